@@ -11,19 +11,71 @@ See the sample below which demonstrates simple HTTP Application.
 
 .. literalinclude:: ../demo/helloworld.py
 """
+import json
+import time
 import asyncio
+import inspect
 import logging
+import functools
 from webob.exc import HTTPError
 from aqua.router import TraversalRouter
-from aqua.http import logger, Connection, Request, Response, logger
+from aqua.static import StaticFiles, FileCache
+from aqua.metrics import Metrics
+from aqua.cache import ResponseCache
+from aqua.compress import accepted_encoding, compressible, compress, CompressedBody
+from aqua.executor import HandlerExecutor, PROCESS_POOL, pickle_request, call_handler
+from aqua.http import logger, Connection, Request, Response, TimerWheel, FileWrapper, HOOKS, logger
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+_json_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+
+def json_dumps(value):
+    """ Serializes value to compact JSON as UTF-8 encoded bytes. It uses
+    :mod:`orjson` or :mod:`ujson` if one of them is installed otherwise :mod:`json`.
+    Values which they can't serialize (like integers wider than 64 bits) are
+    serialized by :mod:`json`.
+    """
+    try:
+        if orjson is not None:
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+        elif ujson is not None:
+            return ujson.dumps(value).encode('UTF-8')
+    except (TypeError, OverflowError):
+        pass
+    return _json_encode(value).encode('UTF-8')
 
 
 def handler(route, method='GET', **options):
     """ Decorator marks method to use as request handler.
     
-    :param route: Route description.
+    :param route: Route description, see :class:`aqua.router.TraversalRouter`.
     :param method: Request method or list of methods.
-    :param options: Additional keyword options.
+    :param options: Additional keyword options:
+    
+        * `name` -- View name used by :meth:`BaseApplication.url_for`, by default it's name of method.
+        * `stream_body` -- If True request body isn't accumulated in memory,
+          handler reads it by chunks from :attr:`aqua.http.Request.body_stream`
+          (see :class:`aqua.http.BodyStream`).
+        * `json` -- If True any value returned by handler (except responses) is serialized to JSON,
+          by default only dictionaries and lists are.
+        * `cache_ttl` -- Time in seconds while successful response to `GET` request is kept
+          in :attr:`BaseApplication.response_cache` and served without calling handler,
+          see :mod:`aqua.cache`.
+        * `vary` -- Names of request headers which cached response depends on,
+          they are added to `Vary` header of response.
+        * `executor` -- 'thread' or 'process' if handler which is plain function is called
+          in pool of threads or processes instead of event loop, None if it's called on event loop.
+          By default it's :attr:`BaseApplication.executor`. Process pool requires Python 3.7
+          or later. See :mod:`aqua.executor`.
     """    
     def wrapper(view):
         if not hasattr(view, '_routes'):
@@ -37,6 +89,33 @@ def handler(route, method='GET', **options):
     return wrapper
 
 
+@asyncio.coroutine
+def metrics_handler(app, request):
+    """ Handler which serves metrics of application in Prometheus text format,
+    see :attr:`BaseApplication.metrics_route`. """
+    return Response(app.metrics.prometheus(), content_type='text/plain; version=0.0.4')
+
+
+def executor_view(view, executor):
+    """ Returns handler which calls plain function `view` by `executor`,
+    see :meth:`BaseApplication.run_handler`. """
+    def wrapper(app, request, **kwargs):
+        return app.run_handler(request, view, executor, kwargs)
+    return wrapper
+
+
+def add_vary(headers, names):
+    """ Returns headers with `Vary` header which lists given names of request headers. """
+    listed = ','.join(value for name, value in headers if name.lower()=='vary').lower()
+    missed = [name for name in names if name.lower() not in listed]
+    return headers+[('Vary', ', '.join(missed))] if missed else headers
+
+
+def etag_with_encoding(etag, encoding):
+    """ Returns ETag of encoded representation, for example '"abc-gzip"' for '"abc"'. """
+    return etag[:-1]+'-'+encoding+'"' if etag.endswith('"') else etag
+
+
 class BaseApplication(object):
     """ Base application class
     
@@ -45,16 +124,48 @@ class BaseApplication(object):
     """
     
     router_class = TraversalRouter #: Default router class
+    route_cache_size = 1024    #: Max number of resolved routes kept in cache of router, 0 disables cache.
+    static_cache_size = 1024   #: Max number of opened static files kept in cache, 0 disables cache.
+    static_cache_ttl = 5.0     #: Time in seconds while static file is served from cache without checking.
+    response_cache_size = 1024 #: Max number of responses of handlers with option `cache_ttl` kept in cache.
+    #: Min size of response body which is compressed, None disables compression, see :mod:`aqua.compress`.
+    compress_min_size = None
+    compress_level = 6         #: Level of compression from 1 to 9.
+    compress_thread_size = 256*1024  #: Min size of body which is compressed in thread pool.
+    #: Default executor of handlers which are plain functions: 'thread', 'process' or None
+    #: if they are called on event loop, see :mod:`aqua.executor`.
+    executor = None
+    executor_workers = None    #: Number of workers of every pool, by default see :class:`aqua.executor.HandlerExecutor`.
+    executor_queue_size = None #: Max number of calls which wait for free worker, further requests get 503 response.
+    max_requests = None        #: Max number of requests handled at the same time, others get 503 response.
+    retry_after = 1            #: Value of `Retry-After` header of 503 response.
+    collect_metrics = False    #: If True stats of requests are collected to :attr:`metrics`.
+    #: Route which serves collected metrics in Prometheus text format, for example '/metrics'.
+    #: If it's set metrics are collected even if :attr:`collect_metrics` is False.
+    metrics_route = None
+    #: Function serializes values returned by handlers to JSON bytes, see :func:`json_dumps`.
+    json_dumps = staticmethod(json_dumps)
     
     def __init__(self, loop, script_name):
         self.loop = loop
-        self._router = self.router_class()
+        self._active_requests = 0
+        self.file_cache = None #: Instance of :class:`aqua.static.FileCache` shared by all static routes.
+        #: Instance of :class:`aqua.metrics.Metrics` or None if metrics aren't collected.
+        self.metrics = Metrics() if self.collect_metrics or self.metrics_route else None
+        self.hooks = dict()    #: Lists of hooks by their names, see :meth:`add_hook`.
+        #: Instances of :class:`aqua.executor.HandlerExecutor` by kinds, they are created on first call.
+        self.executors = dict()
+        #: Instance of :class:`aqua.cache.ResponseCache`, it's created if some handler has option `cache_ttl`.
+        self.response_cache = None
+        self._router = self.router_class(cache_size=self.route_cache_size)
         self.route = lambda *args, **kwargs : self._router.route(*args, **kwargs)
         self.url_for = lambda *args, **kwargs : self._router.url_for(*args, **kwargs)
         self.add_route = lambda *args, **kwargs : self._router.add_route(*args, **kwargs)
         
         self._script_name = script_name or '/'
         self._make_routes()
+        if self.metrics_route is not None:
+            self.add_route(self.metrics_route, 'GET', metrics_handler, name='metrics')
 
     def _make_routes(self):
         cls = self.__class__
@@ -62,9 +173,96 @@ class BaseApplication(object):
         for name, value in cls.__dict__.items():
             if hasattr(value, '_routes'):
                 for route, method, options in value._routes:
-                    if not asyncio.iscoroutinefunction(value):
-                        value = asyncio.coroutine(value)
-                    self.add_route(route, method, value, **options)
+                    if options.get('cache_ttl') and self.response_cache is None:
+                        self.response_cache = ResponseCache(self.response_cache_size)
+                    executor = options.get('executor', self.executor)
+                    if asyncio.iscoroutinefunction(value) or inspect.isgeneratorfunction(value):
+                        if options.get('executor'):
+                            raise ValueError("Coroutine '{0}' cannot be called by executor.".format(name))
+                        view = asyncio.coroutine(value)
+                    elif executor is not None:
+                        if executor not in ('thread', 'process'):
+                            raise ValueError("Unknown executor '{0}' of handler '{1}'.".format(executor, name))
+                        if executor=='process' and not PROCESS_POOL:
+                            raise ValueError("Handler '{0}' cannot be called by process executor, "
+                                             "it requires Python 3.7 or later.".format(name))
+                        view = executor_view(value, executor)
+                    else:
+                        view = asyncio.coroutine(value)
+                    # endpoint keeps options of route for `request_router`
+                    endpoint = functools.partial(view)
+                    endpoint.__name__ = value.__name__
+                    endpoint.options = options
+                    self.add_route(route, method, endpoint, **options)
+
+    @asyncio.coroutine
+    def run_handler(self, request, view, executor, kwargs):
+        """ Calls handler which is plain function by executor, see :mod:`aqua.executor`.
+        
+        :param request: Instance of :class:`aqua.http.Request`.
+        :param view: Handler.
+        :param executor: 'thread' or 'process'.
+        :param kwargs: Dict of urlvars of request.
+        """
+        pool = self.executors.get(executor)
+        if pool is None:
+            pool = self.executors[executor] = HandlerExecutor(executor, self.executor_workers,
+                                                              self.executor_queue_size, self.retry_after)
+            if self.metrics is not None:
+                self.metrics.add_gauge('executor_queue_depth', 'Number of calls which wait for free worker.',
+                                       [('executor', executor)], lambda: pool.queue_depth)
+                self.metrics.add_gauge('executor_pending', 'Number of calls which are running or wait.',
+                                       [('executor', executor)], lambda: pool.pending)
+        if not request.environ.get('aqua.complete', True) and 'aqua.stream' not in request.environ:
+            yield from request.finish_reading()
+        if executor=='process':
+            environ, body = pickle_request(request)
+            return (yield from pool.run(self.loop, call_handler, view.__module__, view.__qualname__,
+                                        environ, body, kwargs))
+        return (yield from pool.run(self.loop, functools.partial(view, self, request, **kwargs)))
+
+    def add_hook(self, name, hook):
+        """ Adds hook which is called on stage of handling of requests,
+        see :meth:`aqua.http.Connection.call_hooks` for names and arguments of hooks.
+        Hooks are plain functions, they are called in order of adding.
+        
+        :param name: Name of hook, one of :data:`aqua.http.HOOKS`.
+        :param hook: Function which is called.
+        :rtype: Given hook.
+        """
+        if name not in HOOKS:
+            raise ValueError("Unknown hook '{0}'.".format(name))
+        self.hooks.setdefault(name, list()).append(hook)
+        return hook
+
+    def remove_hook(self, name, hook):
+        """ Removes hook added by :meth:`add_hook`. """
+        hooks = self.hooks.get(name, [])
+        if hook in hooks:
+            hooks.remove(hook)
+            if not hooks:
+                del self.hooks[name]
+
+    def add_static(self, route, path, name='static', precompressed=False):
+        """ Adds route which serves static files from directory.
+        Opened files are kept in :attr:`file_cache` shared by all static routes.
+        See :class:`aqua.static.StaticFiles` for more info.
+        
+        :param route: Route prefix, file name is appended to it as last part of path.
+        :param path: Directory which files are served from.
+        :param name: View name.
+        :param precompressed: If True `.br` and `.gz` siblings of files are served
+            to clients which accept their encodings.
+        """
+        if self.file_cache is None and self.static_cache_size>0:
+            self.file_cache = FileCache(self.static_cache_size, self.static_cache_ttl)
+        files = StaticFiles(path, self.file_cache, precompressed)
+        @asyncio.coroutine
+        def static(app, request, filename):
+            return files(request, filename)
+        route = route.rstrip('/') + '/:filename'
+        self.add_route(route, 'GET', static, name=name)
+        self.add_route(route, 'HEAD', static, name=name)
 
     @asyncio.coroutine
     def request_router(self, connection, environ):
@@ -74,28 +272,143 @@ class BaseApplication(object):
         :param connection: Instanse of :class:`aqua.http.Connection`
         :rtype: Tuple or list of three items. See parameters of :meth:`aqua.http.Connection.response` for more info.
         """
+        if self.max_requests is not None and self._active_requests>=self.max_requests:
+            self.service_unavailable(connection, environ)
+            return
+        self._active_requests += 1
+        cache_key = None
         try:
-            request = Request(environ)
-            view, kwargs = self.route(request.path_info, request.method)
-            result = yield from view(self, request, **kwargs)
-        except HTTPError as exc:
-            result = exc
-        if not isinstance(result, Response):
-            response = Response()
-            if isinstance(result, str):
-                response.text = result
+            as_json = False
+            stats = environ.get('aqua.stats')
+            try:
+                request = Request(environ)
+                if stats is not None:
+                    started = time.perf_counter()
+                view, kwargs = self.route(request.path_info, request.method)
+                options = getattr(view, 'options', None)
+                if stats is not None:
+                    stats.route = options.get('name', view.__name__) if options else view.__name__
+                    stats.route_time = time.perf_counter()-started
+                if self.hooks:
+                    connection.call_hooks('after_route', connection, request, view, kwargs)
+                if options and options.get('cache_ttl') and self.response_cache is not None \
+                        and environ['REQUEST_METHOD']=='GET' and environ['SERVER_PROTOCOL']=='HTTP/1.1':
+                    vary = options.get('vary', ())
+                    if self.compress_min_size is not None:
+                        vary = tuple(vary)+('Accept-Encoding',)
+                    cache_key = self.response_cache.key(environ, vary)
+                    entry, leader = yield from self.response_cache.acquire(cache_key, self.loop)
+                    if entry is not None:
+                        connection.serialized_response(*entry)
+                        return
+                    elif not leader:
+                        cache_key = None
+                if options and options.get('stream_body'):
+                    connection.body_stream(environ)
+                if self.hooks:
+                    connection.call_hooks('before_handler', connection, request, view, kwargs)
+                if stats is not None:
+                    started = time.perf_counter()
+                    try:
+                        result = yield from view(self, request, **kwargs)
+                    finally:
+                        stats.handler_time = time.perf_counter()-started
+                else:
+                    result = yield from view(self, request, **kwargs)
+                as_json = options and options.get('json')
+            except HTTPError as exc:
+                result = exc
+            if isinstance(result, Response):
+                status, headers, app_iter = result.status, result.headerlist, result.app_iter
+            elif isinstance(result, (dict, list)) or as_json:
+                # JSON is written without response object
+                body = self.json_dumps(result)
+                status, headers, app_iter = '200 OK', [('Content-Type', 'application/json; charset=UTF-8'),
+                                                       ('Content-Length', str(len(body)))], [body]
+            elif isinstance(result, str):
+                response = Response(result)
+                status, headers, app_iter = response.status, response.headerlist, response.app_iter
             elif isinstance(result, bytes):
-                if response.content_type=='text/html':
-                    response.content_type = 'application/octet-stream'
-                response.body = result
-            elif isinstance(result, dict):
-                response.content_type = 'application/json'
-                response.json = result
+                response = Response(result, content_type='application/octet-stream')
+                status, headers, app_iter = response.status, response.headerlist, response.app_iter
+            elif hasattr(result, '__anext__'):
+                response = Response(app_iter=result)
+                status, headers, app_iter = response.status, response.headerlist, response.app_iter
             else:
-                response = result
-        else:
-            response = result
-        connection.response(*request.call_application(response))
+                # WSGI application e.g. webob response or HTTP exception
+                status, headers, app_iter = request.webob.call_application(result)
+            if self.compress_min_size is not None and environ['REQUEST_METHOD']!='HEAD':
+                status, headers, app_iter = yield from self.compress_response(environ, status, headers, app_iter)
+            if cache_key is not None:
+                headers = self.cache_response(cache_key, view, status, headers, app_iter)
+            connection.response(status, headers, app_iter)
+        finally:
+            self._active_requests -= 1
+            if cache_key is not None:
+                self.response_cache.release(cache_key)
+
+    def cache_response(self, key, view, status, headers, app_iter):
+        """ Adds successful response which body is list to :attr:`response_cache`.
+        
+        :param key: Key of response, see :meth:`aqua.cache.ResponseCache.key`.
+        :param view: Request handler which has option `cache_ttl`.
+        :rtype: Headers of response, `Vary` header is added to them if handler has option `vary`.
+        """
+        options = view.options
+        if options.get('vary'):
+            headers = add_vary(headers, options['vary'])
+        if status[:3]=='200' and isinstance(app_iter, list):
+            self.response_cache.put(key, options['cache_ttl'], status, headers, b''.join(app_iter),
+                                    options.get('name', view.__name__))
+        return headers
+
+    @asyncio.coroutine
+    def compress_response(self, environ, status, headers, app_iter):
+        """ Compresses successful response if its content type is compressible and
+        client accepts one of supported encodings, see :mod:`aqua.compress`.
+        
+        :param environ: Request environ variables.
+        :rtype: Tuple of status, headers and body iterator of response.
+        """
+        content_type = None
+        for name, value in headers:
+            name = name.lower()
+            if name=='content-type':
+                content_type = value
+            elif name=='content-encoding' or name=='cache-control' and 'no-transform' in value:
+                return status, headers, app_iter
+        if status[:3]!='200' or content_type is None or not compressible(content_type) \
+                or isinstance(app_iter, FileWrapper):
+            return status, headers, app_iter
+        if isinstance(app_iter, (list, tuple)):
+            size = sum(map(len, app_iter))
+            if size<self.compress_min_size:
+                return status, headers, app_iter
+        headers = add_vary(headers, ('Accept-Encoding',))
+        encoding = accepted_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return status, headers, app_iter
+        headers = [(name, etag_with_encoding(value, encoding) if name.lower()=='etag' else value)
+                   for name, value in headers if name.lower()!='content-length']
+        headers.append(('Content-Encoding', encoding))
+        if isinstance(app_iter, (list, tuple)):
+            body = b''.join(app_iter)
+            if size>=self.compress_thread_size:
+                body = yield from self.loop.run_in_executor(None, compress, body, encoding, self.compress_level)
+            else:
+                body = compress(body, encoding, self.compress_level)
+            headers.append(('Content-Length', str(len(body))))
+            return status, headers, [body]
+        return status, headers, CompressedBody(app_iter, encoding, self.compress_level)
+
+    def service_unavailable(self, connection, environ):
+        """ Responds '503 Service Unavailable' without routing when server is overloaded.
+        
+        :param connection: Instanse of :class:`aqua.http.Connection`
+        :param environ: Request environ variables.
+        """
+        connection.response('503 Service Unavailable', [('Retry-After', str(self.retry_after)),
+                                                        ('Content-Length', '0')], [])
 
 
 class Application(BaseApplication):
@@ -105,11 +418,23 @@ class Application(BaseApplication):
         If not set default event loop instance will be used.
     :server_name: SERVER_NAME request environ variable if None value from connection
     :server_port: SERVER_PORT request environ variable if None value from connection
+    
+    Application keeps live connections, :meth:`shutdown` uses them to stop
+    server without breaking of requests.
     """
+    
+    max_connections = None  #: Max number of connections, requests from other connections get 503 response.
+    timer_resolution = 0.1  #: Resolution of :class:`aqua.http.TimerWheel` of connection timeouts, 0 disables it.
+    
     def __init__(self, loop=None, server_name=None, server_port=None):
         self.loop = loop or asyncio.get_event_loop()
-        BaseApplication.__init__(self, loop, '/')
+        BaseApplication.__init__(self, self.loop, '/')
         self._app_environ = dict()
+        self._connections = set()
+        self._servers = list()
+        self._drained = None
+        #: Instance of :class:`aqua.http.TimerWheel` shared by connections.
+        self.timer = TimerWheel(self.loop, self.timer_resolution) if self.timer_resolution>0 else None
         if server_name is not None:
             self._app_environ['SERVER_NAME'] = server_name
         if server_name is not None:
@@ -117,10 +442,63 @@ class Application(BaseApplication):
 
     def __call__(self):
         connection = Connection(self.loop)
-        connection.request_handler = self.request_router
+        if self.max_connections is not None and len(self._connections)>=self.max_connections:
+            connection.request_handler = self.service_unavailable
+        else:
+            connection.request_handler = self.request_router
+        connection.close_handler = self.close_handler
+        connection.timer = self.timer
+        connection.metrics = self.metrics
+        connection.hooks = self.hooks
+        connection.response_cache = self.response_cache
         connection.default_environ.update(self._app_environ)
+        self._connections.add(connection)
         return connection
 
+    def close_handler(self, connection):
+        """ Called when connection is lost.
+        
+        :param connection: Instance of :class:`aqua.http.Connection`
+        """
+        self._connections.discard(connection)
+        if self._drained is not None and not self._connections and not self._drained.done():
+            self._drained.set_result(None)
+
+    @asyncio.coroutine
+    def create_server(self, *args, **kwargs):
+        """ Creates server by :meth:`asyncio.BaseEventLoop.create_server` with
+        this application as protocol factory, server is closed by :meth:`shutdown`.
+        """
+        server = yield from self.loop.create_server(self, *args, **kwargs)
+        self._servers.append(server)
+        return server
+
+    @asyncio.coroutine
+    def shutdown(self, timeout=None):
+        """ Stops servers created by :meth:`create_server`, closes idle connections
+        at once and waits while responses to active requests are written, then
+        their connections are closed. Connections which aren't closed within
+        `timeout` are aborted.
+        
+        :param timeout: Time in seconds or None to wait without limit.
+        """
+        for server in self._servers:
+            server.close()
+        self._servers = list()
+        if self._connections:
+            self._drained = asyncio.Future(loop=self.loop)
+            for connection in list(self._connections):
+                connection.close()
+            try:
+                yield from asyncio.wait_for(asyncio.shield(self._drained), timeout, loop=self.loop)
+            except asyncio.TimeoutError:
+                for connection in list(self._connections):
+                    connection.abort()
+            finally:
+                self._drained = None
+        for executor in self.executors.values():
+            executor.shutdown(False)
+
     def sub_application(self, script_name, application_class):
         """ Binds sub application
         
@@ -129,4 +507,6 @@ class Application(BaseApplication):
         """
         assert issubclass(application_class, BaseApplication)
         app = application_class(self.loop, script_name)
-        self._router.update(script_name, app._router)
\ No newline at end of file
+        self._router.update(script_name, app._router)
+        if app.response_cache is not None and self.response_cache is None:
+            self.response_cache = ResponseCache(self.response_cache_size)
\ No newline at end of file
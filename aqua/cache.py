@@ -0,0 +1,157 @@
+"""
+aqua.cache -- Response cache
+============================
+
+This module provides the cache of responses of handlers which have option
+`cache_ttl` (see :func:`aqua.app.handler`). Successful responses to `GET`
+requests are kept serialized, so :class:`aqua.http.Connection` writes cached
+response by one call of ``transport.write`` without routing and calling handler.
+
+Responses are cached by path, query string and values of request headers
+listed in option `vary` of handler. Concurrent requests which miss the same
+key wait for the first of them, so handler is called once per key.
+"""
+import time
+import asyncio
+from collections import OrderedDict
+from aqua.http import encode_status, encode_header_name
+
+
+def serialize(status, headers, body):
+    """ Returns head of response as it's written by :class:`aqua.http.Connection`
+    for `HTTP/1.1` request, but without terminating empty line. `Content-Length`
+    header is added if it's missed.
+
+    :param status: HTTP status string like '200 OK'
+    :param headers: List of response headers represented as tuple (name, value)
+    :param body: Body of response as bytes.
+    """
+    parts = [encode_status('HTTP/1.1', status)]
+    length = False
+    for name, value in headers:
+        if name.lower()=='content-length':
+            length = True
+        parts.append(encode_header_name(name))
+        parts.append(str(value).encode('ISO-8859-1'))
+        parts.append(b'\r\n')
+    if not length:
+        parts.append(b'Content-Length: ' + str(len(body)).encode('ISO-8859-1') + b'\r\n')
+    return b''.join(parts)
+
+
+class ResponseCache(object):
+    """ LRU cache of serialized responses with expiration time of entries.
+    Entry is tuple of head of response (see :func:`serialize`), body and view name.
+
+    :param max_entries: Max number of cached responses.
+    :param max_size: Max size of body of cached response.
+    :param timer: Function returns current time in seconds.
+    """
+
+    def __init__(self, max_entries=1024, max_size=1024*1024, timer=time.monotonic):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.timer = timer
+        self.hits = 0    #: Number of responses found in cache.
+        self.misses = 0  #: Number of responses not found in cache.
+        self._entries = OrderedDict()  # key -> (expiration time, entry)
+        self._vary = dict()            # (path, query) -> names of environ variables of varying headers
+        self._pending = dict()         # key -> future of request which makes response
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, environ, vary=()):
+        """ Returns key of response to request.
+
+        :param environ: Request environ variables.
+        :param vary: Names of request headers which response depends on.
+        """
+        path = (environ.get('PATH_INFO'), environ.get('QUERY_STRING'))
+        names = self._vary.get(path)
+        if names is None:
+            if len(self._vary)>=4*self.max_entries:
+                self._vary.clear()
+            names = self._vary[path] = tuple('HTTP_'+name.upper().replace('-', '_') for name in vary)
+        return path+tuple(environ.get(name) for name in names)
+
+    def lookup(self, environ):
+        """ Returns cached entry of response to request or None.
+        Only `GET` requests of `HTTP/1.1` are looked up.
+
+        :param environ: Request environ variables.
+        """
+        if environ.get('REQUEST_METHOD')!='GET' or environ.get('SERVER_PROTOCOL')!='HTTP/1.1':
+            return None
+        path = (environ.get('PATH_INFO'), environ.get('QUERY_STRING'))
+        names = self._vary.get(path)
+        if names is None:
+            return None
+        key = path+tuple(environ.get(name) for name in names)
+        item = self._entries.get(key)
+        if item is None or item[0]<=self.timer():
+            # expired entry is removed by :meth:`get` when request is routed
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def get(self, key):
+        """ Returns cached entry by key or None if it's missed or expired. """
+        item = self._entries.get(key)
+        if item is not None:
+            if item[0]>self.timer():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, ttl, status, headers, body, name=None):
+        """ Adds response to cache. Response isn't cached if its body is larger
+        than :attr:`max_size` or it sets cookies.
+
+        :param key: Key returned by :meth:`key`.
+        :param ttl: Time in seconds while response is kept.
+        :param status: HTTP status string like '200 OK'
+        :param headers: List of response headers represented as tuple (name, value)
+        :param body: Body of response as bytes.
+        :param name: View name.
+        :rtype: True if response is cached.
+        """
+        if len(body)>self.max_size or any(header.lower()=='set-cookie' for header, value in headers):
+            return False
+        self._entries[key] = (self.timer()+ttl, (serialize(status, headers, body), body, name))
+        self._entries.move_to_end(key)
+        while len(self._entries)>self.max_entries:
+            self._entries.popitem(last=False)
+        return True
+
+    @asyncio.coroutine
+    def acquire(self, key, loop):
+        """ Returns tuple of cached entry (None if it's missed) and flag which is True
+        if caller makes response, then it must call :meth:`release` when response is made.
+        If other request is making response with the same key, it waits for it and
+        returns its response if it's cached.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            return entry, False
+        waiter = self._pending.get(key)
+        if waiter is None:
+            self._pending[key] = asyncio.Future(loop=loop)
+            return None, True
+        yield from asyncio.shield(waiter)
+        return self.get(key), False
+
+    def release(self, key):
+        """ Wakes up requests which wait for response with key, see :meth:`acquire`. """
+        waiter = self._pending.pop(key, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def clear(self):
+        """ Removes all cached responses. """
+        self._entries.clear()
+        self._vary.clear()
@@ -0,0 +1,147 @@
+"""
+aqua.compress -- Response compression
+=====================================
+
+This module provides compression of response bodies by encoding negotiated
+with `Accept-Encoding` request header. `gzip` is always available, `br` is
+available if :mod:`brotli` is installed. Compression is enabled by
+:attr:`aqua.app.BaseApplication.compress_min_size`:
+
+* Body which size is known and less than the threshold isn't compressed.
+* Body which size is known is compressed at once, large body is compressed
+  in thread pool (see :attr:`aqua.app.BaseApplication.compress_thread_size`),
+  so event loop isn't blocked.
+* Body which size is unknown (iterator or asynchronous iterator) is compressed
+  chunk by chunk by :class:`CompressedBody`, chunks aren't buffered.
+
+Static files are not compressed by application, see `precompressed` option
+of :class:`aqua.static.StaticFiles` which serves `.br` and `.gz` siblings of files.
+"""
+import zlib
+import asyncio
+from aqua.http import StopAsyncIteration
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#: Supported encodings in order of preference.
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+#: Content types which are compressed besides `text/*`.
+COMPRESSIBLE_TYPES = frozenset([
+    'application/json', 'application/javascript', 'application/xml', 'application/xhtml+xml',
+    'application/rss+xml', 'application/atom+xml', 'application/manifest+json',
+    'image/svg+xml', 'font/ttf', 'font/otf'])
+
+
+def accepted_encoding(value, encodings=ENCODINGS):
+    """ Returns encoding preferred by client or None if none of encodings is acceptable.
+
+    :param value: Value of `Accept-Encoding` header.
+    :param encodings: Available encodings in order of preference.
+    """
+    best, best_q = None, 0.0
+    wildcard = None
+    listed = set()  # wildcard matches only encodings which aren't listed
+    for item in value.split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params[:2]=='q=':
+            try:
+                q = float(params[2:])
+            except ValueError:
+                continue
+        if name=='*':
+            wildcard = q
+            continue
+        listed.add(name)
+        if name in encodings and (q>best_q or q==best_q and best is not None
+                                    and encodings.index(name)<encodings.index(best)):
+            best, best_q = name, q
+    if best is None and wildcard:
+        for name in encodings:
+            if name not in listed:
+                return name
+    return best
+
+
+def compressible(content_type):
+    """ Returns True if body of given content type is worth compressing. """
+    content_type = content_type.partition(';')[0].strip().lower()
+    return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+
+class Compressor(object):
+    """ Incremental compressor.
+
+    :param encoding: 'gzip' or 'br'.
+    :param level: Compression level from 1 to 9, it's scaled to quality of brotli.
+    """
+
+    def __init__(self, encoding, level=6):
+        if encoding=='gzip':
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+            self.compress = compressor.compress
+            self.flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.finish = compressor.flush
+        elif encoding=='br' and brotli is not None:
+            compressor = brotli.Compressor(quality=min(level*11//9, 11))
+            self.compress = compressor.process
+            self.flush = compressor.flush
+            self.finish = compressor.finish
+        else:
+            raise ValueError("Unsupported encoding '{0}'.".format(encoding))
+
+
+def compress(data, encoding, level=6):
+    """ Returns compressed data. """
+    compressor = Compressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+
+class CompressedBody(object):
+    """ Asynchronous iterator over compressed chunks of body. Every chunk of
+    body is compressed and flushed, so streamed body isn't delayed.
+
+    :param app_iter: Iterable or asynchronous iterable over chunks of body.
+    :param encoding: 'gzip' or 'br'.
+    :param level: Compression level.
+    """
+
+    def __init__(self, app_iter, encoding, level=6):
+        self._app_iter = app_iter
+        self._iter = None if hasattr(app_iter, '__anext__') else iter(app_iter)
+        self._compressor = Compressor(encoding, level)
+        self._finished = False
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        while not self._finished:
+            try:
+                if self._iter is None:
+                    data = yield from self._app_iter.__anext__()
+                else:
+                    data = next(self._iter)
+            except (StopIteration, StopAsyncIteration):
+                self._finished = True
+                return self._compressor.finish()
+            if data:
+                data = self._compressor.compress(data) + self._compressor.flush()
+                if data:
+                    return data
+        raise StopAsyncIteration
+
+    @asyncio.coroutine
+    def aclose(self):
+        """ Closes iterator of body. """
+        if hasattr(self._app_iter, 'aclose'):
+            yield from self._app_iter.aclose()
+        elif hasattr(self._app_iter, 'close'):
+            self._app_iter.close()
@@ -0,0 +1,127 @@
+"""
+aqua.executor -- Executors of handlers
+======================================
+
+This module provides pools which run handlers that are plain functions (not
+coroutines) outside of event loop, so blocking I/O or CPU work of one handler
+doesn't delay other connections. Pool is chosen by `executor` option of
+:func:`aqua.app.handler` or by :attr:`aqua.app.BaseApplication.executor`:
+
+* `thread` -- Handler is called in thread pool with the same arguments as on
+  event loop. Handler must not use event loop and shared state without locks.
+* `process` -- Handler is called in process pool, so CPU work isn't limited by GIL.
+  Handler is looked up in worker process by its module and qualified name, so
+  it must be defined at module level or in class at module level. It gets None
+  instead of instance of application, its urlvars and result must be picklable.
+  Request in worker process is rebuilt from its text environ variables and body.
+  Workers are spawned, so module of handler is imported in every worker.
+  Process pool requires Python 3.7 or later, see :data:`PROCESS_POOL`.
+
+Request body is completely read before handler is passed to pool. Number of
+calls which wait for free worker is limited by :attr:`HandlerExecutor.max_queue`,
+further requests get '503 Service Unavailable' response.
+"""
+import io
+import os
+import sys
+import time
+import asyncio
+import importlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from webob.exc import HTTPServiceUnavailable
+from aqua.http import Request
+from aqua.metrics import Histogram
+
+#: True if handlers can be called by process pool. Spawned workers are required
+#: (forked ones would keep sockets of server open), they are supported since Python 3.7.
+PROCESS_POOL = sys.version_info>=(3, 7)
+
+
+class HandlerExecutor(object):
+    """ Bounded pool of threads or processes which tracks depth of its queue.
+
+    :param kind: 'thread' or 'process'.
+    :param max_workers: Number of workers, by default 8 threads or number of CPUs processes.
+    :param max_queue: Max number of calls which wait for free worker, None if it isn't limited.
+    :param retry_after: Value of `Retry-After` header of 503 response when queue is full.
+    """
+
+    def __init__(self, kind='thread', max_workers=None, max_queue=None, retry_after=1):
+        if kind=='thread':
+            self.max_workers = max_workers or 8
+            self.pool = ThreadPoolExecutor(self.max_workers)
+        elif kind=='process':
+            if not PROCESS_POOL:
+                raise ValueError('Process executor requires Python 3.7 or later.')
+            self.max_workers = max_workers or os.cpu_count() or 1
+            self.pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            raise ValueError("Unknown kind of executor '{0}'.".format(kind))
+        self.kind = kind
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.pending = 0         #: Number of calls which are running or waiting for worker.
+        self.max_queue_depth = 0 #: Max depth of queue since start.
+        self.completed = 0       #: Number of calls completed without exception.
+        self.rejected = 0        #: Number of calls rejected because queue is full.
+        self.time = Histogram()  #: Histogram of time of calls including waiting in queue.
+
+    @property
+    def queue_depth(self):
+        """ Number of calls which wait for free worker. """
+        return max(self.pending-self.max_workers, 0)
+
+    @asyncio.coroutine
+    def run(self, loop, func, *args):
+        """ Calls function in pool and returns its result.
+
+        :param loop: :mod:`asyncio` event loop instance to use.
+        :raises webob.exc.HTTPServiceUnavailable: If queue is full.
+        """
+        if self.max_queue is not None and self.pending>=self.max_workers+self.max_queue:
+            self.rejected += 1
+            raise HTTPServiceUnavailable(headers=[('Retry-After', str(self.retry_after))])
+        self.pending += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        started = time.perf_counter()
+        try:
+            result = yield from loop.run_in_executor(self.pool, func, *args)
+            self.completed += 1
+            return result
+        finally:
+            self.pending -= 1
+            self.time.record(time.perf_counter()-started)
+
+    def stats(self):
+        """ Returns dictionary with state of pool. """
+        return dict(kind=self.kind, workers=self.max_workers, pending=self.pending,
+                    queue_depth=self.queue_depth, max_queue_depth=self.max_queue_depth,
+                    completed=self.completed, rejected=self.rejected, time=self.time.summary())
+
+    def shutdown(self, wait=True):
+        """ Stops workers of pool. """
+        self.pool.shutdown(wait)
+
+
+def pickle_request(request):
+    """ Returns text environ variables and body of request which can be passed to other process. """
+    environ = {name: value for name, value in request.environ.items() if isinstance(value, str)}
+    return environ, request.body
+
+
+def call_handler(module, qualname, environ, body, kwargs):
+    """ Calls handler in worker process of process pool.
+
+    :param module: Name of module of handler.
+    :param qualname: Qualified name of handler in module.
+    :param environ: Text environ variables of request.
+    :param body: Body of request.
+    :param kwargs: Urlvars of request.
+    """
+    view = importlib.import_module(module)
+    for name in qualname.split('.'):
+        view = getattr(view, name)
+    environ['wsgi.input'] = io.BytesIO(body)
+    environ['aqua.complete'] = True
+    return view(None, Request(environ), **kwargs)
@@ -15,17 +15,46 @@ Also it contains other classes and utility functions which help to builds async
 HTTP applications.
 """
 import io
+import os
 import re
 import sys
+import mmap
+import time
+import tempfile
+from collections import deque
+from urllib.parse import parse_qsl
 import webob
 import asyncio
 import logging
-from webob import Response
+from webob.headers import EnvironHeaders, ResponseHeaders
+from webob.multidict import MultiDict
+from aqua.metrics import RequestStats
 
 logger = logging.getLogger('aqua.error')
 
+try:
+    StopAsyncIteration = StopAsyncIteration
+except NameError:  # Python 3.4
+    class StopAsyncIteration(Exception):
+        """ Signals the end of asynchronous iterator. """
+
 _MAX_REQUEST_LINE = 2*1024  # Max size of HTTP request first line
 _MAX_REQUEST_SIZE = 64*1024 # Max size of HTTP request except body
+_MAX_COALESCED_BODY = 16*1024 # Max size of response body written with headers by one call
+
+# States of decoding request body in chunked transfer coding
+_CHUNK_SIZE, _CHUNK_DATA, _CHUNK_END, _CHUNK_TRAILER = range(4)
+
+#: Content types besides `text/*` which charset is added to, like :mod:`webob` does.
+_CHARSET_TYPES = frozenset(['application/json', 'application/javascript', 'application/xml',
+                            'application/x-www-form-urlencoded'])
+
+#: Names of hooks, see :meth:`Connection.call_hooks` and :meth:`aqua.app.BaseApplication.add_hook`.
+HOOKS = ('before_parse', 'after_route', 'before_handler', 'after_response', 'connection_close')
+
+_status_lines = dict()     # Cache of encoded response status lines
+_header_names = dict()     # Cache of encoded response header names
+_MAX_CACHED_NAMES = 256    # Max size of each cache of names
 
 
 class Error(Exception):
@@ -37,25 +66,430 @@ class Error(Exception):
         Exception.__init__(self, status, headers, app_iter)
 
 
-class Request(webob.Request):
-    """ HTTP request class (based on webob.Request)
+class Request(object):
+    """ HTTP request class. It reads request line, headers, query string and
+    cookies directly from environ when they are accessed. Other attributes of
+    :class:`webob.Request` are available through :attr:`webob` adapter which
+    is created at first access to them.
+    
+    :param environ: Request environ variables.
     """
+    
+    __slots__ = ('environ', '_webob', '_headers', '_GET', '_cookies')
+    
+    def __init__(self, environ):
+        self.environ = environ
+        self._webob = None
+        self._headers = None
+        self._GET = None
+        self._cookies = None
+    
+    @classmethod
+    def blank(cls, path, *args, **kwargs):
+        """ Creates request for path, see :meth:`webob.Request.blank`. """
+        return cls(WebobRequest.blank(path, *args, **kwargs).environ)
+    
+    def __getattr__(self, name):
+        return getattr(self.webob, name)
+    
+    @property
+    def webob(self):
+        """ Instance of :class:`WebobRequest` with the same environ. """
+        if self._webob is None:
+            self._webob = WebobRequest(self.environ)
+        return self._webob
+    
+    @property
+    def method(self):
+        return self.environ.get('REQUEST_METHOD', 'GET')
+    
+    @property
+    def script_name(self):
+        return self.environ.get('SCRIPT_NAME', '').encode('ISO-8859-1').decode('UTF-8', 'surrogateescape')
+    
+    @property
+    def path_info(self):
+        return self.environ.get('PATH_INFO', '').encode('ISO-8859-1').decode('UTF-8', 'surrogateescape')
+    
+    @property
+    def path(self):
+        return self.script_name + self.path_info
+    
+    @property
+    def query_string(self):
+        return self.environ.get('QUERY_STRING', '')
+    
+    @property
+    def content_type(self):
+        """ Content type of body without parameters. """
+        return self.environ.get('CONTENT_TYPE', '').partition(';')[0].strip()
+    
+    @property
+    def content_length(self):
+        value = self.environ.get('CONTENT_LENGTH')
+        return int(value) if value else None
+    
+    @property
+    def headers(self):
+        """ Case-insensitive dictionary of request headers. """
+        if self._headers is None:
+            self._headers = EnvironHeaders(self.environ)
+        return self._headers
+    
+    @property
+    def GET(self):
+        """ Multi-dictionary of query string variables. """
+        if self._GET is None:
+            self._GET = MultiDict(parse_qsl(self.query_string, keep_blank_values=True))
+        return self._GET
+    
+    @property
+    def cookies(self):
+        """ Dictionary of request cookies. """
+        if self._cookies is None:
+            self._cookies = dict()
+            for item in self.environ.get('HTTP_COOKIE', '').split(';'):
+                name, sep, value = item.partition('=')
+                if sep:
+                    self._cookies.setdefault(name.strip(), value.strip().strip('"'))
+        return self._cookies
+    
+    @property
+    def body(self):
+        """ Request body. It's complete only after :meth:`finish_reading`. """
+        stream = self.environ.get('wsgi.input')
+        if stream is None:
+            return b''
+        pos = stream.tell()
+        stream.seek(0)
+        try:
+            return stream.read()
+        finally:
+            stream.seek(pos)
+    
     @asyncio.coroutine
     def finish_reading(self, process_callback=None):
         """ Waits while body be read.
         
         :param process_callback: A callback that accepts two parameters:
-            size of already loaded part of body and full body size.
+            size of already loaded part of body and full body size. It's called
+            at once and then when next chunk of body is received.
         """
+        environ = self.environ
         total = self.content_length
-        while not self.environ['aqua.complete']:
+        if not environ['aqua.complete']:
             if process_callback is not None:
-                size = 0 if 'wsgi.input' not in self.environ else self.environ['wsgi.input'].tell()
+                size = 0 if 'wsgi.input' not in environ else environ['wsgi.input'].tell()
                 process_callback(size, total)
-            yield from asyncio.sleep(0.001)
+                environ['aqua.progress'].append(process_callback)
+            try:
+                yield from asyncio.shield(environ['aqua.waiter'])
+            finally:
+                if process_callback is not None:
+                    environ['aqua.progress'].remove(process_callback)
+            total = self.content_length
         if process_callback is not None:
             process_callback(total, total)
-        return 
+
+    @property
+    def body_stream(self):
+        """ Instance of :class:`BodyStream` if request body is read in streaming mode
+        (see :meth:`Connection.body_stream`) otherwise None. """
+        return self.environ.get('aqua.stream')
+
+
+class WebobRequest(webob.Request):
+    """ HTTP request class based on :class:`webob.Request`, it's used as adapter by
+    :class:`Request` and can be used by applications which need full webob API.
+    """
+    finish_reading = Request.finish_reading
+    body_stream = Request.body_stream
+
+
+class WebobResponse(webob.Response):
+    """ HTTP response class based on :class:`webob.Response`, handlers can return it
+    if they need full webob API, for example ``response.date = datetime.now()``.
+    """
+
+
+def has_charset(content_type):
+    """ Returns True if body of given content type is text which charset is specified. """
+    content_type = content_type.partition(';')[0].strip().lower()
+    return (content_type.startswith('text/') or content_type in _CHARSET_TYPES
+            or content_type.endswith(('+xml', '+json')))
+
+
+class Response(object):
+    """ HTTP response class.
+    
+    :param body: Body of response, string is encoded by `charset`.
+    :param status: Status of response.
+    :param headerlist: List of headers as tuples of name and value.
+    :param app_iter: Iterable or asynchronous iterable over chunks of body, it's used if body isn't given.
+    :param content_type: Value of `Content-Type` header, by default 'text/html'
+        if `headerlist` isn't given, otherwise header isn't added.
+    :param charset: Charset added to textual `Content-Type` header if it's not None.
+    
+    If `body` is given `Content-Length` header is added.
+    
+    Unlike :class:`webob.Response` it has no setters of headers, they are changed
+    through :attr:`headerlist`. Use :class:`WebobResponse` for full webob API.
+    """
+    
+    __slots__ = ('status', 'headerlist', 'app_iter')
+    
+    def __init__(self, body=None, status='200 OK', headerlist=None, app_iter=None,
+                 content_type=None, charset='UTF-8'):
+        self.status = status
+        self.headerlist = list() if headerlist is None else headerlist
+        if headerlist is None or content_type is not None:
+            content_type = content_type or 'text/html'
+            if charset is not None and 'charset=' not in content_type and has_charset(content_type):
+                content_type += '; charset=' + charset
+            self.headerlist.append(('Content-Type', content_type))
+        if body is not None:
+            if isinstance(body, str):
+                body = body.encode(charset or 'UTF-8')
+            self.headerlist.append(('Content-Length', str(len(body))))
+            app_iter = [body]
+        self.app_iter = list() if app_iter is None else app_iter
+    
+    @property
+    def status_code(self):
+        return int(self.status[:3])
+    
+    @property
+    def headers(self):
+        """ Case-insensitive view of :attr:`headerlist`. """
+        return ResponseHeaders.view_list(self.headerlist)
+    
+    @property
+    def content_type(self):
+        """ Content type without parameters. """
+        value = self.headers.get('Content-Type')
+        return value if value is None else value.partition(';')[0].strip()
+    
+    @property
+    def content_length(self):
+        value = self.headers.get('Content-Length')
+        return value if value is None else int(value)
+    
+    @property
+    def body(self):
+        """ Body of response joined from chunks of :attr:`app_iter` if it's a list. """
+        return b''.join(self.app_iter)
+
+
+class BodyStream(object):
+    """ Asynchronous iterator over chunks of request body.
+
+    Received chunks are buffered until they are read. If size of buffered data
+    exceeds :attr:`high_water` reading from transport is paused and resumed when
+    it becomes less then :attr:`low_water`.
+
+    :param transport: Transport of connection.
+    :param loop: :mod:`asyncio` event loop instance to use.
+    """
+
+    high_water = 64*1024  #: Size of buffered data when reading from transport is paused.
+    low_water = 16*1024   #: Size of buffered data when reading from transport is resumed.
+
+    def __init__(self, transport, loop):
+        self._transport = transport
+        self._loop = loop
+        self._chunks = deque()
+        self._size = 0
+        self._eof = False
+        self._paused = False
+        self._discard = False
+        self._waiter = None
+        self._exception = None
+        self.received = 0  #: Size of received part of body.
+
+    def _wakeup(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _resume(self):
+        if self._paused:
+            self._paused = False
+            self._transport.resume_reading()
+
+    def feed(self, data):
+        """ Adds received chunk of body. """
+        self.received += len(data)
+        if self._discard or not data:
+            return
+        self._chunks.append(data)
+        self._size += len(data)
+        self._wakeup()
+        if not self._paused and self._size>self.high_water:
+            self._paused = True
+            self._transport.pause_reading()
+
+    def feed_eof(self):
+        """ Marks that body is completely received. """
+        self._eof = True
+        self._wakeup()
+
+    def set_exception(self, exc):
+        """ Sets exception which will be raised by :meth:`read` when all buffered data is read. """
+        self._exception = exc
+        self._wakeup()
+
+    def discard(self):
+        """ Drops buffered and following chunks of body. """
+        self._discard = True
+        self._chunks.clear()
+        self._size = 0
+        self._resume()
+
+    @asyncio.coroutine
+    def read(self):
+        """ Reads next chunk of body.
+
+        :rtype: Bytes of chunk or empty bytes if body is completely read.
+        """
+        while not self._chunks:
+            if self._exception is not None:
+                raise self._exception
+            if self._eof or self._discard:
+                return b''
+            self._waiter = asyncio.Future(loop=self._loop)
+            try:
+                yield from self._waiter
+            finally:
+                self._waiter = None
+        data = self._chunks.popleft()
+        self._size -= len(data)
+        if self._size<=self.low_water:
+            self._resume()
+        return data
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        data = yield from self.read()
+        if not data:
+            raise StopAsyncIteration
+        return data
+
+
+class TimerWheel(object):
+    """ Coarse timer shared by connections. Deadlines are rounded up to ticks
+    of :attr:`resolution` and kept in dictionary of slots by tick, so setting,
+    changing and cancelling of timeout costs O(1) and doesn't use heap of
+    event loop. Single handle of event loop sweeps expired slots every tick
+    while there are timeouts.
+
+    :param loop: :mod:`asyncio` event loop instance to use.
+    :param resolution: Duration of tick in seconds.
+    """
+
+    def __init__(self, loop, resolution=0.1):
+        self.loop = loop
+        self.resolution = resolution
+        self._slots = dict()     # tick -> {key: callback}
+        self._ticks = dict()     # key -> tick
+        self._swept = 0          # last swept tick
+        self._handle = None
+
+    def __len__(self):
+        return len(self._ticks)
+
+    def schedule(self, key, delay, callback):
+        """ Sets timeout, previous timeout of key is cancelled.
+
+        :param key: Hashable object, for example connection.
+        :param delay: Delay in seconds.
+        :param callback: Function without arguments called when timeout expires.
+        """
+        tick = -int(-(self.loop.time()+delay)//self.resolution)
+        old_tick = self._ticks.get(key)
+        if old_tick is not None:
+            if old_tick==tick:
+                self._slots[tick][key] = callback
+                return
+            self.cancel(key)
+        if self._handle is None:
+            self._swept = int(self.loop.time()//self.resolution)
+            self._handle = self.loop.call_at((self._swept+1)*self.resolution, self._sweep)
+        tick = max(tick, self._swept+1)
+        self._ticks[key] = tick
+        slot = self._slots.get(tick)
+        if slot is None:
+            slot = self._slots[tick] = dict()
+        slot[key] = callback
+
+    def cancel(self, key):
+        """ Cancels timeout of key if it's set. """
+        tick = self._ticks.pop(key, None)
+        if tick is not None:
+            slot = self._slots[tick]
+            del slot[key]
+            if not slot:
+                del self._slots[tick]
+
+    def _sweep(self):
+        current = int(self.loop.time()//self.resolution)
+        while self._swept<current:
+            self._swept += 1
+            slot = self._slots.pop(self._swept, None)
+            if slot:
+                for key in slot:
+                    del self._ticks[key]
+                for callback in slot.values():
+                    try:
+                        callback()
+                    except Exception:
+                        logger.exception('Exception in timeout callback:')
+        if self._ticks:
+            self._handle = self.loop.call_at((self._swept+1)*self.resolution, self._sweep)
+        else:
+            self._handle = None
+
+
+class FileWrapper(object):
+    """ Wrapper of file which is used as response body, it's available
+    as ``environ['wsgi.file_wrapper']``. :class:`Connection` sends the file
+    by :meth:`asyncio.AbstractEventLoop.sendfile` if it's possible,
+    otherwise the file is mapped to memory and written by blocks.
+
+    :param filelike: File object opened in binary mode.
+    :param block_size: Size of block which file is written by.
+    :param offset: Position in file which sending starts from.
+    :param count: Number of bytes to send. If None, file is sent up to the end.
+    """
+
+    def __init__(self, filelike, block_size=64*1024, offset=0, count=None):
+        self.filelike = filelike
+        self.block_size = block_size
+        self.offset = offset
+        self.count = count
+        if count is None:
+            try:
+                self.count = os.fstat(filelike.fileno()).st_size - offset
+            except (AttributeError, OSError, io.UnsupportedOperation):
+                pass
+
+    def __iter__(self):
+        if hasattr(self.filelike, 'seek'):
+            self.filelike.seek(self.offset)
+        left = self.count
+        while left is None or left>0:
+            data = self.filelike.read(self.block_size if left is None else min(left, self.block_size))
+            if not data:
+                break
+            if left is not None:
+                left -= len(data)
+            yield data
+
+    def close(self):
+        """ Closes wrapped file. """
+        if hasattr(self.filelike, 'close'):
+            self.filelike.close()
 
 
 class Connection(asyncio.Protocol):
@@ -68,15 +502,46 @@ class Connection(asyncio.Protocol):
     first_timeout = 0.2      #: Timeout for start reading first request from connection.
     request_timeout = 5.0    #: Timeout for reading a request headers and body.
     keepalive_timeout = 3.0  #: Timeout for waiting next request if connection is not been closed.
+    body_spool_size = 256*1024 #: Max size of request body kept in memory, larger body is written to temporary file.
+    max_body_size = None     #: Max size of request body, larger request is rejected. If None size isn't limited.
+    #: Max number of pipelined requests which wait for handling, reading from transport is paused above it.
+    max_pipelined = 32
     #: Default request environ variables.
     default_environ = dict([
         ('wsgi.version', (1,0)), ('wsgi.url_scheme','http'),
         ('SERVER_PROTOCOL', 'HTTP/1.0'), ('SERVER_SOFTWARE', 'Aqua/DEV'),
-        ('wsgi.multithread', False), ('wsgi.multiprocess', True), ('wsgi.run_once', False)])
+        ('wsgi.multithread', False), ('wsgi.multiprocess', True), ('wsgi.run_once', False),
+        ('wsgi.file_wrapper', FileWrapper)])
     
 
     def __init__(self, loop=None):
-        self._environ = None
+        self._environ = None      # environ of request which is being handled
+        self._reading = None      # environ of request which is being read
+        self._queue = deque()     # read requests which wait for handling
+        self._closing = False
+        self._draining = False    # connection is closed after current request
+        self._lost = False
+        self._task = None         # task of request handler
+        self._status = None       # status code of the last response
+        self.transport = None
+        self.timer = None         #: Instance of :class:`TimerWheel` used for timeouts, if None they are set by `call_later`.
+        #: Instance of :class:`aqua.metrics.Metrics` which stats of requests are recorded to, if None they aren't collected.
+        self.metrics = None
+        #: Dictionary of lists of hooks by their names, see :meth:`call_hooks`.
+        self.hooks = None
+        #: Instance of :class:`aqua.cache.ResponseCache` which requests are looked up in before handling.
+        self.response_cache = None
+        # connection_made adds addresses of connection
+        self.default_environ = dict(self.default_environ)
+        self._writing_paused = False
+        self._drain_waiter = None
+        self._buff = bytearray()
+        self._backlog = b''       # received data which isn't parsed while reading is paused
+        self._reading_paused = False
+        self._scan_pos = 0
+        self._body_left = None
+        self._body_size = 0
+        self._chunked = None
         self._timeout = (0, None)
         self.loop = loop or asyncio.get_event_loop() #: :mod:`asyncio` event loop.
 
@@ -114,6 +579,13 @@ class Connection(asyncio.Protocol):
 
     @timeout.setter
     def timeout(self, value):
+        if self.timer is not None:
+            if value>0:
+                self.timer.schedule(self, value, self.connection_timeout)
+            else:
+                self.timer.cancel(self)
+            self._timeout = (value, None)
+            return
         if self._timeout[1] is not None:
             self._timeout[1].cancel()
         self._timeout = (value, self.loop.call_later(value, self.connection_timeout)
@@ -131,64 +603,336 @@ class Connection(asyncio.Protocol):
         self.default_environ['REMOTE_ADDR'] = self.remote_addr[0]
         self.default_environ['wsgi.errors'] = sys.stderr
         self.default_environ['aqua.complete'] = False
+        if self._draining:
+            self._closing = True
+            transport.close()
+            return
         self.timeout = self.first_timeout
 
 
     def connection_lost(self, exc):
         """ Called when incomming HTTP connection is lost.
         See more :meth:`asyncio.BaseProtocol.connection_lost`."""
+        self._closing = True
+        self._lost = True
+        self.timeout = 0
+        self.resume_writing()
+        if self._reading is not None and 'aqua.waiter' in self._reading:
+            self._reading['aqua.waiter'].cancel()
+            if 'aqua.stream' in self._reading:
+                self._reading['aqua.stream'].set_exception(ConnectionResetError('Connection lost'))
         if exc is not None:
             self.warning("Connection closed by: {0}".format(exc))
+        if self.hooks:
+            self.call_hooks('connection_close', self)
+        self.close_handler(self)
+
+
+    def close(self):
+        """ Closes connection gracefully. Idle connection is closed at once,
+        otherwise it's closed when response to the current request is written. """
+        self._draining = True
+        if self.transport is not None and self._environ is None and self._reading is None \
+                and not self._queue and not self._closing:
+            self._closing = True
+            self.timeout = 0
+            self.transport.close()
+
+
+    def abort(self):
+        """ Closes connection at once, cancels task of request handler. """
+        if self._task is not None:
+            self._task.cancel()
+        if self.transport is not None:
+            self.transport.abort()
+
+
+    def pause_writing(self):
+        """ Called when the transport's buffer goes over the high-water mark.
+        See more :meth:`asyncio.BaseProtocol.pause_writing`."""
+        self._writing_paused = True
+
+
+    def resume_writing(self):
+        """ Called when the transport's buffer drains below the low-water mark.
+        See more :meth:`asyncio.BaseProtocol.resume_writing`."""
+        self._writing_paused = False
+        waiter, self._drain_waiter = self._drain_waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+
+    @asyncio.coroutine
+    def drain(self):
+        """ Waits while the transport's buffer is over the high-water mark. """
+        if self._writing_paused:
+            if self._drain_waiter is None:
+                self._drain_waiter = asyncio.Future(loop=self.loop)
+            yield from asyncio.shield(self._drain_waiter)
 
 
     def connection_timeout(self):
         """ Called when connection I/O timeout exceeded. """
-        if self._environ is not None:
+        if self._reading is not None and self._environ is None:
+            self._environ = self._reading
             self.response('408 Request Timeout', [], [])
         else:
             self.transport.close()
     
     def data_received(self, data):
         """ Called when some data is received.
-        See more :meth:`asyncio.Protocol.data_received`."""
-        if self._environ is None:
-            self.start_request()
+        See more :meth:`asyncio.Protocol.data_received`.
+
+        Data may contain several requests which are sent one after another
+        without waiting responses (HTTP/1.1 pipelining). They are queued
+        and handled in order, so responses are written in the same order."""
+        if self._reading_paused:
+            self._backlog += data
+            return
         try:
-            if not self._header_received:
-                self._buff = data
-                if len(self._buff)>_MAX_REQUEST_SIZE:
-                    raise Error('414 Request Too Long')
-                pos = self._buff.find(b'\r\n\r\n')
-                if pos>=0:
-                    self._header_received = True
-                    self._environ.update(parse_environ(self._buff[:pos+4]))
-                    if 'CONTENT_TYPE' in self._environ:
-                        self.body_chunk_received(self._environ, self._buff[pos+4:])
-                        if self._environ.get('HTTP_EXPECT') == '100-continue':
-                            self.expect_continue(self._environ)
-                        else:
-                            self.timeout = 0
-                    else:
-                        self._environ['aqua.complete'] = True
-                    if asyncio.iscoroutinefunction(self.request_handler):
-                        asyncio.Task(self.request_handler(self, self._environ))
-                    else:
-                        self.request_handler(self, self._environ)
-            else:
-                self.body_chunk_received(self._environ, data)
+            while data and not self._closing:
+                if self._reading is None:
+                    if len(self._queue)>=self.max_pipelined:
+                        # rest of data is parsed when queued requests are handled
+                        self._reading_paused = True
+                        self._backlog = data
+                        self.transport.pause_reading()
+                        break
+                    self.start_request()
+                if not self._header_received:
+                    data = self.header_received(data)
+                else:
+                    data = self.body_received(data)
         except Error as exc:
-            self.response(*exc.args)
+            self.request_failed(exc.args)
         except Exception as exc:
             self.exception('Uncaught exception when reading request:')
-            self.response('500 Internal Server Error', [], [])
+            self.request_failed(('500 Internal Server Error', [], []))
 
 
     def start_request(self):
         """ Called when HTTP request is start reading. """
-        self._buff = b''
         self._header_received = False
-        self._environ = self.default_environ.copy()
+        self._reading = self.default_environ.copy()
+        if self.metrics is not None:
+            self._reading['aqua.stats'] = RequestStats()
         self.timeout = self.request_timeout
+
+
+    def header_received(self, data):
+        """ Accumulates chunk of request headers and parses them if they are complete.
+
+        :param data: Received data.
+        :rtype: Rest of data which follows the headers.
+        """
+        buff = self._buff
+        buff += data
+        pos = buff.find(b'\r\n\r\n', self._scan_pos)
+        if pos>_MAX_REQUEST_SIZE:
+            raise Error('414 Request Too Long')
+        if pos<0:
+            if len(buff)>_MAX_REQUEST_SIZE:
+                raise Error('414 Request Too Long')
+            # the terminator may be split between chunks
+            self._scan_pos = max(len(buff)-3, 0)
+            return b''
+        environ = self._reading
+        if self.hooks:
+            self.call_hooks('before_parse', self, environ)
+        started = time.perf_counter() if self.metrics is not None else None
+        with memoryview(buff) as view:
+            environ.update(parse_environ(view[:pos]))
+        if started is not None:
+            stats = environ['aqua.stats']
+            stats.parse_time = time.perf_counter()-started
+            stats.bytes_in = pos+4
+        data = bytes(buff[pos+4:])
+        del buff[:]
+        self._scan_pos = 0
+        self._header_received = True
+        self.timeout = 0
+        if 'HTTP_TRANSFER_ENCODING' in environ:
+            if environ['HTTP_TRANSFER_ENCODING'].rpartition(',')[2].strip().lower()!='chunked':
+                raise Error('501 Not Implemented')
+            # length of body is known when it's completely read
+            environ.pop('CONTENT_LENGTH', None)
+            self._chunked = _CHUNK_SIZE
+            self._body_size = 0
+            self.start_body(environ)
+        elif 'CONTENT_LENGTH' in environ:
+            try:
+                self._body_left = int(environ['CONTENT_LENGTH'])
+            except ValueError:
+                raise Error('400 Bad Request')
+            if self._body_left<0:
+                raise Error('400 Bad Request')
+            if self.max_body_size is not None and self._body_left>self.max_body_size:
+                raise Error('413 Request Entity Too Large')
+            self.start_body(environ)
+            if self._body_left==0:
+                self.body_chunk_received(environ, b'')
+        else:
+            environ['aqua.complete'] = True
+        self._queue.append(environ)
+        if self._environ is None:
+            self.handle_request()
+        if environ['aqua.complete']:
+            self.finish_request()
+        return data
+
+
+    def start_body(self, environ):
+        """ Called when request headers are read and request has body.
+
+        :param environ: Request environ variables.
+        """
+        environ['aqua.waiter'] = asyncio.Future(loop=self.loop)
+        environ['aqua.progress'] = list()
+        if environ.get('HTTP_EXPECT') == '100-continue':
+            self.expect_continue(environ)
+
+
+    def body_received(self, data):
+        """ Passes chunk of request body to :meth:`body_chunk_received`.
+
+        :param data: Received data.
+        :rtype: Rest of data which follows the body.
+        """
+        if self._chunked is not None:
+            return self.chunk_received(data)
+        environ = self._reading
+        if len(data)>self._body_left:
+            data, rest = data[:self._body_left], data[self._body_left:]
+        else:
+            rest = b''
+        self._body_left -= len(data)
+        self.body_chunk_received(environ, data)
+        if environ['aqua.complete']:
+            self.finish_request()
+        return rest
+
+
+    def chunk_received(self, data):
+        """ Decodes request body in chunked transfer coding and passes
+        its chunks to :meth:`body_chunk_received`.
+
+        :param data: Received data.
+        :rtype: Rest of data which follows the body.
+        """
+        environ = self._reading
+        if self._chunked==_CHUNK_DATA:
+            if len(data)>self._body_left:
+                data, rest = data[:self._body_left], data[self._body_left:]
+            else:
+                rest = b''
+            self._body_left -= len(data)
+            if self._body_left==0:
+                self._chunked = _CHUNK_END
+            self.body_chunk_received(environ, data)
+            return rest
+        buff = self._buff
+        buff += data
+        pos = buff.find(b'\r\n')
+        if pos<0:
+            if len(buff)>_MAX_REQUEST_LINE:
+                raise Error('400 Bad Request')
+            return b''
+        line = bytes(buff[:pos])
+        data = bytes(buff[pos+2:])
+        del buff[:]
+        if self._chunked==_CHUNK_SIZE:
+            size, sep, ext = line.partition(b';')
+            if sep:
+                size = size.rstrip(b' \t')
+            # int() accepts prefixes, signs and underscores which proxy may interpret differently
+            if _chunk_size.fullmatch(size) is None:
+                raise Error('400 Bad Request')
+            size = int(size, 16)
+            if size==0:
+                self._chunked = _CHUNK_TRAILER
+            else:
+                self._body_size += size
+                if self.max_body_size is not None and self._body_size>self.max_body_size:
+                    raise Error('413 Request Entity Too Large')
+                self._body_left = size
+                self._chunked = _CHUNK_DATA
+        elif self._chunked==_CHUNK_END:
+            if line:
+                raise Error('400 Bad Request')
+            self._chunked = _CHUNK_SIZE
+        elif not line:
+            # end of trailer, trailer headers are ignored
+            self.body_chunk_received(environ, b'')
+            if environ['aqua.complete']:
+                self.finish_request()
+        return data
+
+
+    def finish_request(self):
+        """ Called when HTTP request is completely read. """
+        self._reading = None
+        self._body_left = None
+        self._chunked = None
+        if self._environ is None and not self._queue and not self._closing:
+            self.timeout = self.keepalive_timeout
+
+
+    def request_failed(self, args):
+        """ Called when HTTP request cannot be read. Further data is ignored,
+        error response is sent after responses of all previous requests.
+
+        :param args: Arguments of :meth:`Connection.response`.
+        """
+        environ = self._reading if self._reading is not None else self.default_environ.copy()
+        self.timeout = 0
+        self._closing = True
+        self._reading = None
+        self._queue.append((environ, args))
+        if self._environ is None:
+            self.handle_request()
+
+
+    def handle_request(self):
+        """ Passes next request from queue to :meth:`request_handler`. """
+        item = self._queue.popleft()
+        if isinstance(item, tuple):
+            self._environ, args = item
+            self.response(*args)
+            return
+        self._environ = item
+        self._status = None
+        if self.response_cache is not None:
+            entry = self.response_cache.lookup(item)
+            if entry is not None:
+                self.serialized_response(*entry)
+                return
+        try:
+            if asyncio.iscoroutinefunction(self.request_handler):
+                self._task = asyncio.Task(self.request_handler(self, item), loop=self.loop)
+                self._task.add_done_callback(lambda task: self.request_done(item, task))
+            else:
+                self.request_handler(self, item)
+        except Exception:
+            self.exception('Uncaught exception when handling request:')
+            if self._environ is item:
+                self.response('500 Internal Server Error', [], [])
+
+
+    def request_done(self, environ, task):
+        """ Called when task of request handler is done. If handler failed
+        before response is started '500 Internal Server Error' is sent.
+
+        :param environ: Request environ variables.
+        :param task: Task of :meth:`request_handler`.
+        """
+        if task.cancelled() or task.exception() is None:
+            return
+        exc = task.exception()
+        logger.error('Uncaught exception when handling request:', exc_info=(type(exc), exc, exc.__traceback__),
+                     extra=dict(ip=self.remote_addr[0]))
+        if self._environ is environ and self._status is None and not self._lost:
+            self._task = None
+            self.response('500 Internal Server Error', [], [])
     
 
     def request_handler(self, connection, environ):
@@ -200,6 +944,39 @@ class Connection(asyncio.Protocol):
         connection.response('501 Not Implemented', [], [])
 
 
+    def close_handler(self, connection):
+        """ Called when connection is lost. It can be overriden to track connections.
+
+        :param connection: Instance of :class:`Connection`.
+        """
+
+
+    def call_hooks(self, name, *args):
+        """ Calls hooks with given name from :attr:`hooks`, exceptions raised
+        by them are logged. Hooks are called with arguments:
+
+        * `before_parse(connection, environ)` -- Request headers are received,
+          `environ` contains only default variables yet.
+        * `after_route(connection, request, view, kwargs)` -- Request is routed,
+          hook can change urlvars `kwargs` which are passed to `view`.
+        * `before_handler(connection, request, view, kwargs)` -- Request handler
+          is going to be called.
+        * `after_response(connection, environ, status)` -- Response is written,
+          `status` is its status code.
+        * `connection_close(connection)` -- Connection is lost.
+
+        Hooks `after_route` and `before_handler` are called by :meth:`aqua.app.BaseApplication.request_router`.
+
+        :param name: Name of hooks, see :data:`HOOKS`.
+        :param args: Arguments of hooks.
+        """
+        for hook in self.hooks.get(name, ()):
+            try:
+                hook(*args)
+            except Exception:
+                self.exception('Uncaught exception in hook {0}:'.format(name))
+
+
     def expect_continue(self, environ):
         """ Called when present header 'Expect: 100-continue'.
         
@@ -212,19 +989,76 @@ class Connection(asyncio.Protocol):
         """ Called when chunk of body is received.
         
         :param environ: Request environ variables.
-        :param data: Received chunk of body.
+        :param data: Received chunk of body. Empty chunk means end of body
+            if it's in chunked transfer coding.
         :type data: bytes
         """
         assert not environ['aqua.complete']
-        if 'wsgi.input' not in environ:
-            environ['wsgi.input'] = io.BytesIO()
-        if 'CONTENT_LENGTH' in environ:
+        if self.metrics is not None:
+            environ['aqua.stats'].bytes_in += len(data)
+        stream = environ.get('aqua.stream')
+        if stream is not None:
+            stream.feed(data)
+            size = stream.received
+        else:
+            if 'wsgi.input' not in environ:
+                environ['wsgi.input'] = self.body_file(environ)
             environ['wsgi.input'].write(data)
-            if environ['wsgi.input'].tell() < int(environ['CONTENT_LENGTH']):
-                return
+            size = environ['wsgi.input'].tell()
+        total = environ.get('CONTENT_LENGTH')
+        if total is not None:
+            total = int(total)
+            complete = size>=total
+        else:
+            complete = not data
+        if not complete:
+            for callback in environ['aqua.progress']:
+                callback(size, total)
+            return
+        if total is None:
+            environ['CONTENT_LENGTH'] = str(size)
         environ['aqua.complete'] = True
-        environ['wsgi.input'].seek(0)
-        self.timeout = 0
+        if stream is not None:
+            stream.feed_eof()
+        else:
+            environ['wsgi.input'].seek(0)
+        environ['aqua.waiter'].set_result(None)
+
+
+    def body_file(self, environ):
+        """ Returns file object which request body is written to. Body which size
+        is larger than :attr:`body_spool_size` is written to temporary file.
+
+        :param environ: Request environ variables.
+        """
+        size = int(environ.get('CONTENT_LENGTH', -1))
+        if size<0:
+            return tempfile.SpooledTemporaryFile(max_size=self.body_spool_size)
+        elif size>self.body_spool_size:
+            return tempfile.TemporaryFile()
+        else:
+            return io.BytesIO()
+
+
+    def body_stream(self, environ):
+        """ Switches reading of request body to streaming mode. Chunks of body
+        are not accumulated in ``environ['wsgi.input']`` but they are passed to
+        returned stream. Already received part of body is passed too.
+        If the stream is not completely read before response, rest of body is discarded.
+
+        :param environ: Request environ variables.
+        :rtype: Instance of :class:`BodyStream`, it's stored in ``environ['aqua.stream']``.
+        """
+        stream = environ.get('aqua.stream')
+        if stream is None:
+            stream = environ['aqua.stream'] = BodyStream(self.transport, self.loop)
+            if 'wsgi.input' in environ:
+                with environ.pop('wsgi.input') as body:
+                    body.seek(0)
+                    stream.feed(body.read())
+            if environ['aqua.complete']:
+                stream.feed_eof()
+        return stream
   
 
     def response(self, status, headers, app_iter):
@@ -232,10 +1066,12 @@ class Connection(asyncio.Protocol):
         
         :param status: HTTP status string like '200 OK'
         :param headers: List of response headers represented as tuple (name, value)
-        :param app_iter: Body iterator, item must be bytes.
+        :param app_iter: Body iterator, item must be bytes. It can be asynchronous
+            iterator (for example asynchronous generator), then the response is
+            written by task which waits while the transport's buffer is drained
+            after each item.
         """
-        self.timeout = 0
-        code = int(status.split(' ')[0])
+        code = self._status = int(status[:3])
         if code<400:
             if 'HTTP_CONNECTION' in self._environ:
                 close_connection = (self._environ['HTTP_CONNECTION']=='close')
@@ -243,52 +1079,296 @@ class Connection(asyncio.Protocol):
                 close_connection = (self._environ['SERVER_PROTOCOL']<'HTTP/1.1')
         else:
             close_connection = True
-        self.transport.write("{0} {1}\r\n".format(self._environ['SERVER_PROTOCOL'], status).encode('ISO-8859-1'))
+        # head and small body are joined to one buffer allocated at once
+        parts = [encode_status(self._environ['SERVER_PROTOCOL'], status)]
+        framed = False
         for name, value in headers:
-            if not close_connection and name=='Connection':
-                close_connection = (value=='close')
-            self.transport.write('{0}: {1}\r\n'.format(name, value).encode('ISO-8859-1'))
-        self.transport.write(b'\r\n')
-        for data in app_iter:
-            self.transport.write(data)
-        if close_connection:
+            lower = name.lower()
+            if lower=='connection':
+                close_connection = close_connection or (str(value).lower()=='close')
+            elif lower=='content-length':
+                framed = True
+            elif lower=='transfer-encoding':
+                # body is framed by connection, chunks of body aren't encoded by handler
+                continue
+            parts.append(encode_header_name(name))
+            parts.append(str(value).encode('ISO-8859-1'))
+            parts.append(b'\r\n')
+        if isinstance(app_iter, (list, tuple)):
+            size = sum(map(len, app_iter))
+        elif isinstance(app_iter, FileWrapper):
+            size = app_iter.count
+        else:
+            size = None
+        chunked = False
+        if not framed and not close_connection and code>=200 and code!=204 and code!=304 \
+                and self._environ.get('REQUEST_METHOD')!='HEAD':
+            # length of body must be known to keep connection alive
+            if size is not None:
+                parts.append(b'Content-Length: ' + str(size).encode('ISO-8859-1') + b'\r\n')
+            elif self._environ['SERVER_PROTOCOL']=='HTTP/1.1':
+                chunked = True
+                parts.append(b'Transfer-Encoding: chunked\r\n')
+            else:
+                close_connection = True
+        if self._draining and not close_connection:
+            close_connection = True
+            parts.append(b'Connection: close\r\n')
+        parts.append(b'\r\n')
+        head_only = self._environ.get('REQUEST_METHOD')=='HEAD'
+        stats = self._environ.get('aqua.stats') if self.metrics is not None else None
+        if stats is not None:
+            stats.status = code
+            stats.bytes_out = sum(map(len, parts))
+            if size is not None and not head_only and not isinstance(app_iter, FileWrapper):
+                stats.bytes_out += size
+        if head_only:
+            # response to HEAD request has no body, though its headers describe it
+            self.transport.write(b''.join(parts))
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+            self.finish_response(close_connection)
+            return
+        elif isinstance(app_iter, FileWrapper):
+            self.transport.write(b''.join(parts))
+            asyncio.Task(self.send_file(app_iter, close_connection), loop=self.loop)
+            return
+        elif size is not None and size<=_MAX_COALESCED_BODY:
+            parts.extend(app_iter)
+            self.transport.write(b''.join(parts))
+        elif hasattr(app_iter, '__anext__'):
+            self.transport.write(b''.join(parts))
+            asyncio.Task(self.write_body(app_iter, chunked, close_connection), loop=self.loop)
+            return
+        elif chunked:
+            self.transport.write(b''.join(parts))
+            for data in app_iter:
+                if data:
+                    self.transport.write(encode_chunk(data))
+                    if stats is not None:
+                        stats.bytes_out += len(data)
+            self.transport.write(b'0\r\n\r\n')
+        else:
+            self.transport.write(b''.join(parts))
+            for data in app_iter:
+                self.transport.write(data)
+                if stats is not None and size is None:
+                    stats.bytes_out += len(data)
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+        self.finish_response(close_connection)
+
+
+    def serialized_response(self, head, body, name=None):
+        """ Outputs response to `HTTP/1.1` request which head is already encoded
+        by :func:`aqua.cache.serialize`.
+
+        :param head: Status line and headers without terminating empty line, they must contain `Content-Length`.
+        :param body: Body of response as bytes.
+        :param name: View name which is recorded to metrics.
+        """
+        close_connection = self._draining or self._environ.get('HTTP_CONNECTION')=='close'
+        head += b'Connection: close\r\n\r\n' if close_connection else b'\r\n'
+        if len(body)<=_MAX_COALESCED_BODY:
+            self.transport.write(head+body)
+        else:
+            self.transport.write(head)
+            self.transport.write(body)
+        self._status = int(head[9:12])
+        stats = self._environ.get('aqua.stats') if self.metrics is not None else None
+        if stats is not None:
+            stats.route = name
+            stats.status = self._status
+            stats.bytes_out = len(head)+len(body)
+        self.finish_response(close_connection)
+
+
+    @asyncio.coroutine
+    def write_body(self, app_iter, chunked, close_connection):
+        """ Writes response body from asynchronous iterator.
+
+        :param app_iter: Asynchronous body iterator, item must be bytes.
+        :param chunked: If True body is written in chunked transfer coding.
+        :param close_connection: If True connection is closed after response.
+        """
+        stats = self._environ.get('aqua.stats') if self.metrics is not None else None
+        try:
+            while not self._lost:
+                try:
+                    data = yield from app_iter.__anext__()
+                except StopAsyncIteration:
+                    if chunked:
+                        self.transport.write(b'0\r\n\r\n')
+                    break
+                if data:
+                    self.transport.write(encode_chunk(data) if chunked else data)
+                    if stats is not None:
+                        stats.bytes_out += len(data)
+                    yield from self.drain()
+        except Exception:
+            self.exception('Uncaught exception when writing response:')
+            # client cannot find the end of incomplete body
+            close_connection = True
+        if hasattr(app_iter, 'aclose'):
+            yield from app_iter.aclose()
+        if not self._lost:
+            self.finish_response(close_connection)
+
+
+    @asyncio.coroutine
+    def send_file(self, wrapper, close_connection):
+        """ Writes response body from file.
+
+        :param wrapper: Instance of :class:`FileWrapper`.
+        :param close_connection: If True connection is closed after response.
+        """
+        try:
+            sent = False
+            sendfile = getattr(self.loop, 'sendfile', None)
+            if sendfile is not None and wrapper.count:
+                try:
+                    yield from sendfile(self.transport, wrapper.filelike,
+                                        wrapper.offset, wrapper.count, fallback=False)
+                    sent = True
+                except (_SendfileNotAvailable, AttributeError, io.UnsupportedOperation):
+                    pass
+            if not sent:
+                try:
+                    fileno = wrapper.filelike.fileno() if wrapper.count else None
+                except (AttributeError, OSError, io.UnsupportedOperation):
+                    fileno = None
+                if fileno is not None:
+                    with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mapped:
+                        end = wrapper.offset + wrapper.count
+                        for pos in range(wrapper.offset, end, wrapper.block_size):
+                            if self._lost:
+                                break
+                            self.transport.write(mapped[pos:min(pos+wrapper.block_size, end)])
+                            yield from self.drain()
+                else:
+                    for data in wrapper:
+                        if self._lost:
+                            break
+                        self.transport.write(data)
+                        yield from self.drain()
+        except Exception:
+            self.exception('Uncaught exception when sending file:')
+            close_connection = True
+        finally:
+            wrapper.close()
+        if self.metrics is not None and 'aqua.stats' in self._environ:
+            self._environ['aqua.stats'].bytes_out += wrapper.count or 0
+        if not self._lost:
+            self.finish_response(close_connection)
+
+
+    def finish_response(self, close_connection):
+        """ Called when response is written.
+
+        :param close_connection: If True connection is closed.
+        """
+        if 'aqua.stream' in self._environ:
+            self._environ['aqua.stream'].discard()
+        if self.metrics is not None and 'aqua.stats' in self._environ:
+            self.metrics.record(self._environ['aqua.stats'])
+        if self.hooks:
+            self.call_hooks('after_response', self, self._environ, self._status)
+        self._task = None
+        if close_connection or self._closing and not self._queue:
+            self._closing = True
+            self._queue.clear()
             self.transport.close()
         else:
             self._environ = None
-            self.timeout = self.keepalive_timeout
+            if self._queue:
+                self.handle_request()
+            elif self._reading is None:
+                self.timeout = self.keepalive_timeout
+            if self._reading_paused and len(self._queue)<self.max_pipelined:
+                self._reading_paused = False
+                self.transport.resume_reading()
+                data, self._backlog = self._backlog, b''
+                self.data_received(data)
+
+
+def encode_status(protocol, status):
+    """ Returns encoded status line of response, for example ``b'HTTP/1.1 200 OK\\r\\n'``. """
+    key = (protocol, status)
+    line = _status_lines.get(key)
+    if line is None:
+        line = '{0} {1}\r\n'.format(protocol, status).encode('ISO-8859-1')
+        if len(_status_lines)<_MAX_CACHED_NAMES:
+            _status_lines[key] = line
+    return line
+
+
+def encode_chunk(data):
+    """ Returns chunk of body encoded in chunked transfer coding. """
+    return b''.join((format(len(data), 'x').encode('ISO-8859-1'), b'\r\n', data, b'\r\n'))
 
 
-_quoted_slash = re.compile(b'(?i)%2F')        
+def encode_header_name(name):
+    """ Returns encoded beginning of response header line, for example ``b'Content-Type: '``. """
+    line = _header_names.get(name)
+    if line is None:
+        line = '{0}: '.format(name).encode('ISO-8859-1')
+        if len(_header_names)<_MAX_CACHED_NAMES:
+            _header_names[name] = line
+    return line
+
+
+# Raised by loop.sendfile() if sending of file is not supported
+_SendfileNotAvailable = getattr(asyncio, 'SendfileNotAvailableError', NotImplementedError)
+
+
+_quoted_slash = re.compile('(?i)%2F')
+_chunk_size = re.compile(b'[0-9A-Fa-f]+')
+_environ_names = dict()    # Cache of header names translated to environ keys
 
 def parse_environ(data):
-    """ Parses request bytes data (except body) to request environ variables. """
-    lines = data.split(b'\r\n')
+    """ Parses request bytes data (except body) to request environ variables.
+
+    :param data: Bytes-like object (``bytes``, ``bytearray`` or ``memoryview``)
+        contains request line and headers. It's decoded only once.
+    """
+    lines = str(data, 'ISO-8859-1').split('\r\n')
     if len(lines[0])>_MAX_REQUEST_LINE:
         raise Error('414 Request Too Long')
-    method, uri, version = lines[0].split(b' ')
-    if version not in (b'HTTP/1.0',b'HTTP/1.1'):
-        raise Error('505 HTTP Version Not Supported')
-    parts = uri.split(b'?', 1)
-    path, query = parts[0], parts[1] if len(parts)==2 else b''
     try:
-        atoms = [unquote_bytes(x) for x in _quoted_slash.split(path)]
+        method, uri, version = lines[0].split(' ')
     except ValueError:
         raise Error('400 Bad Request')
-    path = b'%2F'.join(atoms)
-    result = dict(
-        zip(('REQUEST_METHOD','REQUEST_URI','SERVER_PROTOCOL','SCRIPT_NAME', 'PATH_INFO', 'QUERY_STRING'),
-             map(lambda item: item.decode('ISO-8859-1') ,(method, uri, version, b'', path, query))))
+    if version!='HTTP/1.1' and version!='HTTP/1.0':
+        raise Error('505 HTTP Version Not Supported')
+    path, _, query = uri.partition('?')
+    if '%' in path:
+        try:
+            path = '%2F'.join(unquote_text(x) for x in _quoted_slash.split(path))
+        except ValueError:
+            raise Error('400 Bad Request')
+    result = {'REQUEST_METHOD': method, 'REQUEST_URI': uri, 'SERVER_PROTOCOL': version,
+              'SCRIPT_NAME': '', 'PATH_INFO': path, 'QUERY_STRING': query}
     name = None
-    for item in map(lambda item: item.decode('ISO-8859-1'), lines[1:]):
+    for index in range(1, len(lines)):
+        item = lines[index]
         if item=='':
             break
-        elif item[0] in (' ', '\t'):
-            result[name] += item[0].strip()
+        elif item[0]==' ' or item[0]=='\t':
+            if name is None:
+                raise Error('400 Bad Request')
+            result[name] += ' ' + item.strip()
         else:
-            name, value = map(str.strip, item.split(':',1))
-            name = name.upper().replace('-','_')
-            if name not in ('CONTENT_TYPE','CONTENT_LENGTH'):
-                name = 'HTTP_' + name
+            key, sep, value = item.partition(':')
+            if not sep:
+                raise Error('400 Bad Request')
+            name = _environ_names.get(key)
+            if name is None:
+                name = key.strip().upper().replace('-','_')
+                if name!='CONTENT_TYPE' and name!='CONTENT_LENGTH':
+                    name = 'HTTP_' + name
+                if len(_environ_names)<_MAX_CACHED_NAMES:
+                    _environ_names[key] = name
+            value = value.strip()
             if name in result:
                 result[name] += ', ' + value
             else:
@@ -296,6 +1376,15 @@ def parse_environ(data):
     return result
 
 
+def unquote_text(data):
+    """ Unqotes string decoded as ISO-8859-1, the same as :func:`unquote_bytes` does it for bytes. """
+    res = data.split('%')
+    for i in range(1, len(res)):
+        item = res[i]
+        res[i] = chr(int(item[:2], 16)) + item[2:]
+    return ''.join(res)
+
+
 def unquote_bytes(data):
     """ Unqotes bytes string. """
     res = data.split(b'%')
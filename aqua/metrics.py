@@ -0,0 +1,231 @@
+"""
+aqua.metrics -- Request metrics
+===============================
+
+This module provides collecting of request metrics. When it's enabled by
+:attr:`aqua.app.BaseApplication.collect_metrics`, :class:`aqua.http.Connection`
+and :meth:`aqua.app.BaseApplication.request_router` fill :class:`RequestStats`
+of every request and :class:`Metrics` aggregates them per route: time of parsing
+request headers, time of routing, time of handler, received and sent bytes and
+statuses of responses. Times are kept by :class:`Histogram` which has bounded
+relative error like HDR histogram, so percentiles are cheap to record and query.
+
+Metrics are available by :meth:`Metrics.snapshot` or in Prometheus text format
+by :meth:`Metrics.prometheus` which is served by route
+:attr:`aqua.app.BaseApplication.metrics_route` if it's set. Every worker process
+of :mod:`aqua.runner` collects own metrics.
+"""
+from collections import OrderedDict
+
+
+class Histogram(object):
+    """ Histogram with log-linear buckets like HDR histogram. Values are recorded
+    as integer number of units, buckets of values which are less than ``2**precision``
+    units are exact, relative error of larger values is less than ``2**(1-precision)``.
+
+    :param unit: Size of unit, recorded values are divided by it.
+    :param precision: Number of significant bits of recorded values.
+    """
+
+    def __init__(self, unit=1e-6, precision=7):
+        self.unit = unit
+        self.precision = precision
+        self.count = 0     #: Number of recorded values.
+        self.total = 0.0   #: Sum of recorded values.
+        self.min = None    #: Min of recorded values.
+        self.max = None    #: Max of recorded values.
+        self._counts = list()
+        self._size = 1 << precision
+        self._half = self._size >> 1
+
+    def _index(self, value):
+        if value<self._size:
+            return value
+        shift = value.bit_length()-self.precision
+        return self._size + (shift-1)*self._half + (value>>shift) - self._half
+
+    def _value(self, index):
+        """ Returns highest value of bucket in units. """
+        if index<self._size:
+            return index
+        shift, mantissa = divmod(index-self._size, self._half)
+        shift += 1
+        return ((mantissa+self._half+1) << shift) - 1
+
+    def record(self, value):
+        """ Records value. """
+        self.count += 1
+        self.total += value
+        if self.min is None or value<self.min:
+            self.min = value
+        if self.max is None or value>self.max:
+            self.max = value
+        index = self._index(max(int(value/self.unit), 0))
+        counts = self._counts
+        if index>=len(counts):
+            counts.extend([0]*(index-len(counts)+1))
+        counts[index] += 1
+
+    @property
+    def mean(self):
+        """ Mean of recorded values or None if there are not them. """
+        return self.total/self.count if self.count else None
+
+    def percentile(self, percent):
+        """ Returns value which is not exceeded by given percent of recorded values.
+        Result is upper bound of bucket, but it's not more than :attr:`max`.
+
+        :param percent: Percent from 0 to 100.
+        :rtype: Value or None if there are not recorded values.
+        """
+        if not self.count:
+            return None
+        rank = max(percent*self.count/100.0, 1)
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen>=rank:
+                return min(self._value(index)*self.unit, self.max)
+        return self.max
+
+    def summary(self, percents=(50, 90, 99, 99.9)):
+        """ Returns dictionary with count, sum, min, max, mean and percentiles of values. """
+        result = dict(count=self.count, sum=self.total, min=self.min, max=self.max, mean=self.mean)
+        for percent in percents:
+            result['p{0:g}'.format(percent)] = self.percentile(percent)
+        return result
+
+
+class RequestStats(object):
+    """ Stats of one request, they are stored in ``environ['aqua.stats']``. """
+
+    __slots__ = ('route', 'parse_time', 'route_time', 'handler_time', 'bytes_in', 'bytes_out', 'status')
+
+    def __init__(self):
+        self.route = None          #: Name of view or None if request isn't routed.
+        self.parse_time = None     #: Time in seconds of parsing request headers.
+        self.route_time = None     #: Time in seconds of routing.
+        self.handler_time = None   #: Time in seconds of handler.
+        self.bytes_in = 0          #: Size of request headers and body.
+        self.bytes_out = 0         #: Size of response headers and body.
+        self.status = None         #: Status code of response.
+
+
+class RouteMetrics(object):
+    """ Metrics of requests of one route. """
+
+    def __init__(self):
+        self.requests = 0  #: Number of requests.
+        self.bytes_in = 0  #: Number of received bytes.
+        self.bytes_out = 0 #: Number of sent bytes.
+        self.statuses = dict()  #: Number of responses by status code.
+        self.parse_time = Histogram()    #: Histogram of time of parsing request headers.
+        self.route_time = Histogram()    #: Histogram of time of routing.
+        self.handler_time = Histogram()  #: Histogram of time of handler.
+
+    def record(self, stats):
+        """ Adds stats of request, see :class:`RequestStats`. """
+        self.requests += 1
+        self.bytes_in += stats.bytes_in
+        self.bytes_out += stats.bytes_out
+        self.statuses[stats.status] = self.statuses.get(stats.status, 0)+1
+        if stats.parse_time is not None:
+            self.parse_time.record(stats.parse_time)
+        if stats.route_time is not None:
+            self.route_time.record(stats.route_time)
+        if stats.handler_time is not None:
+            self.handler_time.record(stats.handler_time)
+
+
+class Metrics(object):
+    """ Metrics of requests by routes. Requests which aren't routed
+    (for example malformed ones) are counted by route with empty name. """
+
+    def __init__(self):
+        self.routes = OrderedDict()  #: Instances of :class:`RouteMetrics` by names of routes.
+        self.gauges = OrderedDict()  #: Gauges by names, see :meth:`add_gauge`.
+
+    def record(self, stats):
+        """ Adds stats of request, see :class:`RequestStats`. """
+        name = stats.route or ''
+        metrics = self.routes.get(name)
+        if metrics is None:
+            metrics = self.routes[name] = RouteMetrics()
+        metrics.record(stats)
+
+    def add_gauge(self, name, help, labels, value):
+        """ Adds gauge which value is read when metrics are exposed. Gauges
+        are not removed by :meth:`reset`.
+
+        :param name: Name of metric without prefix.
+        :param help: Description of metric.
+        :param labels: List of labels of sample as tuples (name, value).
+        :param value: Function without arguments which returns current value.
+        """
+        if name not in self.gauges:
+            self.gauges[name] = (help, list())
+        self.gauges[name][1].append((labels, value))
+
+    def reset(self):
+        """ Removes collected metrics. """
+        self.routes.clear()
+
+    def snapshot(self):
+        """ Returns collected metrics as dictionary by names of routes. """
+        result = dict()
+        for name, metrics in self.routes.items():
+            result[name] = dict(requests=metrics.requests, bytes_in=metrics.bytes_in,
+                                bytes_out=metrics.bytes_out, statuses=dict(metrics.statuses),
+                                parse_time=metrics.parse_time.summary(),
+                                route_time=metrics.route_time.summary(),
+                                handler_time=metrics.handler_time.summary())
+        return result
+
+    def prometheus(self, prefix='aqua'):
+        """ Returns collected metrics in Prometheus text exposition format.
+        Times are exposed as summaries with quantiles.
+
+        :param prefix: Prefix of names of metrics.
+        """
+        lines = list()
+        def add(name, kind, help, samples):
+            name = prefix+'_'+name
+            lines.append('# HELP {0} {1}'.format(name, help))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+            for suffix, labels, value in samples:
+                labels = ','.join('{0}="{1}"'.format(key, _escape(value)) for key, value in labels)
+                lines.append('{0}{1}{{{2}}} {3}'.format(name, suffix, labels, _format(value)))
+
+        routes = list(self.routes.items())
+        add('requests_total', 'counter', 'Number of requests.',
+            [('', [('route', name), ('status', status)], count)
+             for name, metrics in routes for status, count in sorted(metrics.statuses.items(), key=str)])
+        add('received_bytes_total', 'counter', 'Number of received bytes.',
+            [('', [('route', name)], metrics.bytes_in) for name, metrics in routes])
+        add('sent_bytes_total', 'counter', 'Number of sent bytes.',
+            [('', [('route', name)], metrics.bytes_out) for name, metrics in routes])
+        for attr, help in (('parse_time', 'Time of parsing request headers in seconds.'),
+                           ('route_time', 'Time of routing in seconds.'),
+                           ('handler_time', 'Time of request handler in seconds.')):
+            samples = list()
+            for name, metrics in routes:
+                histogram = getattr(metrics, attr)
+                for quantile in (0.5, 0.9, 0.99, 0.999):
+                    samples.append(('', [('route', name), ('quantile', quantile)],
+                                    histogram.percentile(quantile*100)))
+                samples.append(('_sum', [('route', name)], histogram.total))
+                samples.append(('_count', [('route', name)], histogram.count))
+            add(attr.replace('_time', '_seconds'), 'summary', help, samples)
+        for name, (help, gauges) in self.gauges.items():
+            add(name, 'gauge', help, [('', labels, value()) for labels, value in gauges])
+        return '\n'.join(lines)+'\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format(value):
+    if value is None:
+        return 'NaN'
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,183 @@
+"""
+aqua.profiler -- Profiler of slow requests
+==========================================
+
+This module provides the profiler which uses hooks of application (see
+:meth:`aqua.app.BaseApplication.add_hook`) to find out where time of slow
+requests goes. Only requests which are slower than threshold are dumped to
+files, so profiler can be used in production. It has two modes:
+
+* `stack` -- When request is handled longer than threshold, stack of task of its
+  handler is sampled every :attr:`SlowRequestProfiler.interval` until response.
+  Stacks show where handler waits, fast requests cost only setting of timer.
+* `cprofile` -- Handler is profiled by :mod:`cProfile`, result is dumped by
+  :meth:`cProfile.Profile.dump_stats` if request is slow. Only one request is
+  profiled at the same time and profile includes all code run by event loop
+  meanwhile, so it shows blocking code. Part of requests which are profiled is
+  set by :attr:`SlowRequestProfiler.sample_rate`. Profiling is stopped when
+  handler finishes or connection is lost even if response isn't written.
+
+Sample below dumps stacks of requests slower than half a second::
+
+    app = MyApplication(loop)
+    profiler = SlowRequestProfiler(app, threshold=0.5, directory='/var/tmp/aqua')
+"""
+import os
+import time
+import random
+import cProfile
+import tempfile
+import functools
+import traceback
+
+
+class _Trace(object):
+    """ State of profiling of one request, it's stored in ``environ['aqua.profile']``. """
+
+    __slots__ = ('started', 'connection', 'samples', 'profile', 'handle')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.connection = None
+        self.samples = list()
+        self.profile = None
+        self.handle = None
+
+
+class SlowRequestProfiler(object):
+    """ Profiler of slow requests, it adds own hooks to application.
+
+    :param app: Instance of :class:`aqua.app.BaseApplication`.
+    :param threshold: Request which is handled longer than this time in seconds is dumped.
+    :param directory: Directory which files are written to, by default temporary directory.
+    :param mode: 'stack' or 'cprofile', see :mod:`aqua.profiler`.
+    """
+
+    interval = 0.1     #: Interval in seconds between samples of stack in `stack` mode.
+    sample_rate = 1.0  #: Part of requests profiled in `cprofile` mode.
+    max_files = 100    #: Max number of dumped files, further slow requests are not dumped.
+
+    def __init__(self, app, threshold=1.0, directory=None, mode='stack'):
+        if mode not in ('stack', 'cprofile'):
+            raise ValueError("Unknown mode of profiler '{0}'.".format(mode))
+        self.app = app
+        self.threshold = threshold
+        self.directory = directory or tempfile.gettempdir()
+        self.mode = mode
+        self.files = list()  #: Paths of dumped files.
+        self._profiled = None  # trace of request which is profiled by cProfile
+        self._hooks = [('before_parse', self.before_parse),
+                       ('before_handler', self.before_handler),
+                       ('after_response', self.after_response),
+                       ('connection_close', self.connection_close)]
+        for name, hook in self._hooks:
+            app.add_hook(name, hook)
+
+    def close(self):
+        """ Removes hooks of profiler from application. """
+        for name, hook in self._hooks:
+            self.app.remove_hook(name, hook)
+        if self._profiled is not None:
+            self._profiled.profile.disable()
+            self._profiled = None
+
+    def before_parse(self, connection, environ):
+        environ['aqua.profile'] = _Trace()
+
+    def before_handler(self, connection, request, view, kwargs):
+        trace = request.environ.get('aqua.profile')
+        if trace is None:
+            return
+        trace.connection = connection
+        if self.mode=='stack':
+            self._schedule(trace, self.threshold-(time.perf_counter()-trace.started))
+        elif self._profiled is None and random.random()<self.sample_rate:
+            trace.profile = cProfile.Profile()
+            self._profiled = trace
+            trace.profile.enable()
+            if connection._task is not None:
+                connection._task.add_done_callback(lambda task: self._disable(trace))
+
+    def after_response(self, connection, environ, status):
+        trace = environ.get('aqua.profile')
+        if trace is None:
+            return
+        elapsed = time.perf_counter()-trace.started
+        if trace.connection is not None and self.mode=='stack':
+            self._cancel(trace)
+        self._disable(trace)
+        trace.connection = None
+        if elapsed>=self.threshold and len(self.files)<self.max_files:
+            self.dump(environ, status, elapsed, trace)
+
+    def connection_close(self, connection):
+        if self._profiled is not None and self._profiled.connection is connection:
+            self._disable(self._profiled)
+
+    def dump(self, environ, status, elapsed, trace):
+        """ Writes file with profile of slow request.
+
+        :param environ: Request environ variables.
+        :param status: Status code of response.
+        :param elapsed: Time of request in seconds.
+        :param trace: Data collected by profiler.
+        """
+        if self.mode=='cprofile' and trace.profile is None:
+            return
+        name = 'aqua-slow-{0}-{1}.{2}'.format(os.getpid(), len(self.files)+1,
+                                              'txt' if trace.profile is None else 'prof')
+        path = os.path.join(self.directory, name)
+        if trace.profile is not None:
+            trace.profile.dump_stats(path)
+        else:
+            with open(path, 'w') as output:
+                output.write('{0} {1} {2} {3:.3f}s\n'.format(environ.get('REQUEST_METHOD'),
+                                                           environ.get('PATH_INFO'), status, elapsed))
+                for offset, stack in trace.samples:
+                    output.write('\nSample at {0:.3f}s:\n{1}'.format(offset, stack))
+        self.files.append(path)
+
+    def _disable(self, trace):
+        if trace.profile is not None:
+            trace.profile.disable()
+        if self._profiled is trace:
+            self._profiled = None
+
+    def _sample(self, trace):
+        connection = trace.connection
+        if connection is None:
+            return
+        task = connection._task
+        if task is None or task.done():
+            return
+        trace.samples.append((time.perf_counter()-trace.started, format_stack(task)))
+        self._schedule(trace, self.interval)
+
+    def _schedule(self, trace, delay):
+        callback = functools.partial(self._sample, trace)
+        timer = trace.connection.timer
+        if timer is not None:
+            timer.schedule(trace, max(delay, 0), callback)
+        else:
+            trace.handle = trace.connection.loop.call_later(max(delay, 0), callback)
+
+    def _cancel(self, trace):
+        timer = trace.connection.timer
+        if timer is not None:
+            timer.cancel(trace)
+        elif trace.handle is not None:
+            trace.handle.cancel()
+
+
+def format_stack(task):
+    """ Returns stack of suspended task as string, unlike :meth:`asyncio.Task.get_stack`
+    it follows coroutines which task waits by `yield from` or `await`. """
+    coro = getattr(task, '_coro', None)
+    lines = list()
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is None:
+            break
+        lines.extend(traceback.format_stack(frame, 1))
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    return ''.join(lines)
@@ -3,64 +3,75 @@ aqua.router -- Router
 =====================
 """
 
-from itertools import zip_longest
+from collections import OrderedDict
+from urllib.parse import quote
 from webob.exc import HTTPMethodNotAllowed, HTTPNotFound
 
 
 class _RouteItem(object):
-    """ Class of object describe item of route based on traversal. """
+    """ Class of object describe item of route based on traversal.
+    
+    Items make trie by static parts of path, parameters of routes are kept by
+    `methods` as tuples of endpoint, names of parameters, their converters and
+    flag of wildcard parameter (it takes rest of path).
+    """
+    
+    __slots__ = ('routes', 'methods')
     
     def __init__(self):
         self.routes = dict()
         self.methods = dict()
     
-    def __call__(self, split_path, method):
-        """ Route resolver"""
-        item = self.methods.get(method, (None,))
-        endpoint, argnames = item[0], item[1:]
-        if endpoint is not None and len(argnames)>=len(split_path):
-            return endpoint, dict(zip_longest(argnames, split_path)) # endpoint found
-        elif self.routes is not None and len(split_path)>0 and split_path[0] in self.routes:
-            return self.routes[split_path[0]](split_path[1:], method) # has subroute item
-        else:
-            if len(split_path)==0:
-                return None, tuple(self.methods.keys())  # 405
-            else:
-                return None, () # 404
-
-    
-    def add(self, split_path, method, endpoint, *argnames):
+    def add(self, split_path, method, endpoint, argnames=(), converters=(), wildcard=False):
         """ Adds route item"""
-        if len(split_path)==0:
-            if method is not None:
-                if method in self.methods:
-                    raise ValueError("Route with some method already exists.")
-                if len(argnames)>0:
-                    if self.routes is not None and len(self.routes)>0:
-                        raise ValueError("Route with some part of path already exists.")
-                    self.routes = None
-                self.methods[method] = (endpoint,)+argnames
-            else:
-                if len(self.methods)==0 and len(self.routes)==0:
-                    self.methods = endpoint.methods
-                    self.routes = endpoint.routes
-                else:
-                    raise ValueError("Route with some part of `script_name` already exists.")
+        item = self
+        for part in split_path:
+            if item.routes is None:
+                raise ValueError("Route with some part of path already exists.")
+            if part not in item.routes:
+                item.routes[part] = _RouteItem()
+            item = item.routes[part]
+        if method is not None:
+            if method in item.methods:
+                raise ValueError("Route with some method already exists.")
+            if len(argnames)>0:
+                if item.routes is not None and len(item.routes)>0:
+                    raise ValueError("Route with some part of path already exists.")
+                item.routes = None
+            item.methods[method] = (endpoint, tuple(argnames), tuple(converters), wildcard)
         else:
-            if self.routes is not None:
-                if split_path[0] not in self.routes:
-                    self.routes[split_path[0]] = _RouteItem()
-                self.routes[split_path[0]].add(split_path[1:], method, endpoint, *argnames)
+            if len(item.methods)==0 and len(item.routes)==0:
+                item.methods = endpoint.methods
+                item.routes = endpoint.routes
             else:
-                raise ValueError("Route with some part of path already exists.")
+                raise ValueError("Route with some part of `script_name` already exists.")
 
 
 class TraversalRouter(object):
-    """ Router based on traversal method. """
+    """ Router based on traversal method.
     
-    def __init__(self):
+    Route is a path which static parts may be followed by parameters: `:name`
+    is a part of path, `:name:type` is a part of path converted by function
+    from :attr:`converters`, `*name` is the rest of path. Missed trailing
+    parameters are None.
+    
+    :param cache_size: Max number of results of resolving kept in LRU cache
+        by request path and method, 0 disables cache. Cache is cleared when
+        routes are added.
+    """
+    
+    #: Converters of typed parameters, route isn't found if converter raises `ValueError`.
+    converters = {'int': int, 'float': float, 'str': str}
+    
+    def __init__(self, cache_size=0):
         self._views = dict()
+        self._urls = dict()        # view name -> names of urlvars -> (path, names, wildcard)
+        self._wildcards = set()    # items of views which last urlvar is wildcard
         self._routes = _RouteItem()
+        self._cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_hits = 0    #: Number of routes found in cache.
+        self.cache_misses = 0  #: Number of routes resolved because they aren't found in cache.
         
     def route(self, path_info, method):
         """Resolves route for request described given arguments
@@ -69,15 +80,66 @@ class TraversalRouter(object):
         :param method: Request method.
         :rtype: Tuple of two items: correspond method an its urlvars as dict.
         """
-        split_path = path_info.split('/')[1:]
-        split_path = [] if split_path==[''] else split_path
-        view, kwargs = self._routes(split_path, method)
+        if self.cache_size>0:
+            key = (path_info, method)
+            result = self._cache.get(key)
+            if result is not None:
+                self.cache_hits += 1
+                self._cache.move_to_end(key)
+            else:
+                self.cache_misses += 1
+                result = self._cache[key] = self._resolve(path_info, method)
+                if len(self._cache)>self.cache_size:
+                    self._cache.popitem(last=False)
+        else:
+            result = self._resolve(path_info, method)
+        view, kwargs = result
         if view is None:
             if len(kwargs)>0:
                 raise HTTPMethodNotAllowed(headers=[('Allow', ','.join(kwargs))])
             else:
                 raise HTTPNotFound()
-        return view, kwargs
+        # cached urlvars are copied since handler may change them
+        return view, dict(kwargs) if self.cache_size>0 else kwargs
+    
+    def _resolve(self, path_info, method):
+        """ Returns tuple of endpoint and its urlvars, or tuple of None and
+        allowed methods (it's empty if route isn't found). """
+        parts = path_info.split('/')
+        count = len(parts)
+        if count==2 and parts[1]=='':
+            count = 1
+        item = self._routes
+        pos = 1
+        while True:
+            found = item.methods.get(method)
+            if found is not None:
+                endpoint, argnames, converters, wildcard = found
+                if count-pos<=len(argnames) or wildcard:
+                    kwargs = dict.fromkeys(argnames)
+                    try:
+                        for name, convert in zip(argnames, converters):
+                            if pos==count:
+                                break
+                            elif convert is None:
+                                kwargs[name] = parts[pos]
+                            elif convert is True:
+                                kwargs[name] = '/'.join(parts[pos:count])
+                                break
+                            else:
+                                kwargs[name] = convert(parts[pos])
+                            pos += 1
+                    except ValueError:
+                        return None, ()
+                    return endpoint, kwargs
+            if item.routes and pos<count:
+                item = item.routes.get(parts[pos])
+                if item is not None:
+                    pos += 1
+                    continue
+            elif pos==count:
+                return None, tuple(item.methods)
+            return None, ()
     
     def add_route(self, route, method, view, **options):
         """ Adds route
@@ -88,56 +150,77 @@ class TraversalRouter(object):
         :param options: Additional keyword options.
         """
         argnames = list()
+        converters = list()
+        wildcard = False
         split_path = list()
         parts = route.split('/')[1:]
         parts = [] if parts==[''] else parts
         for part in parts:
-            if part[0]!=':':
-                if len(argnames)==0:
-                    split_path.append(part)
-                else:
-                    raise ValueError("Parameter 'path' has wrong value '{0}'.".format(path))
-            else:
+            if wildcard or (part[:1] not in (':', '*') and len(argnames)>0):
+                raise ValueError("Parameter 'route' has wrong value '{0}'.".format(route))
+            elif part[:1]==':':
+                name, _, type_name = part[1:].partition(':')
+                if type_name and type_name not in self.converters:
+                    raise ValueError("Unknown type of parameter in route '{0}'.".format(route))
+                argnames.append(name)
+                converters.append(self.converters[type_name] if type_name else None)
+            elif part[:1]=='*':
+                # converter of wildcard is True
+                wildcard = True
                 argnames.append(part[1:])
+                converters.append(True)
+            else:
+                split_path.append(part)
         try:
-            self._routes.add(split_path, method, view, *argnames)
+            self._routes.add(split_path, method, view, argnames, converters, wildcard)
         except ValueError:
             raise ValueError("Route bad or corresponding for '{0} {1}' already exists.".format(method, route))
+        self._cache.clear()
         # adds view name
         view_name = options.get('name', view.__name__)
         if view_name not in self._views:
             self._views[view_name] = list()
         item = ('/'+'/'.join(split_path),)+tuple(argnames)
+        if wildcard:
+            self._wildcards.add(item)
         if item not in self._views[view_name]:
             self._views[view_name].append(item)
             self._views[view_name] = list(reversed(sorted(self._views[view_name])))
+            self._compile_urls(view_name)
 
+    def _compile_urls(self, view_name):
+        """ Makes builders of URLs of view for every set of urlvars which
+        can be given to :meth:`url_for`, i.e. leading urlvars of routes. """
+        urls = self._urls[view_name] = dict()
+        for item in self._views[view_name]:
+            path, argnames = item[0], item[1:]
+            for N in range(len(argnames)+1):
+                wildcard = N==len(argnames) and item in self._wildcards
+                urls[frozenset(argnames[:N])] = (path, argnames[:N], wildcard)
             
     def url_for(self, view_name, **kwargs):
-        """ Returns URL for request endpoint (view)
+        """ Returns URL for request endpoint (view). Urlvars are percent-encoded,
+        slashes are kept only in value of wildcard.
         
         :param view_name: View name.
-        :param kwargs: Urlvars as keyword arguments.
-        :rtype: String contains reconstructed URL.
+        :param kwargs: Urlvars as keyword arguments, None values are skipped.
+        :rtype: String contains reconstructed URL or None if route isn't found.
         """
-        result = None
-        found_none = False
-        for item in self._views.get(view_name, list()):
-            path, argnames = item[0], item[1:]
-            if len(argnames)>=len(kwargs.keys()) and set(kwargs.keys()).issubset(set(argnames)):
-                result = path.split('/')
-                for name in argnames:
-                    part = kwargs.get(name)
-                    found_none = True if part is None else found_none
-                    if part is not None:
-                        if not found_none:
-                            result.append(part)
-                        else:
-                            result = None
-                            break
-        if result is not None:
-            result = '/'.join(result)
-        return result
+        urls = self._urls.get(view_name)
+        if urls is None:
+            return None
+        if None in kwargs.values():
+            kwargs = {name: value for name, value in kwargs.items() if value is not None}
+        url = urls.get(frozenset(kwargs))
+        if url is None:
+            return None
+        path, argnames, wildcard = url
+        if not argnames:
+            return path
+        parts = [quote(str(kwargs[name]), safe='') for name in argnames]
+        if wildcard:
+            parts[-1] = quote(str(kwargs[argnames[-1]]), safe='/')
+        return path.rstrip('/')+'/'+'/'.join(parts)
     
     def update(self, script_name, sub_router):
         """ Updates current routers with info from sub routes. It is need for bins sub application.
@@ -152,6 +235,7 @@ class TraversalRouter(object):
         split_path = [] if split_path==[''] else split_path
         if len(split_path)!=0:
             self._routes.add(split_path, None, sub_router._routes)
+            self._cache.clear()
         else:
             raise ValueError("Wrong value '{0}' in parameter 'script_name'".format(script_name))
         # views
@@ -160,5 +244,8 @@ class TraversalRouter(object):
             for N in range(len(value)):
                 path, argnames = value[N][0], value[N][1:]
                 path = script_name if path=='/' else script_name+path
+                if value[N] in sub_router._wildcards:
+                    self._wildcards.add((path,) + argnames)
                 value[N] = (path,) + argnames
-            self._views[view_name] = value        
+            self._views[view_name] = value
+            self._compile_urls(view_name)        
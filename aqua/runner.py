@@ -0,0 +1,349 @@
+"""
+aqua.runner -- Multi-process server
+===================================
+
+This module provides the pre-forking server runner. The master process
+forks worker processes, each of them runs its own event loop and serves
+connections by instance of application. Workers bind own listening sockets
+with `SO_REUSEPORT` where it's available, so kernel balances connections
+between them, otherwise they share the socket opened by master.
+
+Master supervises workers: worker which exited is started again, worker
+which event loop doesn't send heartbeat within :attr:`Runner.heartbeat_timeout`
+is killed and started again. Signals of master:
+
+* `SIGHUP` -- graceful restart: new workers are started (application is
+  imported again by them), then old workers are stopped gracefully.
+* `SIGTERM`, `SIGINT` -- graceful stop.
+
+Workers are stopped gracefully by `SIGTERM`: they stop accepting connections
+and exit when they finish current work or :attr:`Runner.graceful_timeout` expires.
+
+Runner requires POSIX system. It's available as console command::
+
+    $ aqua --port 5000 --workers 4 mymodule:MyApplication
+
+Application is given as `module:name` where `name` is class of application
+or function which takes event loop and returns protocol factory.
+"""
+import os
+import sys
+import time
+import fcntl
+import signal
+import select
+import socket
+import asyncio
+import logging
+import argparse
+import importlib
+
+logger = logging.getLogger('aqua.runner')
+
+_LOAD_ERROR = 3  # Exit status of worker which cannot load or start application
+
+
+def load_app(spec):
+    """ Imports application by `module:name` string.
+
+    :param spec: String of module name and name of object in module separated by colon.
+    :rtype: Object of application (class or factory function).
+    """
+    module_name, sep, name = spec.partition(':')
+    if not sep or not module_name or not name:
+        raise ValueError("Application must be given as 'module:name' instead of '{0}'.".format(spec))
+    obj = importlib.import_module(module_name)
+    for attr in name.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def make_socket(host, port, reuse_port=False, backlog=1024):
+    """ Returns non-blocking listening socket.
+
+    :param host: Host name or address.
+    :param port: Port number.
+    :param reuse_port: If True socket is bound with `SO_REUSEPORT` option.
+    :param backlog: Max size of queue of pending connections.
+    """
+    family, type_, proto, _, address = socket.getaddrinfo(
+        host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE)[0]
+    sock = socket.socket(family, type_, proto)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(address)
+        sock.listen(backlog)
+        sock.setblocking(False)
+    except:
+        sock.close()
+        raise
+    return sock
+
+
+class Runner(object):
+    """ Pre-forking server runner.
+
+    :param app: Class of application or function which takes event loop
+        and returns protocol factory, or `module:name` string of them which
+        is imported by workers.
+    :param host: Host name or address to listen.
+    :param port: Port number to listen.
+    :param workers: Number of worker processes, by default number of CPUs.
+    :param reuse_port: If True every worker binds own socket with `SO_REUSEPORT`,
+        otherwise workers share socket opened by master. By default it's True
+        if `SO_REUSEPORT` is available.
+    :param backlog: Max size of queue of pending connections.
+    """
+
+    heartbeat = 1.0           #: Interval in seconds between heartbeats of worker.
+    heartbeat_timeout = 30.0  #: Worker is killed if it doesn't send heartbeat within this time.
+    graceful_timeout = 30.0   #: Time in seconds given to worker to finish work when it's stopped.
+
+    def __init__(self, app, host='127.0.0.1', port=5000, workers=None, reuse_port=None, backlog=1024):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.reuse_port = hasattr(socket, 'SO_REUSEPORT') if reuse_port is None else reuse_port
+        self.backlog = backlog
+        self.socket = None        # socket shared by workers
+        self._workers = dict()    # pid -> [read end of heartbeat pipe, time of last heartbeat]
+        self._signals = list()    # received signals which aren't processed yet
+        self._running = False
+        self._exit_status = 0
+
+    def run(self):
+        """ Starts workers and supervises them until stop. Returns exit status. """
+        if not self.reuse_port:
+            self.socket = make_socket(self.host, self.port, backlog=self.backlog)
+        wakeup_read, wakeup_write = os.pipe()
+        for fd in (wakeup_read, wakeup_write):
+            self._set_flags(fd)
+        handlers = dict()
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            handlers[signum] = signal.signal(signum, self._signal)
+        old_wakeup = signal.set_wakeup_fd(wakeup_write)
+        logger.info('Listening on %s:%s by %s workers', self.host, self.port, self.workers)
+        self._running = True
+        try:
+            for N in range(self.workers):
+                self.spawn()
+            while self._running or self._workers:
+                self._supervise(wakeup_read)
+        finally:
+            signal.set_wakeup_fd(old_wakeup)
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+            os.close(wakeup_read)
+            os.close(wakeup_write)
+            if self.socket is not None:
+                self.socket.close()
+        return self._exit_status
+
+    def spawn(self):
+        """ Forks new worker process. """
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid==0:
+            status = 0
+            try:
+                os.close(read_fd)
+                for worker in self._workers.values():
+                    os.close(worker[0])
+                status = self.worker(write_fd)
+            except SystemExit as exc:
+                status = exc.code
+            except:
+                logger.exception('Worker %s failed', os.getpid())
+                status = 1
+            finally:
+                os._exit(status or 0)
+        os.close(write_fd)
+        self._set_flags(read_fd)
+        self._workers[pid] = [read_fd, time.monotonic()]
+        logger.info('Worker %s started', pid)
+        return pid
+
+    def stop(self):
+        """ Stops workers gracefully and finishes supervising. """
+        self._running = False
+        for pid in list(self._workers):
+            self._kill(pid, signal.SIGTERM)
+
+    def restart(self):
+        """ Starts new workers and stops old ones gracefully. """
+        old_workers = list(self._workers)
+        for N in range(self.workers):
+            self.spawn()
+        for pid in old_workers:
+            self._kill(pid, signal.SIGTERM)
+
+    def worker(self, heartbeat_fd):
+        """ Runs worker, it's called in forked process.
+
+        :param heartbeat_fd: Write end of pipe which heartbeats are sent to.
+        :rtype: Exit status of worker.
+        """
+        signal.set_wakeup_fd(-1)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        try:
+            app = load_app(self.app) if isinstance(self.app, str) else self.app
+        except Exception:
+            logger.exception('Cannot load application %r', self.app)
+            return _LOAD_ERROR
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            sock = self.socket
+            if sock is None:
+                sock = make_socket(self.host, self.port, True, self.backlog)
+            factory = app(loop)
+            if hasattr(factory, 'create_server'):
+                server = loop.run_until_complete(factory.create_server(sock=sock))
+            else:
+                server = loop.run_until_complete(loop.create_server(factory, sock=sock))
+        except Exception:
+            # worker started again would fail the same way
+            logger.exception('Cannot start application %r', self.app)
+            loop.close()
+            return _LOAD_ERROR
+        stopping = []
+
+        def beat():
+            try:
+                os.write(heartbeat_fd, b'.')
+            except BlockingIOError:
+                pass
+            except BrokenPipeError:
+                logger.error('Master process is gone, stopping worker %s', os.getpid())
+                stop()
+                return
+            loop.call_later(self.heartbeat, beat)
+
+        def stop():
+            if not stopping:
+                stopping.append(asyncio.Task(self.shutdown(loop, server, factory), loop=loop))
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stop)
+        beat()
+        try:
+            loop.run_forever()
+        finally:
+            server.close()
+            loop.close()
+        return 0
+
+    @asyncio.coroutine
+    def shutdown(self, loop, server, factory):
+        """ Stops accepting connections and stops event loop of worker when
+        requests are finished (see :meth:`aqua.app.Application.shutdown`) or
+        :attr:`graceful_timeout` expires. """
+        server.close()
+        try:
+            if hasattr(factory, 'shutdown'):
+                yield from factory.shutdown(self.graceful_timeout)
+            else:
+                yield from asyncio.wait_for(server.wait_closed(), self.graceful_timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            loop.stop()
+
+    def _signal(self, signum, frame):
+        self._signals.append(signum)
+
+    def _supervise(self, wakeup_fd):
+        """ Waits for heartbeats and signals, processes them. """
+        pipes = {worker[0]: pid for pid, worker in self._workers.items()}
+        try:
+            ready = select.select([wakeup_fd]+list(pipes), [], [], self.heartbeat)[0]
+        except InterruptedError:
+            ready = []
+        now = time.monotonic()
+        for fd in ready:
+            try:
+                while os.read(fd, 1024):
+                    if fd!=wakeup_fd:
+                        self._workers[pipes[fd]][1] = now
+                    else:
+                        break
+            except BlockingIOError:
+                pass
+        while self._signals:
+            signum = self._signals.pop(0)
+            if signum==signal.SIGHUP and self._running:
+                logger.info('Restarting workers')
+                self.restart()
+            elif signum in (signal.SIGTERM, signal.SIGINT) and self._running:
+                logger.info('Stopping workers')
+                self.stop()
+        self._reap()
+        for pid, worker in list(self._workers.items()):
+            if now-worker[1]>self.heartbeat_timeout:
+                logger.error('Worker %s does not respond, killing it', pid)
+                worker[1] = now
+                self._kill(pid, signal.SIGKILL)
+
+    def _reap(self):
+        """ Collects exited workers and starts new ones instead of them. """
+        while self._workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid==0:
+                break
+            worker = self._workers.pop(pid, None)
+            if worker is None:
+                continue
+            os.close(worker[0])
+            code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+            logger.info('Worker %s exited with status %s', pid, code)
+            if code==_LOAD_ERROR:
+                logger.error('Application cannot be loaded or started, stopping')
+                self._exit_status = _LOAD_ERROR
+                self.stop()
+            elif self._running and len(self._workers)<self.workers:
+                self.spawn()
+
+    def _kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    @staticmethod
+    def _set_flags(fd):
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+
+def main(args=None):
+    """ Entry point of `aqua` console command. """
+    parser = argparse.ArgumentParser(prog='aqua', description='Runs aqua application by several worker processes.')
+    parser.add_argument('app', help="application as 'module:name'")
+    parser.add_argument('--host', default='127.0.0.1', help='host to listen (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=5000, help='port to listen (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--no-reuse-port', action='store_true', help='share one listening socket instead of SO_REUSEPORT')
+    parser.add_argument('--backlog', type=int, default=1024, help='size of queue of pending connections')
+    parser.add_argument('--graceful-timeout', type=float, default=Runner.graceful_timeout,
+                        help='seconds given to worker to finish work on stop (default: %(default)s)')
+    parser.add_argument('--log-level', default='INFO', help='logging level (default: %(default)s)')
+    options = parser.parse_args(args)
+    logging.basicConfig(level=getattr(logging, options.log_level.upper()),
+                        format='%(asctime)s [%(process)d] %(levelname)s %(message)s')
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    runner = Runner(options.app, options.host, options.port, options.workers,
+                    False if options.no_reuse_port else None, options.backlog)
+    runner.graceful_timeout = options.graceful_timeout
+    return runner.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""
+aqua.static -- Static files
+===========================
+
+This module provides the handler of static files. Files are sent by
+:class:`aqua.http.FileWrapper`, so :class:`aqua.http.Connection` uses
+:meth:`asyncio.AbstractEventLoop.sendfile` where it's possible and content
+of files isn't read to Python buffers. The handler supports conditional
+requests (`If-None-Match`, `If-Modified-Since`) and single byte range
+requests (`Range`, `If-Range`).
+
+Opened files and their metadata can be kept in :class:`FileCache`, so
+serving of frequently requested file doesn't need to open and stat it.
+
+Handler can serve precompressed siblings of files (`style.css.br`,
+`style.css.gz`) to clients which accept their encoding, so static files
+are compressed once when they are deployed.
+
+Use :meth:`aqua.app.BaseApplication.add_static` to add route which serves
+static files from directory.
+"""
+import os
+import stat
+import time
+import mimetypes
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_tz, mktime_tz
+from webob.exc import HTTPNotFound
+from aqua.http import Response, FileWrapper
+from aqua.compress import accepted_encoding
+
+
+class FileInfo(object):
+    """ Opened file and its metadata. File is closed when it's discarded
+    and all files returned by :meth:`open` are closed.
+
+    :param path: Path of file.
+    :raises OSError: If file cannot be opened or it isn't regular file.
+    """
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0))
+        try:
+            info = os.fstat(self.fd)
+            if not stat.S_ISREG(info.st_mode):
+                raise OSError('Not a regular file: {0}'.format(path))
+        except:
+            os.close(self.fd)
+            raise
+        self.size = info.st_size  #: Size of file.
+        self.mtime = int(info.st_mtime)  #: Time of last modification.
+        self.etag = '"{0:x}-{1:x}"'.format(info.st_mtime_ns, info.st_size)  #: Value of `ETag` header.
+        self.last_modified = formatdate(info.st_mtime, usegmt=True)  #: Value of `Last-Modified` header.
+        #: Value of `Content-Type` header.
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self._refs = 0
+        self._discarded = False
+
+    def open(self):
+        """ Returns file object which can be used by concurrent responses, see :class:`SharedFile`. """
+        self._refs += 1
+        return SharedFile(self)
+
+    def release(self):
+        """ Called when file object returned by :meth:`open` is closed. """
+        self._refs -= 1
+        if self._discarded and self._refs==0:
+            os.close(self.fd)
+
+    def discard(self):
+        """ Marks that file isn't used anymore. """
+        if not self._discarded:
+            self._discarded = True
+            if self._refs==0:
+                os.close(self.fd)
+
+
+class SharedFile(object):
+    """ File object which reads file of :class:`FileInfo` by :func:`os.pread`,
+    it has own position so file can be sent by several responses at the same time. """
+
+    mode = 'rb'
+
+    def __init__(self, info):
+        self._info = info
+        self._pos = 0
+
+    def fileno(self):
+        return self._info.fd
+
+    def seek(self, pos, whence=0):
+        self._pos = pos if whence==0 else self._pos+pos if whence==1 else self._info.size+pos
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size<0:
+            size = max(self._info.size-self._pos, 0)
+        data = os.pread(self._info.fd, size, self._pos)
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        if self._info is not None:
+            self._info.release()
+            self._info = None
+
+
+class FileCache(object):
+    """ LRU cache of opened files and their metadata (:class:`FileInfo`).
+    Files which cannot be opened are cached too, so missing precompressed
+    siblings aren't looked up by every request.
+
+    :param max_entries: Max number of cached files.
+    :param ttl: Time in seconds while cached file is used without checking it's modified.
+    :param timer: Function returns current time.
+    """
+
+    def __init__(self, max_entries=1024, ttl=5.0, timer=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._timer = timer
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, path):
+        """ Returns :class:`FileInfo` of file. File is opened if it isn't in cache or it's expired.
+
+        :param key: Key of cache entry.
+        :param path: Function without parameters returns path of file, it's called only if file is opened.
+        :raises OSError: If file cannot be opened.
+        """
+        now = self._timer()
+        entry = self._entries.get(key)
+        if entry is not None:
+            info, expires = entry
+            if expires>now:
+                self._entries.move_to_end(key)
+                if info is None:
+                    raise OSError('File cannot be opened')
+                return info
+            del self._entries[key]
+            if info is not None:
+                info.discard()
+        try:
+            info = FileInfo(path())
+        except OSError:
+            self._add(key, None, now+self.ttl)
+            raise
+        self._add(key, info, now+self.ttl)
+        return info
+
+    def _add(self, key, info, expires):
+        self._entries[key] = (info, expires)
+        while len(self._entries)>self.max_entries:
+            info = self._entries.popitem(last=False)[1][0]
+            if info is not None:
+                info.discard()
+
+    def clear(self):
+        """ Removes all files from cache. """
+        for info, expires in self._entries.values():
+            if info is not None:
+                info.discard()
+        self._entries.clear()
+
+
+class StaticFiles(object):
+    """ Handler of static files.
+
+    :param path: Directory which files are served from.
+    :param cache: Instance of :class:`FileCache` or None if files aren't cached.
+    :param precompressed: If True siblings of files with suffixes from :attr:`encodings`
+        are served to clients which accept their encodings.
+    """
+
+    block_size = 64*1024  #: Size of block which file is sent by if sendfile is not available.
+    #: Encodings and suffixes of precompressed files in order of preference.
+    encodings = (('br', '.br'), ('gzip', '.gz'))
+
+    def __init__(self, path, cache=None, precompressed=False):
+        self.path = os.path.abspath(path)
+        self.cache = cache
+        self.precompressed = precompressed
+
+    def __call__(self, request, filename):
+        """ Returns response which sends file.
+
+        :param request: Instance of :class:`aqua.http.Request`.
+        :param filename: Path of file relative to directory.
+        """
+        environ = request.environ
+        if self.precompressed and 'HTTP_ACCEPT_ENCODING' in environ:
+            for encoding, suffix in self.encodings:
+                if accepted_encoding(environ['HTTP_ACCEPT_ENCODING'], (encoding,)) is not None:
+                    response = self.serve(environ, filename+suffix, encoding,
+                                          mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+                    if response is not None:
+                        return response
+        response = self.serve(environ, filename)
+        if response is None:
+            raise HTTPNotFound()
+        return response
+
+    def serve(self, environ, filename, encoding=None, content_type=None):
+        """ Returns response which sends file or None if file cannot be opened.
+
+        :param environ: Request environ variables.
+        :param filename: Path of file relative to directory.
+        :param encoding: Value of `Content-Encoding` header if file is compressed.
+        :param content_type: Value of `Content-Type` header, by default it's guessed by name of file.
+        """
+        try:
+            if self.cache is not None:
+                info = self.cache.get((self.path, filename), lambda: self.resolve(filename))
+                return self.response(environ, info, encoding, content_type)
+            info = FileInfo(self.resolve(filename))
+        except OSError:
+            return None
+        try:
+            return self.response(environ, info, encoding, content_type)
+        finally:
+            info.discard()
+
+    def resolve(self, filename):
+        """ Returns absolute path of file, raises :class:`webob.exc.HTTPNotFound`
+        if file is outside the directory. """
+        if not filename:
+            raise HTTPNotFound()
+        path = os.path.normpath(os.path.join(self.path, filename))
+        if not path.startswith(self.path + os.sep):
+            raise HTTPNotFound()
+        return path
+
+    def response(self, environ, info, encoding=None, content_type=None):
+        """ Returns response which sends file.
+
+        :param environ: Request environ variables.
+        :param info: Instance of :class:`FileInfo`.
+        :param encoding: Value of `Content-Encoding` header if file is compressed.
+        :param content_type: Value of `Content-Type` header, by default :attr:`FileInfo.content_type`.
+        """
+        size = info.size
+        headers = [('ETag', info.etag), ('Last-Modified', info.last_modified)]
+        if self.precompressed:
+            headers.append(('Vary', 'Accept-Encoding'))
+        if not_modified(environ, info.etag, info.mtime):
+            return Response(status='304 Not Modified', headerlist=headers)
+        headers.append(('Accept-Ranges', 'bytes'))
+        status, offset, count = '200 OK', 0, size
+        if 'HTTP_RANGE' in environ and if_range(environ, info.etag, info.last_modified):
+            byte_range = parse_range(environ['HTTP_RANGE'], size)
+            if byte_range==():
+                headers.append(('Content-Range', 'bytes */{0}'.format(size)))
+                return Response(status='416 Requested Range Not Satisfiable', headerlist=headers)
+            elif byte_range is not None:
+                offset, count = byte_range
+                status = '206 Partial Content'
+                headers.append(('Content-Range', 'bytes {0}-{1}/{2}'.format(offset, offset+count-1, size)))
+        headers.insert(0, ('Content-Type', content_type or info.content_type))
+        headers.insert(1, ('Content-Length', str(count)))
+        if encoding is not None:
+            headers.append(('Content-Encoding', encoding))
+        app_iter = FileWrapper(info.open(), self.block_size, offset, count)
+        return Response(status=status, headerlist=headers, app_iter=app_iter)
+
+
+def not_modified(environ, etag, mtime):
+    """ Checks conditional headers of request, returns True if file isn't modified.
+
+    :param environ: Request environ variables.
+    :param etag: ETag of file.
+    :param mtime: Time of last modification of file.
+    """
+    if 'HTTP_IF_NONE_MATCH' in environ:
+        value = environ['HTTP_IF_NONE_MATCH'].strip()
+        return value=='*' or etag in [item.strip() for item in value.split(',')]
+    if 'HTTP_IF_MODIFIED_SINCE' in environ:
+        since = parsedate_tz(environ['HTTP_IF_MODIFIED_SINCE'])
+        return since is not None and mtime<=mktime_tz(since)
+    return False
+
+
+def if_range(environ, etag, last_modified):
+    """ Returns True if `Range` header must be applied according to `If-Range` header. """
+    value = environ.get('HTTP_IF_RANGE')
+    return value is None or value.strip() in (etag, last_modified)
+
+
+def parse_range(value, size):
+    """ Parses value of `Range` header.
+
+    :param value: Value of header.
+    :param size: Size of file.
+    :rtype: Tuple of offset and count of bytes; empty tuple if range
+        is not satisfiable; None if header is wrong or it contains several ranges.
+    """
+    unit, _, ranges = value.partition('=')
+    if unit.strip()!='bytes' or ',' in ranges:
+        return None
+    first, sep, last = ranges.strip().partition('-')
+    try:
+        if not sep:
+            return None
+        elif not first:
+            count = min(int(last), size)
+            return (size-count, count) if count>0 else ()
+        first = int(first)
+        last = int(last) if last else None
+    except ValueError:
+        return None
+    if last is not None and first>last:
+        return None
+    if first>=size:
+        return ()
+    last = size-1 if last is None else min(last, size-1)
+    return first, last-first+1
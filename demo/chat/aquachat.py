@@ -3,7 +3,6 @@ import time
 import os.path
 import asyncio
 import logging
-from webob.static import FileApp
 from webob.exc import HTTPFound
 from aqua.app import Application, handler
 from jinja2 import Environment, PackageLoader
@@ -13,16 +12,12 @@ class AquaChat(Application):
     def __init__(self, loop, **kwargs):
         Application.__init__(self, loop, **kwargs)
         self.static_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+        self.add_static('/static', self.static_path)
         self.jinja2_env = Environment(loader=PackageLoader('aquachat', 'templates'))
         self.jinja2_env.globals['url_for'] = self.url_for
         self.messages = list()
     
     
-    @handler(r'/static/:filename')
-    def static(self, request, filename):
-        """ Static file serve handler."""
-        return FileApp(os.path.join(self.static_path, filename))
-    
     def redirect(self, url):
         return HTTPFound(location=url)
     
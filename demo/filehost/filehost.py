@@ -2,7 +2,6 @@ import os.path
 import asyncio
 from os import listdir
 from jinja2 import Template
-from webob.static import FileApp
 from aqua.app import Application, handler
 
 template = Template("""<!DOCTYPE html>
@@ -24,14 +23,12 @@ class Filehost(Application):
     def __init__(self, loop, **kwargs):
         Application.__init__(self, loop, **kwargs)
         self.static_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
-
-    @handler(r'/static/:filename')
-    def static(self, request, filename):
-        return FileApp(os.path.join(self.static_path, filename))    
+        self.add_static('/static', self.static_path)
     
-    @handler('/')
+    @handler('/', executor='thread')
     def index(self, request):
-        def dir(path, files=[], prefix=None):
+        def dir(path, prefix=None):
+            files = []
             for filename in listdir(path):
                 if os.path.isfile(os.path.join(path, filename)):
                     filename = prefix+'/'+filename if prefix else filename
@@ -14,4 +14,11 @@ setup(
     install_requires = [
         'webob'
     ],    
+    extras_require = {
+        'json': ['ujson'],
+        'brotli': ['brotli'],
+    },
+    entry_points = {
+        'console_scripts': ['aqua = aqua.runner:main'],
+    },
 )
\ No newline at end of file
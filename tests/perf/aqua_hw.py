@@ -1,14 +1,14 @@
 import asyncio
 import logging
 from datetime import datetime
-from aqua.http import Response
+from aqua.http import WebobResponse
 from aqua.app import Application, handler
 
 class SampleApplication(Application):
     
     @handler('/:user')
     def hello(self, request, user):
-        response = Response("Hello, World!"*1024)
+        response = WebobResponse("Hello, World!"*1024)
         response.date = datetime.now()
         response.server = 'AquaServer/0.1.5dev'
         response.etag = '000000000000000000000000000000000000009e'
@@ -0,0 +1,322 @@
+""" Benchmark suite of HTTP server.
+
+Starts server of :class:`BenchApplication` in subprocess (or by
+:class:`aqua.runner.Runner` with several workers, or in the process of
+benchmark) and drives it by built-in asyncio load generator. Scenarios:
+
+* `hello` -- GET of small response by keep-alive connections.
+* `pipelined` -- the same requests sent by batches without waiting responses.
+* `post` -- POST requests with 16 KiB body.
+* `large` -- GET of 1 MiB response.
+* `routes` -- GET of 200 different routes with urlvars.
+* `json` -- GET of dictionary serialized to JSON.
+* `cached` -- GET of response served from cache of responses.
+
+Report contains throughput, latency percentiles and RSS of server for
+every scenario, it's printed as JSON or written to file, so results of
+commits can be compared::
+
+    $ python tests/perf/bench.py --output before.json
+    $ git checkout feature
+    $ python tests/perf/bench.py --output after.json --compare before.json
+
+Latency of pipelined request is measured from sending of its batch.
+In-process server shares CPU with load generator, so its results are
+only comparable with results of the same mode.
+
+$ python tests/perf/bench.py [--server subprocess|inprocess] [--workers N]
+      [--duration 5] [--connections 50] [--scenario NAME ...]
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import itertools
+import subprocess
+from aqua.app import Application, handler
+from aqua.http import Response
+from aqua.metrics import Histogram
+
+ROUTES = 200
+LARGE = b'0123456789abcdef'*64*1024
+POST_BODY = b'x'*16*1024
+
+
+class BenchApplication(Application):
+    """ Application which serves requests of scenarios. """
+
+    def __init__(self, loop=None):
+        Application.__init__(self, loop)
+        for N in range(ROUTES):
+            self.add_route('/r{0}/item/:id:int'.format(N), 'GET', BenchApplication.item, name='r{0}'.format(N))
+
+    @handler('/hello')
+    def hello(self, request):
+        return Response('Hello, World!')
+
+    @handler('/large')
+    def large(self, request):
+        return LARGE
+
+    @handler('/echo', 'POST')
+    def echo(self, request):
+        yield from request.finish_reading()
+        return str(len(request.body))
+
+    @handler('/json')
+    def json(self, request):
+        return {'message': 'Hello, World!', 'items': list(range(10))}
+
+    @handler('/cached', cache_ttl=60)
+    def cached(self, request):
+        return {'message': 'Hello, World!', 'items': list(range(10))}
+
+    @asyncio.coroutine
+    def item(self, request, id):
+        return str(id)
+
+
+def get(path):
+    return 'GET {0} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(path).encode()
+
+
+#: Scenarios: name -> (number of pipelined requests, list of requests which are sent in turn).
+SCENARIOS = {
+    'hello': (1, [get('/hello')]),
+    'pipelined': (16, [get('/hello')]),
+    'post': (1, [b'POST /echo HTTP/1.1\r\nHost: localhost\r\nContent-Length: 16384\r\n\r\n'+POST_BODY]),
+    'large': (1, [get('/large')]),
+    'routes': (1, [get('/r{0}/item/{1}'.format(N, N*7)) for N in range(ROUTES)]),
+    'json': (1, [get('/json')]),
+    'cached': (1, [get('/cached')]),
+}
+
+
+@asyncio.coroutine
+def read_response(reader):
+    """ Reads response, returns its status code and size of body. """
+    status = yield from reader.readline()
+    if not status:
+        raise ConnectionResetError('Connection closed by server')
+    length = None
+    chunked = False
+    while True:
+        line = yield from reader.readline()
+        if line==b'\r\n':
+            break
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        if name==b'content-length':
+            length = int(value)
+        elif name==b'transfer-encoding':
+            chunked = value.strip().lower()==b'chunked'
+    size = 0
+    if chunked:
+        while True:
+            chunk = int((yield from reader.readline()).split(b';')[0], 16)
+            yield from reader.readexactly(chunk+2)
+            size += chunk
+            if chunk==0:
+                break
+    elif length:
+        yield from reader.readexactly(length)
+        size = length
+    return int(status.split()[1]), size
+
+
+@asyncio.coroutine
+def client(loop, host, port, depth, requests, deadline, result):
+    """ Sends requests by one connection until deadline. """
+    reader, writer = yield from asyncio.open_connection(host, port)
+    requests = itertools.cycle(requests)
+    latency = result['latency']
+    try:
+        while loop.time()<deadline:
+            batch = [next(requests) for N in range(depth)]
+            started = time.perf_counter()
+            writer.write(b''.join(batch))
+            for data in batch:
+                status, size = yield from read_response(reader)
+                latency.record(time.perf_counter()-started)
+                result['requests'] += 1
+                result['bytes'] += size
+                if status>=400:
+                    result['errors'] += 1
+    except (OSError, asyncio.IncompleteReadError):
+        result['errors'] += 1
+    finally:
+        writer.close()
+
+
+@asyncio.coroutine
+def load(loop, host, port, scenario, duration, connections):
+    """ Runs scenario by several connections, returns its results. """
+    depth, requests = SCENARIOS[scenario]
+    result = dict(requests=0, errors=0, bytes=0, latency=Histogram())
+    started = time.perf_counter()
+    deadline = loop.time()+duration
+    yield from asyncio.gather(*[client(loop, host, port, depth, requests[N%len(requests):]+requests[:N%len(requests)],
+                                       deadline, result) for N in range(connections)])
+    seconds = time.perf_counter()-started
+    latency = result.pop('latency')
+    result.update(seconds=seconds, throughput=result['requests']/seconds,
+                  latency={name: value for name, value in latency.summary((50, 99, 99.9)).items()
+                           if name not in ('count', 'sum')})
+    return result
+
+
+def rss(pid):
+    """ Returns current and peak RSS in KiB of process and its children or None if it's unknown. """
+    pids = [pid]
+    try:
+        with open('/proc/{0}/task/{0}/children'.format(pid)) as children:
+            pids.extend(int(child) for child in children.read().split())
+    except OSError:
+        pass
+    current = peak = 0
+    for pid in pids:
+        try:
+            with open('/proc/{0}/status'.format(pid)) as status:
+                values = dict(line.split(':', 1) for line in status if line.startswith(('VmRSS', 'VmHWM')))
+        except OSError:
+            return None
+        current += int(values['VmRSS'].split()[0])
+        peak += int(values['VmHWM'].split()[0])
+    return dict(rss_kib=current, peak_rss_kib=peak)
+
+
+def free_port(host):
+    sock = socket.socket()
+    try:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+@asyncio.coroutine
+def wait_server(host, port, timeout=10.0):
+    deadline = time.monotonic()+timeout
+    while True:
+        try:
+            reader, writer = yield from asyncio.open_connection(host, port)
+        except OSError:
+            if time.monotonic()>deadline:
+                raise
+            yield from asyncio.sleep(0.05)
+        else:
+            writer.close()
+            return
+
+
+def serve(host, port, workers):
+    """ Runs server of :class:`BenchApplication`, it's called in subprocess. """
+    if workers>1:
+        from aqua.runner import Runner
+        return Runner(BenchApplication, host, port, workers).run()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    app = BenchApplication(loop)
+    loop.run_until_complete(app.create_server(host, port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def commit():
+    """ Returns hash of current git commit or None. """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(options):
+    """ Runs scenarios, returns report. """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    host = options.host
+    port = free_port(host)
+    process = server = None
+    if options.server=='inprocess':
+        server = loop.run_until_complete(BenchApplication(loop).create_server(host, port))
+        pid = os.getpid()
+    else:
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve',
+                                    '--host', host, '--port', str(port), '--workers', str(options.workers)])
+        pid = process.pid
+    report = dict(commit=commit(), python=platform.python_version(), server=options.server,
+                  workers=options.workers, connections=options.connections, duration=options.duration,
+                  scenarios=dict())
+    try:
+        loop.run_until_complete(wait_server(host, port))
+        for scenario in options.scenario or sorted(SCENARIOS):
+            result = loop.run_until_complete(load(loop, host, port, scenario, options.duration, options.connections))
+            result['rss'] = rss(pid)
+            report['scenarios'][scenario] = result
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if server is not None:
+            server.close()
+        loop.close()
+    return report
+
+
+def compare(report, baseline):
+    """ Prints ratios of throughput and p99 latency of report to baseline. """
+    print('{0:<12} {1:>14} {2:>10} {3:>14} {4:>10}'.format('scenario', 'requests/sec', 'ratio', 'p99 ms', 'ratio'))
+    for name, result in sorted(report['scenarios'].items()):
+        base = baseline['scenarios'].get(name)
+        p99 = result['latency']['p99']
+        throughput_ratio = p99_ratio = float('nan')
+        if base is not None:
+            if base['throughput']:
+                throughput_ratio = result['throughput']/base['throughput']
+            if base['latency']['p99'] and p99 is not None:
+                p99_ratio = p99/base['latency']['p99']
+        print('{0:<12} {1:>14.0f} {2:>10.2f} {3:>14.2f} {4:>10.2f}'.format(
+            name, result['throughput'], throughput_ratio, (p99 or 0)*1000, p99_ratio))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Runs benchmark of HTTP server.')
+    parser.add_argument('--server', choices=('subprocess', 'inprocess'), default='subprocess')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes of server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of every scenario')
+    parser.add_argument('--connections', type=int, default=50, help='number of concurrent connections')
+    parser.add_argument('--scenario', nargs='+', choices=sorted(SCENARIOS),
+                        help='scenarios to run, by default all')
+    parser.add_argument('--output', help='file which report is written to')
+    parser.add_argument('--compare', help='file of previous report to compare with')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    options = parser.parse_args(args)
+    if options.serve:
+        return serve(options.host, options.port, options.workers)
+    if options.server=='inprocess' and options.workers>1:
+        parser.error('several workers require subprocess server')
+    report = run(options)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as output:
+            output.write(text+'\n')
+    else:
+        print(text)
+    if options.compare:
+        with open(options.compare) as baseline:
+            compare(report, json.load(baseline))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+""" Micro-benchmark of HTTP request header parsing and response writing.
+
+Compares :func:`aqua.http.parse_environ` with the previous implementation
+and measures :meth:`aqua.http.Connection.data_received` when request headers
+come in one chunk and split over many TCP segments.
+
+Also compares :meth:`aqua.http.Connection.response` with the previous
+implementation which wrote each response line by separate call of
+``transport.write``. Both serve keep-alive requests over a connected TCP socket
+pair with the real transport of event loop, requests are pipelined by
+batches of :data:`DEPTH` (responses are the same as in ``aqua_cn.py``).
+Client and server share one event loop, so throughput is only comparable
+between lines of the same report.
+
+$ python tests/perf/http_bench.py [number]
+"""
+import re
+import sys
+import time
+import socket
+import timeit
+import asyncio
+import aqua.http
+
+REQUEST = (b'GET /wiki/HTTP%20%D0%97%D0%B0%D0%BF%D1%80%D0%BE%D1%81?last=Y&K HTTP/1.1\r\n'
+           b'Host: ru.wikipedia.org\r\n'
+           b'User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:29.0) Gecko/20100101 Firefox/29.0\r\n'
+           b'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n'
+           b'Accept-Language: en-US,en;q=0.5\r\n'
+           b'Accept-Encoding: gzip, deflate\r\n'
+           b'Cookie: c1=100; c5=500\r\n'
+           b'Connection: keep-alive\r\n'
+           b'\r\n')
+
+
+_quoted_slash = re.compile(b'(?i)%2F')
+
+def legacy_parse_environ(data):
+    """ Previous implementation of :func:`aqua.http.parse_environ`. """
+    lines = data.split(b'\r\n')
+    method, uri, version = lines[0].split(b' ')
+    parts = uri.split(b'?', 1)
+    path, query = parts[0], parts[1] if len(parts)==2 else b''
+    atoms = [aqua.http.unquote_bytes(x) for x in _quoted_slash.split(path)]
+    path = b'%2F'.join(atoms)
+    result = dict(
+        zip(('REQUEST_METHOD','REQUEST_URI','SERVER_PROTOCOL','SCRIPT_NAME', 'PATH_INFO', 'QUERY_STRING'),
+             map(lambda item: item.decode('ISO-8859-1') ,(method, uri, version, b'', path, query))))
+    name = None
+    for item in map(lambda item: item.decode('ISO-8859-1'), lines[1:]):
+        if item=='':
+            break
+        elif item[0] in (' ', '\t'):
+            result[name] += item[0].strip()
+        else:
+            name, value = map(str.strip, item.split(':',1))
+            name = name.upper().replace('-','_')
+            if name not in ('CONTENT_TYPE','CONTENT_LENGTH'):
+                name = 'HTTP_' + name
+            if name in result:
+                result[name] += ', ' + value
+            else:
+                result[name] = value
+    return result
+
+
+class BenchTransport(object):
+    def write(self, data):
+        pass
+    def close(self):
+        pass
+    def get_extra_info(self, name):
+        return ('127.0.0.1', 5000)
+
+
+class BenchConnection(aqua.http.Connection):
+    
+    keepalive_timeout = 0
+    
+    def request_handler(self, connection, environ):
+        self._environ = None
+        self.timeout = 0
+
+
+def feed(connection, segments):
+    for data in segments:
+        connection.data_received(data)
+
+
+class SampleConnection(aqua.http.Connection):
+    """ Connection which answers by response of ``aqua_cn.py`` with body of :attr:`body`. """
+    
+    body = b'Hello, World!'
+    
+    def request_handler(self, connection, environ):
+        connection.response('200 OK',
+                [('Content-Type', 'text/html; charset=UTF-8'),
+                 ('Content-Length', str(len(self.body))),
+                 ('Date','Sat, 17 May 2014 19:05:24 GMT'),
+                 ('Server','AquaServer/0.1.5dev'),
+                 ('ETag','"000000000000000000000000000000000000009e"'),
+                ],[self.body])
+
+
+class LegacyConnection(SampleConnection):
+    """ Connection with previous implementation of :meth:`aqua.http.Connection.response`. """
+    
+    def response(self, status, headers, app_iter):
+        code = self._status = int(status.split(' ')[0])
+        if code<400:
+            if 'HTTP_CONNECTION' in self._environ:
+                close_connection = (self._environ['HTTP_CONNECTION']=='close')
+            else:
+                close_connection = (self._environ['SERVER_PROTOCOL']<'HTTP/1.1')
+        else:
+            close_connection = True
+        self.transport.write("{0} {1}\r\n".format(self._environ['SERVER_PROTOCOL'], status).encode('ISO-8859-1'))
+        for name, value in headers:
+            if not close_connection and name=='Connection':
+                close_connection = (value=='close')
+            self.transport.write('{0}: {1}\r\n'.format(name, value).encode('ISO-8859-1'))
+        self.transport.write(b'\r\n')
+        for data in app_iter:
+            self.transport.write(data)
+        self.finish_response(close_connection)
+
+
+class CountingTransport(object):
+    """ Proxy of transport which counts calls of ``write``. """
+    
+    def __init__(self, transport):
+        self.transport = transport
+        self.writes = 0
+    
+    def write(self, data):
+        self.writes += 1
+        self.transport.write(data)
+    
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+
+DEPTH = 16  #: Number of pipelined requests sent at once.
+
+
+@asyncio.coroutine
+def exchange(reader, writer, batches, size):
+    """ Sends batches of pipelined requests, returns the last batch of responses. """
+    for _ in range(batches):
+        writer.write(REQUEST*DEPTH)
+        data = yield from reader.readexactly(size*DEPTH)
+    return data
+
+
+@asyncio.coroutine
+def read_response(reader):
+    """ Reads response with `Content-Length` header, returns its size. """
+    size, length = 0, 0
+    line = None
+    while line!=b'\r\n':
+        line = yield from reader.readline()
+        size += len(line)
+        if line.startswith(b'Content-Length:'):
+            length = int(line[15:])
+    yield from reader.readexactly(length)
+    return size+length
+
+
+def socket_pair():
+    """ Returns server and client sides of TCP connection over loopback interface. """
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    client_sock = socket.create_connection(listener.getsockname())
+    server_sock = listener.accept()[0]
+    listener.close()
+    # small pipelined responses aren't delayed by Nagle's algorithm, like asyncio
+    # servers do since Python 3.6, so results depend on writes only
+    for sock in (server_sock, client_sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return server_sock, client_sock
+
+
+def serve(loop, factory, body, number):
+    """ Serves requests by connection over TCP socket pair, returns seconds,
+    writes per response and the last response. """
+    server_sock, client_sock = socket_pair()
+    factory.body = body
+    transport, connection = loop.run_until_complete(
+        loop.create_connection(lambda: factory(loop), sock=server_sock))
+    connection.transport = counter = CountingTransport(transport)
+    reader, writer = loop.run_until_complete(asyncio.open_connection(sock=client_sock, loop=loop))
+    # size of response is taken from the first one
+    writer.write(REQUEST)
+    size = loop.run_until_complete(read_response(reader))
+    counter.writes = 0
+    started = time.perf_counter()
+    data = loop.run_until_complete(exchange(reader, writer, number//DEPTH, size))
+    seconds = time.perf_counter()-started
+    writes = counter.writes/(number//DEPTH*DEPTH)
+    writer.close()
+    transport.close()
+    loop.run_until_complete(asyncio.sleep(0, loop=loop))
+    return seconds, writes, data[-size:]
+
+
+def report(name, number, seconds):
+    print('{0:<48} {1:>12.0f} requests/sec'.format(name, number/seconds))
+
+
+if __name__ == '__main__':
+    number = int(sys.argv[1]) if len(sys.argv)>1 else 100000
+    assert legacy_parse_environ(REQUEST)==aqua.http.parse_environ(REQUEST)
+    report('legacy parse_environ', number,
+           timeit.timeit(lambda: legacy_parse_environ(REQUEST), number=number))
+    report('parse_environ', number,
+           timeit.timeit(lambda: aqua.http.parse_environ(REQUEST), number=number))
+    
+    loop = asyncio.get_event_loop()
+    connection = BenchConnection(loop)
+    connection.connection_made(BenchTransport())
+    for size in (len(REQUEST), 64, 8):
+        segments = [REQUEST[i:i+size] for i in range(0, len(REQUEST), size)]
+        report('data_received ({0} segments)'.format(len(segments)), number,
+               timeit.timeit(lambda: feed(connection, segments), number=number))
+    
+    for body in (b'Hello, World!', b'Hello, World!'*1024):
+        results = dict()
+        for name, factory in (('legacy response', LegacyConnection), ('response', SampleConnection)):
+            seconds, writes, results[name] = serve(loop, factory, body, number//10)
+            report('{0} ({1} bytes body, {2:g} writes)'.format(name, len(body), writes), number//10//DEPTH*DEPTH, seconds)
+        assert results['legacy response']==results['response']
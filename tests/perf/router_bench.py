@@ -0,0 +1,125 @@
+""" Micro-benchmark of route resolution.
+
+Builds a few thousand synthetic routes (static routes, routes with
+parameters and routes of sub applications) and compares
+:meth:`aqua.router.TraversalRouter.route` with the previous recursive
+implementation and with the router which uses cache of resolved routes.
+
+$ python tests/perf/router_bench.py [number of resources]
+"""
+import sys
+import timeit
+import random
+from itertools import zip_longest
+from webob.exc import HTTPException, HTTPMethodNotAllowed, HTTPNotFound
+from aqua.router import TraversalRouter
+
+
+class LegacyRouteItem(object):
+    """ Previous implementation of :class:`aqua.router._RouteItem`. """
+    
+    def __init__(self):
+        self.routes = dict()
+        self.methods = dict()
+    
+    def __call__(self, split_path, method):
+        item = self.methods.get(method, (None,))
+        endpoint, argnames = item[0], item[1:]
+        if endpoint is not None and len(argnames)>=len(split_path):
+            return endpoint, dict(zip_longest(argnames, split_path))
+        elif self.routes is not None and len(split_path)>0 and split_path[0] in self.routes:
+            return self.routes[split_path[0]](split_path[1:], method)
+        else:
+            if len(split_path)==0:
+                return None, tuple(self.methods.keys())
+            else:
+                return None, ()
+    
+    def add(self, split_path, method, endpoint, *argnames):
+        if len(split_path)==0:
+            if len(argnames)>0:
+                self.routes = None
+            self.methods[method] = (endpoint,)+argnames
+        else:
+            if split_path[0] not in self.routes:
+                self.routes[split_path[0]] = LegacyRouteItem()
+            self.routes[split_path[0]].add(split_path[1:], method, endpoint, *argnames)
+
+
+class LegacyRouter(object):
+    """ Previous implementation of :meth:`aqua.router.TraversalRouter.route`. """
+    
+    def __init__(self):
+        self._routes = LegacyRouteItem()
+    
+    def route(self, path_info, method):
+        split_path = path_info.split('/')[1:]
+        split_path = [] if split_path==[''] else split_path
+        view, kwargs = self._routes(split_path, method)
+        if view is None:
+            if len(kwargs)>0:
+                raise HTTPMethodNotAllowed(headers=[('Allow', ','.join(kwargs))])
+            else:
+                raise HTTPNotFound()
+        return view, kwargs
+    
+    def add_route(self, route, method, view):
+        parts = route.split('/')[1:]
+        split_path = [part for part in parts if part[0]!=':']
+        argnames = [part[1:] for part in parts if part[0]==':']
+        self._routes.add(split_path, method, view, *argnames)
+
+
+def view():
+    pass
+
+
+def routes(resources):
+    """ Yields routes and paths which match them. """
+    for N in range(resources):
+        prefix = '/api/v{0}/resource{1}'.format(N%3, N)
+        yield prefix, prefix
+        yield prefix+'/list/all', prefix+'/list/all'
+        yield prefix+'/item/:id', prefix+'/item/{0}'.format(N)
+        yield prefix+'/field/:id/:field', prefix+'/field/{0}/name'.format(N)
+        yield '/site/section{0}/page/:slug'.format(N), '/site/section{0}/page/about'.format(N)
+
+
+def main(resources=1000):
+    items = list(routes(resources))
+    router, legacy = TraversalRouter(), LegacyRouter()
+    cached = TraversalRouter(cache_size=20000)
+    for route, path in items:
+        for method in ('GET', 'POST'):
+            router.add_route(route, method, view, name=route+method)
+            cached.add_route(route, method, view, name=route+method)
+            legacy.add_route(route, method, view)
+    paths = [path for route, path in items]
+    random.seed(0)
+    random.shuffle(paths)
+    paths = paths[:10000]
+    for path in paths:
+        assert router.route(path, 'GET')==legacy.route(path, 'GET')
+    print('{0} routes'.format(len(items)*2))
+    
+    def resolve(router):
+        route = router.route
+        for path in paths:
+            route(path, 'GET')
+    
+    def not_found(router):
+        route = router.route
+        for path in paths:
+            try:
+                route(path+'/missing/part/of/path', 'GET')
+            except HTTPException:
+                pass
+    
+    for name, func in (('resolve', resolve), ('not found', not_found)):
+        for title, value in (('legacy', legacy), ('current', router), ('cached', cached)):
+            best = min(timeit.repeat(lambda: func(value), number=1, repeat=5))
+            print('{0:10} {1:8} {2:10.0f} routes/s'.format(name, title, len(paths)/best))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,60 @@
+""" Micro-benchmark of connection timeouts.
+
+Sets timeouts of 10000 idle keep-alive connections and changes them as
+they are changed while request is processed (start of request, headers
+are received, keep-alive), then compares :meth:`asyncio.BaseEventLoop.call_later`
+with :class:`aqua.http.TimerWheel`: number of timers pushed to heap of event loop,
+size of heap and time.
+
+$ python tests/perf/timer_bench.py [number of connections] [number of requests]
+"""
+import sys
+import time
+import asyncio
+import aqua.http
+
+
+class TimerConnection(aqua.http.Connection):
+    """ Connection which isn't connected to transport. """
+    
+    def connection_timeout(self):
+        pass
+
+
+def run(loop, connections, requests, wheel):
+    timers = []
+    call_at = loop.call_at
+    def counted_call_at(*args, **kwargs):
+        timers.append(None)
+        return call_at(*args, **kwargs)
+    loop.call_at = counted_call_at
+    conns = [TimerConnection(loop) for N in range(connections)]
+    timer = aqua.http.TimerWheel(loop) if wheel else None
+    start = time.perf_counter()
+    for conn in conns:
+        conn.timer = timer
+        conn.timeout = conn.keepalive_timeout
+    for N in range(requests):
+        conn = conns[N%connections]
+        conn.timeout = conn.request_timeout
+        conn.timeout = 0
+        conn.timeout = conn.keepalive_timeout
+    elapsed = time.perf_counter()-start
+    heap = len(loop._scheduled)
+    for conn in conns:
+        conn.timeout = 0
+    loop.call_at = call_at
+    return len(timers), heap, elapsed
+
+
+def main(connections=10000, requests=100000):
+    print('{0} idle connections, {1} requests'.format(connections, requests))
+    for title, wheel in (('call_later', False), ('timer wheel', True)):
+        loop = asyncio.new_event_loop()
+        timers, heap, elapsed = run(loop, connections, requests, wheel)
+        loop.close()
+        print('{0:12} {1:8} timers pushed to heap, heap size {2:6}, {3:.3f} s'.format(title, timers, heap, elapsed))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import asyncio
+from nose.tools import assert_raises
 from aqua.app import BaseApplication, Application, handler
+from aqua.http import Request, Response, WebobResponse
 
 class SubApplication(BaseApplication):
     @handler('/:name')
@@ -20,6 +22,26 @@ class TestApplication(Application):
     @handler('/binary')
     def binary(self, request):
         return b'\t\t\t\t\t'
+    
+    @handler('/list')
+    def items(self, request):
+        return [1, "two", None]
+    
+    @handler('/count', json=True)
+    def count(self, request):
+        return 3
+    
+    @handler('/keys')
+    def keys(self, request):
+        return {1: 'a', 'big': 2**70}
+    
+    @handler('/webob')
+    def webob(self, request):
+        response = WebobResponse()
+        response.text = 'Webob'
+        response.content_type = 'text/plain'
+        response.etag = '1'
+        return response
 
 loop = asyncio.get_event_loop()
 app = TestApplication(asyncio.get_event_loop(), server_name='localhost')
@@ -69,7 +91,7 @@ def test_Router():
         environ['REQUEST_METHOD'] = 'GET'
         environ['PATH_INFO'] = '/binary'
         def response(*args):
-            assert args==('200 OK', [('Content-Type', 'application/octet-stream; charset=UTF-8'), ('Content-Length', '5')], [b'\t\t\t\t\t'])
+            assert args==('200 OK', [('Content-Type', 'application/octet-stream'), ('Content-Length', '5')], [b'\t\t\t\t\t'])
         connection.response = response
         yield from app.request_router(connection, environ)
 
@@ -105,6 +127,31 @@ def test_Router():
         yield from app.request_router(connection, environ)
 
     
+    @asyncio.coroutine
+    def test_07():
+        for path, body in (('/list', b'[1,"two",null]'), ('/count', b'3'),
+                           ('/keys', b'{"1":"a","big":1180591620717411303424}')):
+            environ = dict(app._app_environ.items())
+            environ['REQUEST_METHOD'] = 'GET'
+            environ['PATH_INFO'] = path
+            def response(*args):
+                assert args==('200 OK', [('Content-Type', 'application/json; charset=UTF-8'),
+                                         ('Content-Length', str(len(body)))], [body])
+            connection.response = response
+            yield from app.request_router(connection, environ)
+
+    @asyncio.coroutine
+    def test_08():
+        environ = dict(app._app_environ.items())
+        environ['REQUEST_METHOD'] = 'GET'
+        environ['PATH_INFO'] = '/webob'
+        def response(*args):
+            assert args[0]=='200 OK' and b''.join(args[2])==b'Webob'
+            assert ('Content-Type', 'text/plain; charset=UTF-8') in args[1] and ('ETag', '"1"') in args[1]
+        connection.response = response
+        yield from app.request_router(connection, environ)
+
+    
     loop.run_until_complete(asyncio.async(test_01()))
     loop.run_until_complete(asyncio.async(test_02()))
     loop.run_until_complete(asyncio.async(test_02a()))
@@ -112,6 +159,8 @@ def test_Router():
     loop.run_until_complete(asyncio.async(test_04()))
     loop.run_until_complete(asyncio.async(test_05()))
     loop.run_until_complete(asyncio.async(test_06()))
+    loop.run_until_complete(asyncio.async(test_07()))
+    loop.run_until_complete(asyncio.async(test_08()))
 
 
 def test_url_for():
@@ -126,7 +175,245 @@ def test_url_for():
     assert app.url_for('sub:hello:hello', name='ivan') is None
     assert app.url_for('sub:foo:index', name='ivan') is None
 
+def test_RequestResponse():
+    request = Request.blank('/user/%D0%B8%D0%B2%D0%B0%D0%BD?a=1&b=&a=2', headers={
+        'Cookie': 'c1=100; c2="x y"', 'Content-Type': 'text/plain; charset=UTF-8'})
+    assert request.method=='GET'
+    assert request.path_info=='/user/\u0438\u0432\u0430\u043d'
+    assert request.GET.getall('a')==['1', '2'] and request.GET['b']==''
+    assert request.cookies=={'c1': '100', 'c2': 'x y'}
+    assert request.headers['cookie'].startswith('c1=')
+    assert request.content_type=='text/plain'
+    assert request._webob is None
+    assert request.host=='localhost:80'
+    assert request._webob is not None
+    
+    response = Response('Index', headerlist=[('ETag', '"1"')], content_type='text/plain')
+    assert response.headerlist==[('ETag', '"1"'), ('Content-Type', 'text/plain; charset=UTF-8'), ('Content-Length', '5')]
+    assert response.headers['etag']=='"1"'
+    assert response.content_type=='text/plain' and response.content_length==5
+    assert response.status_code==200 and response.body==b'Index'
+    assert Response(b'\x00', content_type='image/png').headerlist==[('Content-Type', 'image/png'), ('Content-Length', '1')]
+    assert Response('{}', content_type='application/json').headerlist[0]==('Content-Type', 'application/json; charset=UTF-8')
+    assert Response('', content_type='image/svg+xml').headerlist[0]==('Content-Type', 'image/svg+xml; charset=UTF-8')
+    response = Response(status='304 Not Modified', headerlist=[])
+    assert response.headerlist==[] and response.app_iter==[]
+
+
+def test_Shutdown():
+    
+    class SlowApplication(Application):
+        @handler('/:delay')
+        def index(self, request, delay):
+            yield from asyncio.sleep(float(delay or 0), loop=self.loop)
+            return 'Done'
+    
+    loop = asyncio.new_event_loop()
+    slow = SlowApplication(loop)
+    
+    @asyncio.coroutine
+    def skip_head(reader):
+        line = yield from reader.readline()
+        while line!=b'\r\n':
+            line = yield from reader.readline()
+    
+    @asyncio.coroutine
+    def test():
+        server = yield from slow.create_server('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        idle = yield from asyncio.open_connection('127.0.0.1', port, loop=loop)
+        active = yield from asyncio.open_connection('127.0.0.1', port, loop=loop)
+        idle[1].write(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        yield from skip_head(idle[0])
+        assert (yield from idle[0].readexactly(4))==b'Done'
+        active[1].write(b'GET /0.3 HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        yield from asyncio.sleep(0.1, loop=loop)
+        assert len(slow._connections)==2
+        shutdown = asyncio.Task(slow.shutdown(5), loop=loop)
+        # idle connection is closed at once
+        assert (yield from idle[0].read())==b''
+        assert not shutdown.done()
+        # active request is finished, then connection is closed
+        data = yield from active[0].read()
+        assert data.startswith(b'HTTP/1.1 200 OK\r\n')
+        assert b'Connection: close\r\n' in data and data.endswith(b'Done')
+        yield from shutdown
+        assert len(slow._connections)==0
+        try:
+            yield from asyncio.open_connection('127.0.0.1', port, loop=loop)
+        except OSError:
+            pass
+        else:
+            assert False, 'Server accepts connections after shutdown'
+        # connection is aborted when timeout expires
+        server = yield from slow.create_server('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        active = yield from asyncio.open_connection('127.0.0.1', port, loop=loop)
+        active[1].write(b'GET /10 HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        yield from asyncio.sleep(0.1, loop=loop)
+        yield from slow.shutdown(0.1)
+        assert (yield from active[0].read())==b''
+    
+    loop.run_until_complete(test())
+    loop.close()
+
+
+def test_HandlerError():
+    
+    class ErrorApplication(Application):
+        @handler('/')
+        def index(self, request):
+            yield from asyncio.sleep(0.01, loop=self.loop)
+            raise KeyError('missing')
+    
+    loop = asyncio.new_event_loop()
+    app = ErrorApplication(loop)
+    
+    @asyncio.coroutine
+    def test():
+        server = yield from app.create_server('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = yield from asyncio.open_connection('127.0.0.1', port, loop=loop)
+        writer.write(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        data = yield from asyncio.wait_for(reader.read(), 2, loop=loop)
+        assert data.startswith(b'HTTP/1.1 500 Internal Server Error\r\n')
+        yield from asyncio.wait_for(app.shutdown(5), 1, loop=loop)
+    
+    loop.run_until_complete(test())
+    loop.close()
+
+
+def test_Head():
+    
+    class HeadApplication(Application):
+        @handler('/', method=['GET', 'HEAD'])
+        def index(self, request):
+            return 'Hello'
+    
+    loop = asyncio.new_event_loop()
+    app = HeadApplication(loop)
+    
+    @asyncio.coroutine
+    def test():
+        server = yield from app.create_server('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = yield from asyncio.open_connection('127.0.0.1', port, loop=loop)
+        writer.write(b'HEAD / HTTP/1.1\r\n\r\nGET / HTTP/1.1\r\nConnection: close\r\n\r\n')
+        data = yield from reader.read()
+        # response to HEAD request has no body, so next response isn't shifted
+        head, _, rest = data.partition(b'\r\n\r\n')
+        assert b'Content-Length: 5' in head
+        assert rest.startswith(b'HTTP/1.1 200 OK\r\n') and rest.endswith(b'\r\n\r\nHello')
+        yield from app.shutdown(1)
+    
+    loop.run_until_complete(test())
+    loop.close()
+
+
+def test_Limits():
+    
+    class SlowApplication(Application):
+        max_connections = 2
+        max_requests = 1
+        retry_after = 3
+        
+        @handler('/:delay')
+        def index(self, request, delay):
+            yield from asyncio.sleep(float(delay or 0), loop=self.loop)
+            return 'Done'
+    
+    loop = asyncio.new_event_loop()
+    slow = SlowApplication(loop)
+    
+    @asyncio.coroutine
+    def request(port, path):
+        reader, writer = yield from asyncio.open_connection('127.0.0.1', port, loop=loop)
+        writer.write('GET {0} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(path).encode())
+        return reader, writer
+    
+    @asyncio.coroutine
+    def response(reader):
+        status = yield from reader.readline()
+        line = status
+        while line!=b'\r\n':
+            line = yield from reader.readline()
+        return status, (yield from reader.readexactly(4))
+    
+    @asyncio.coroutine
+    def test():
+        server = yield from slow.create_server('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        active = yield from request(port, '/0.3')
+        yield from asyncio.sleep(0.1, loop=loop)
+        assert slow._active_requests==1
+        # queue of requests is saturated
+        shed = yield from request(port, '/')
+        data = yield from shed[0].read()
+        assert data.startswith(b'HTTP/1.1 503 Service Unavailable\r\n')
+        assert b'Retry-After: 3\r\n' in data
+        # too many connections
+        second = yield from asyncio.open_connection('127.0.0.1', port, loop=loop)
+        shed = yield from request(port, '/')
+        data = yield from shed[0].read()
+        assert data.startswith(b'HTTP/1.1 503 Service Unavailable\r\n')
+        second[1].close()
+        yield from asyncio.sleep(0.1, loop=loop)
+        assert (yield from response(active[0]))==(b'HTTP/1.1 200 OK\r\n', b'Done')
+        assert slow._active_requests==0
+        active[1].write(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        assert (yield from response(active[0]))==(b'HTTP/1.1 200 OK\r\n', b'Done')
+        active[1].close()
+        yield from slow.shutdown(1)
+    
+    loop.run_until_complete(test())
+    loop.close()
+
+
+def test_Hooks():
+    
+    class HookApplication(Application):
+        @handler('/:name')
+        def index(self, request, name):
+            return 'Hello, {0}!'.format(name)
+    
+    loop = asyncio.new_event_loop()
+    app = HookApplication(loop)
+    calls = []
+    app.add_hook('before_parse', lambda connection, environ: calls.append(('before_parse', 'PATH_INFO' in environ)))
+    def after_route(connection, request, view, kwargs):
+        calls.append(('after_route', view.__name__))
+        kwargs['name'] = kwargs['name'].upper()
+    app.add_hook('after_route', after_route)
+    app.add_hook('before_handler', lambda connection, request, view, kwargs: calls.append(('before_handler', kwargs['name'])))
+    app.add_hook('after_response', lambda connection, environ, status: calls.append(('after_response', status)))
+    app.add_hook('after_response', lambda connection, environ, status: 1/0)
+    app.add_hook('connection_close', lambda connection: calls.append(('connection_close',)))
+    assert_raises(ValueError, app.add_hook, 'unknown', after_route)
+    
+    @asyncio.coroutine
+    def test():
+        server = yield from app.create_server('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = yield from asyncio.open_connection('127.0.0.1', port, loop=loop)
+        writer.write(b'GET /ivan HTTP/1.1\r\nConnection: close\r\n\r\n')
+        assert (yield from reader.read()).endswith(b'Hello, IVAN!')
+        yield from app.shutdown(1)
+    
+    loop.run_until_complete(test())
+    loop.close()
+    assert calls==[('before_parse', False), ('after_route', 'index'), ('before_handler', 'IVAN'),
+                   ('after_response', 200), ('connection_close',)]
+    app.remove_hook('after_route', after_route)
+    assert 'after_route' not in app.hooks
+
+
 if __name__ == '__main__':
     
     test_Router()
     test_url_for()
+    test_RequestResponse()
+    test_HandlerError()
+    test_Head()
+    test_Shutdown()
+    test_Limits()
+    test_Hooks()
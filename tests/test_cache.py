@@ -0,0 +1,127 @@
+import asyncio
+from aqua.app import Application, handler
+from aqua.cache import ResponseCache, serialize
+
+
+class Timer(object):
+    now = 0.0
+    def __call__(self):
+        return self.now
+
+
+class CachedApplication(Application):
+    calls = 0
+    
+    @handler('/page/:name', cache_ttl=10, vary=('Accept-Language',))
+    def page(self, request, name):
+        CachedApplication.calls += 1
+        yield from asyncio.sleep(0.1, loop=self.loop)
+        return '{0} {1} {2}'.format(name, request.headers.get('Accept-Language'), CachedApplication.calls)
+    
+    @handler('/fresh')
+    def fresh(self, request):
+        CachedApplication.calls += 1
+        return str(CachedApplication.calls)
+
+
+def test_ResponseCache():
+    timer = Timer()
+    cache = ResponseCache(max_entries=2, max_size=10, timer=timer)
+    environ = dict(REQUEST_METHOD='GET', SERVER_PROTOCOL='HTTP/1.1', PATH_INFO='/a', QUERY_STRING='x=1',
+                   HTTP_ACCEPT_LANGUAGE='en')
+    assert cache.lookup(environ) is None
+    key = cache.key(environ, ('Accept-Language',))
+    assert key==('/a', 'x=1', 'en')
+    assert cache.get(key) is None
+    assert cache.put(key, 5, '200 OK', [('Content-Type', 'text/plain')], b'body', 'a')
+    head = b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: 4\r\n'
+    assert serialize('200 OK', [('Content-Type', 'text/plain')], b'body')==head
+    assert cache.lookup(environ)==(head, b'body', 'a')
+    assert cache.lookup(dict(environ, HTTP_ACCEPT_LANGUAGE='de')) is None
+    assert cache.lookup(dict(environ, SERVER_PROTOCOL='HTTP/1.0')) is None
+    assert cache.lookup(dict(environ, REQUEST_METHOD='POST')) is None
+    assert not cache.put(key, 5, '200 OK', [], b'large body!')
+    assert not cache.put(key, 5, '200 OK', [('Set-Cookie', 'a=b')], b'')
+    assert not cache.put(key, 5, '200 OK', [('set-cookie', 'a=b')], b'')
+    assert serialize('200 OK', [('content-length', '4')], b'body')==b'HTTP/1.1 200 OK\r\ncontent-length: 4\r\n'
+    timer.now = 5
+    assert cache.lookup(environ) is None and cache.get(key) is None and len(cache)==0
+    for N in range(3):
+        cache.put(('/b', str(N)), 5, '200 OK', [], b'')
+    assert len(cache)==2 and cache.get(('/b', '0')) is None
+    cache.clear()
+    assert len(cache)==0
+
+
+def test_Dogpile():
+    loop = asyncio.new_event_loop()
+    cache = ResponseCache()
+    
+    @asyncio.coroutine
+    def test():
+        assert (yield from cache.acquire('key', loop))==(None, True)
+        waiter = asyncio.Task(cache.acquire('key', loop), loop=loop)
+        yield from asyncio.sleep(0, loop=loop)
+        assert not waiter.done()
+        cache.put('key', 5, '200 OK', [], b'body')
+        cache.release('key')
+        entry, leader = yield from waiter
+        assert entry[1]==b'body' and not leader
+        # waiter makes response itself if response isn't cached
+        assert (yield from cache.acquire('other', loop))==(None, True)
+        waiter = asyncio.Task(cache.acquire('other', loop), loop=loop)
+        yield from asyncio.sleep(0, loop=loop)
+        cache.release('other')
+        assert (yield from waiter)==(None, False)
+    
+    loop.run_until_complete(test())
+    loop.close()
+
+
+def test_CachedHandler():
+    loop = asyncio.new_event_loop()
+    app = CachedApplication(loop)
+    
+    @asyncio.coroutine
+    def get(port, path, *headers):
+        reader, writer = yield from asyncio.open_connection('127.0.0.1', port, loop=loop)
+        writer.write('GET {0} HTTP/1.1\r\n{1}Connection: close\r\n\r\n'.format(
+            path, ''.join(header+'\r\n' for header in headers)).encode())
+        return (yield from reader.read())
+    
+    @asyncio.coroutine
+    def test():
+        server = yield from app.create_server('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        # concurrent misses call handler once
+        responses = yield from asyncio.gather(*[get(port, '/page/a', 'Accept-Language: en') for N in range(5)], loop=loop)
+        assert CachedApplication.calls==1
+        for data in responses:
+            assert data.startswith(b'HTTP/1.1 200 OK\r\n') and data.endswith(b'\r\n\r\na en 1')
+            assert b'Vary: Accept-Language\r\n' in data
+        assert (yield from get(port, '/page/a', 'Accept-Language: de')).endswith(b'a de 2')
+        assert (yield from get(port, '/page/a?x=1', 'Accept-Language: en')).endswith(b'a en 3')
+        assert (yield from get(port, '/page/a', 'Accept-Language: en')).endswith(b'a en 1')
+        # keep-alive connection gets cached responses
+        reader, writer = yield from asyncio.open_connection('127.0.0.1', port, loop=loop)
+        writer.write(b'GET /page/a HTTP/1.1\r\nAccept-Language: en\r\n\r\n'*2 +
+                     b'GET /fresh HTTP/1.1\r\nConnection: close\r\n\r\n')
+        data = yield from reader.read()
+        assert data.count(b'a en 1')==2 and data.endswith(b'\r\n\r\n4')
+        assert b'Connection: close' not in data.partition(b'a en 1')[0]
+        assert app.response_cache.hits>=6
+        # HTTP/1.0 requests aren't served from cache
+        reader, writer = yield from asyncio.open_connection('127.0.0.1', port, loop=loop)
+        writer.write(b'GET /page/a HTTP/1.0\r\nAccept-Language: en\r\n\r\n')
+        assert (yield from reader.read()).endswith(b'a en 5')
+        yield from app.shutdown(1)
+    
+    loop.run_until_complete(test())
+    loop.close()
+    assert Application(loop).response_cache is None
+
+
+if __name__ == '__main__':
+    test_ResponseCache()
+    test_Dogpile()
+    test_CachedHandler()
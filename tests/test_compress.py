@@ -0,0 +1,155 @@
+import zlib
+import asyncio
+from nose.tools import assert_raises
+from aqua.app import Application, handler
+from aqua.http import Response
+from aqua.compress import accepted_encoding, compressible, compress, Compressor, CompressedBody
+
+TEXT = b'Hello, World! '*1024
+
+
+class CompressApplication(Application):
+    compress_min_size = 1024
+    compress_thread_size = 8*1024
+    
+    @handler('/text')
+    def text(self, request):
+        return Response(app_iter=[TEXT[:4096]], headerlist=[('Content-Type', 'text/plain'), ('ETag', '"abc"')])
+    
+    @handler('/large')
+    def large(self, request):
+        return TEXT.decode()
+    
+    @handler('/lower')
+    def lower(self, request):
+        return Response(app_iter=[TEXT], headerlist=[('content-type', 'text/plain'), ('content-length', str(len(TEXT)))])
+    
+    @handler('/encoded')
+    def encoded(self, request):
+        return Response(app_iter=[TEXT], headerlist=[('Content-Type', 'text/plain'), ('content-encoding', 'identity')])
+    
+    @handler('/small')
+    def small(self, request):
+        return 'Hello'
+    
+    @handler('/binary')
+    def binary(self, request):
+        return TEXT
+    
+    @handler('/stream')
+    def stream(self, request):
+        return Response(app_iter=Chunks([b'first ', b'', b'second']))
+    
+    @handler('/cached', cache_ttl=10)
+    def cached(self, request):
+        return TEXT.decode()
+
+
+class Chunks(object):
+    
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+    
+    def __aiter__(self):
+        return self
+    
+    @asyncio.coroutine
+    def __anext__(self):
+        if not self.chunks:
+            raise StopAsyncIteration
+        return self.chunks.pop(0)
+
+
+def test_AcceptedEncoding():
+    assert accepted_encoding('gzip, deflate', ('br', 'gzip'))=='gzip'
+    assert accepted_encoding('gzip, deflate, br', ('br', 'gzip'))=='br'
+    assert accepted_encoding('gzip;q=1.0, br;q=0.5', ('br', 'gzip'))=='gzip'
+    assert accepted_encoding('GZIP;q=0', ('br', 'gzip')) is None
+    assert accepted_encoding('*', ('br', 'gzip'))=='br'
+    assert accepted_encoding('*;q=0, identity', ('gzip',)) is None
+    assert accepted_encoding('gzip;q=0, *', ('gzip',)) is None
+    assert accepted_encoding('br;q=0, *', ('br', 'gzip'))=='gzip'
+    assert accepted_encoding('', ('gzip',)) is None
+    assert accepted_encoding('gzip;q=x', ('gzip',)) is None
+    assert compressible('text/html; charset=UTF-8') and compressible('application/json')
+    assert not compressible('image/png') and not compressible('application/octet-stream')
+
+
+def test_Compress():
+    assert zlib.decompress(compress(TEXT, 'gzip'), 31)==TEXT
+    assert_raises(ValueError, Compressor, 'lzma')
+    loop = asyncio.new_event_loop()
+    
+    @asyncio.coroutine
+    def read(body):
+        chunks = []
+        while True:
+            try:
+                chunks.append((yield from body.__anext__()))
+            except StopAsyncIteration:
+                break
+        yield from body.aclose()
+        return chunks
+    
+    for app_iter in ([b'first ', b'', b'second'], Chunks([b'first ', b'', b'second'])):
+        chunks = loop.run_until_complete(read(CompressedBody(app_iter, 'gzip')))
+        # every chunk is flushed
+        decompressor = zlib.decompressobj(31)
+        assert decompressor.decompress(chunks[0])==b'first '
+        assert zlib.decompress(b''.join(chunks), 31)==b'first second'
+    loop.close()
+
+
+def test_CompressResponse():
+    loop = asyncio.new_event_loop()
+    app = CompressApplication(loop)
+    
+    @asyncio.coroutine
+    def get(port, path, encoding='gzip, deflate'):
+        reader, writer = yield from asyncio.open_connection('127.0.0.1', port, loop=loop)
+        writer.write('GET {0} HTTP/1.1\r\nAccept-Encoding: {1}\r\nConnection: close\r\n\r\n'.format(
+            path, encoding).encode())
+        head, _, body = (yield from reader.read()).partition(b'\r\n\r\n')
+        return head.decode().split('\r\n')[1:], body
+    
+    @asyncio.coroutine
+    def test():
+        server = yield from app.create_server('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        for path, size in (('/text', 4096), ('/large', len(TEXT))):
+            headers, body = yield from get(port, path)
+            assert 'Content-Encoding: gzip' in headers and 'Vary: Accept-Encoding' in headers
+            assert 'Content-Length: {0}'.format(len(body)) in headers
+            assert zlib.decompress(body, 31)==TEXT[:size]
+            if path=='/text':
+                assert 'ETag: "abc-gzip"' in headers
+        headers, body = yield from get(port, '/text', 'identity')
+        assert 'Content-Encoding: gzip' not in headers and 'Vary: Accept-Encoding' in headers
+        assert body==TEXT[:4096] and 'ETag: "abc"' in headers
+        headers, body = yield from get(port, '/lower')
+        assert 'Content-Encoding: gzip' in headers and 'content-length: {0}'.format(len(TEXT)) not in headers
+        assert zlib.decompress(body, 31)==TEXT
+        for path in ('/small', '/binary', '/encoded'):
+            headers, body = yield from get(port, path)
+            assert 'Content-Encoding: gzip' not in headers
+        headers, body = yield from get(port, '/stream')
+        assert 'Content-Encoding: gzip' in headers
+        assert not any(header.startswith('Content-Length') for header in headers)
+        assert zlib.decompress(body, 31)==b'first second'
+        # cached responses depend on encoding
+        for N in range(2):
+            headers, body = yield from get(port, '/cached')
+            assert zlib.decompress(body, 31)==TEXT
+            headers, body = yield from get(port, '/cached', 'identity')
+            assert body==TEXT
+        assert app.response_cache.hits==2
+        yield from app.shutdown(1)
+    
+    loop.run_until_complete(test())
+    loop.close()
+
+
+if __name__ == '__main__':
+    test_AcceptedEncoding()
+    test_Compress()
+    test_CompressResponse()
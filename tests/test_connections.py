@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import io
 import asyncio
 import aqua.http
 from collections import deque
@@ -114,15 +115,371 @@ def test_RequestProcess():
                          b'Content-Length: text/plain\r\n'
                          b'Content-Length: 13\r\n'
                          b'\r\n'
-                         b'Hello, World!'
                          b'#START_REQUEST#\r\n'
                          b'#BODY_CHUNK#12#50#\r\n'
-                         b'#BODY_CHUNK#12#50#\r\n'
                          b'#BODY_CHUNK#50#50#\r\n'
                          b'HTTP/1.1 200 OK\r\n'
                          b'\r\n'
                          b'#CONNECTION_CLOSED#\r\n')
 
+
+def test_ParseEnviron():
+    environ = aqua.http.parse_environ(b'GET /a%2fb/%41?x=1 HTTP/1.1\r\n'
+                                      b'Host: localhost\r\n'
+                                      b'X-Long: first\r\n'
+                                      b'  second\r\n'
+                                      b'Content-Length: 0\r\n'
+                                      b'\r\n')
+    assert environ['PATH_INFO']=='/a%2Fb/A'
+    assert environ['QUERY_STRING']=='x=1'
+    assert environ['REQUEST_URI']=='/a%2fb/%41?x=1'
+    assert environ['HTTP_HOST']=='localhost'
+    assert environ['HTTP_X_LONG']=='first second'
+    assert environ['CONTENT_LENGTH']=='0'
+    for data in (b'GET / HTTP/2.0\r\n\r\n', b'GET /%zz HTTP/1.1\r\n\r\n', b'GET / HTTP/1.1\r\nHost\r\n\r\n'):
+        try:
+            aqua.http.parse_environ(data)
+        except aqua.http.Error:
+            pass
+        else:
+            assert False, data
+
+
+def test_SplitHeaders():
+    
+    environs = list()
+    loop = asyncio.new_event_loop()
+    conn = aqua.http.Connection(loop)
+    conn.request_handler = lambda connection, environ: environs.append(environ)
+    trans = TestTransport(conn)
+    trans.get_extra_info = lambda name: ('myhost', 8080) if name=='sockname' else ('athost', 9090)
+    conn.connection_made(trans)
+    data = (b'GET /index HTTP/1.1\r\n'
+            b'Host: localhost\r\n'
+            b'\r\n')
+    for i in range(len(data)):
+        conn.data_received(data[i:i+1])
+    conn.timeout = 0
+    assert len(environs)==1
+    assert environs[0]['PATH_INFO']=='/index'
+    assert environs[0]['HTTP_HOST']=='localhost'
+    loop.close()
+
+
+def test_LongHeaders():
+    
+    environs = list()
+    loop = asyncio.new_event_loop()
+    conn = aqua.http.Connection(loop)
+    conn.request_handler = lambda connection, environ: environs.append(environ)
+    trans = TestTransport(conn)
+    trans.get_extra_info = lambda name: ('myhost', 8080) if name=='sockname' else ('athost', 9090)
+    trans.close = lambda: None
+    conn.connection_made(trans)
+    # complete headers which are too long are rejected as well as incomplete ones
+    conn.data_received(b'GET /index HTTP/1.1\r\nX-Long: ' + b'x'*200*1024 + b'\r\n\r\n')
+    conn.timeout = 0
+    assert not environs
+    assert trans._buff.startswith(b'HTTP/1.0 414 Request Too Long\r\n')
+    loop.close()
+
+
+def test_Pipelining():
+    
+    loop = asyncio.new_event_loop()
+    
+    @asyncio.coroutine
+    def request_handler(connection, environ):
+        # the first request is handled longer than others
+        yield from asyncio.sleep(0.05 if environ['PATH_INFO']=='/1' else 0.01, loop=loop)
+        body = environ['PATH_INFO'].encode('ISO-8859-1')
+        if 'wsgi.input' in environ:
+            body += b':' + environ['wsgi.input'].read()
+        connection.response('200 OK', [('Content-Length', str(len(body)))], [body])
+    
+    conn = aqua.http.Connection(loop)
+    conn.request_handler = request_handler
+    trans = TestTransport(conn)
+    trans.get_extra_info = lambda name: ('myhost', 8080) if name=='sockname' else ('athost', 9090)
+    trans.close = lambda: loop.stop()
+    conn.connection_made(trans)
+    conn.data_received(b'GET /1 HTTP/1.1\r\n\r\n'
+                       b'POST /2 HTTP/1.1\r\nContent-Type: text/plain\r\nContent-Length: 4\r\n\r\nbodyGET /3 HTTP/1.1\r\n')
+    conn.data_received(b'Connection: close\r\n\r\n')
+    loop.run_forever()
+    loop.close()
+    assert trans._buff==(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n/1'
+                         b'HTTP/1.1 200 OK\r\nContent-Length: 7\r\n\r\n/2:body'
+                         b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n/3')
+
+
+def test_PipeliningLimit():
+    
+    loop = asyncio.new_event_loop()
+    
+    @asyncio.coroutine
+    def request_handler(connection, environ):
+        yield from asyncio.sleep(0.001, loop=loop)
+        connection.response('200 OK', [], [b'.'])
+    
+    conn = aqua.http.Connection(loop)
+    conn.max_pipelined = 4
+    conn.request_handler = request_handler
+    trans = TestTransport(conn)
+    trans.get_extra_info = lambda name: ('myhost', 8080) if name=='sockname' else ('athost', 9090)
+    trans.close = lambda: loop.stop()
+    paused = []
+    trans.pause_reading = lambda: paused.append(True)
+    trans.resume_reading = lambda: paused.append(False)
+    conn.connection_made(trans)
+    conn.data_received(b'GET / HTTP/1.1\r\n\r\n'*20 + b'GET / HTTP/1.1\r\nConnection: close\r\n\r\n')
+    # requests over limit aren't parsed until queue is handled
+    assert len(conn._queue)==4 and paused==[True]
+    loop.run_forever()
+    loop.close()
+    assert trans._buff.count(b'HTTP/1.1 200 OK\r\n')==21
+    assert paused.count(True)==paused.count(False)>1
+
+
+def test_BodyStream():
+    
+    loop = asyncio.new_event_loop()
+    chunks = list()
+    
+    @asyncio.coroutine
+    def request_handler(connection, environ):
+        stream = connection.body_stream(environ)
+        assert environ['aqua.stream'] is stream
+        assert 'wsgi.input' not in environ
+        while True:
+            data = yield from stream.read()
+            if not data:
+                break
+            chunks.append(data)
+        connection.response('200 OK', [('Connection', 'close')], [])
+    
+    conn = aqua.http.Connection(loop)
+    conn.request_handler = request_handler
+    trans = TestTransport(conn)
+    trans.get_extra_info = lambda name: ('myhost', 8080) if name=='sockname' else ('athost', 9090)
+    trans.close = lambda: loop.stop()
+    trans.paused = 0
+    def pause_reading():
+        trans.paused += 1
+    trans.pause_reading = pause_reading
+    trans.resume_reading = lambda: None
+    conn.connection_made(trans)
+    size = aqua.http.BodyStream.high_water+1
+    
+    @asyncio.coroutine
+    def test_01():
+        conn.data_received('POST /upload HTTP/1.1\r\nContent-Length: {0}\r\n\r\n'.format(size+4).encode('ISO-8859-1'))
+        conn.data_received(b'0123')
+        yield from asyncio.sleep(0.01, loop=loop)
+        conn.data_received(b'0'*size)
+        assert trans.paused==1
+    
+    asyncio.Task(test_01(), loop=loop)
+    loop.run_forever()
+    loop.close()
+    assert chunks==[b'0123', b'0'*size]
+
+
+def test_BodySpooling():
+    
+    environs = list()
+    loop = asyncio.new_event_loop()
+    conn = aqua.http.Connection(loop)
+    conn.body_spool_size = 8
+    conn.max_body_size = 16
+    conn.request_handler = lambda connection, environ: environs.append(environ)
+    trans = TestTransport(conn)
+    trans.get_extra_info = lambda name: ('myhost', 8080) if name=='sockname' else ('athost', 9090)
+    trans.close = lambda: None
+    conn.connection_made(trans)
+    conn.data_received(b'POST / HTTP/1.1\r\nContent-Length: 4\r\n\r\n0123'
+                       b'POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\n0123456789')
+    assert isinstance(environs[0]['wsgi.input'], io.BytesIO)
+    assert environs[0]['wsgi.input'].read()==b'0123'
+    conn.response('200 OK', [], [])
+    assert not isinstance(environs[1]['wsgi.input'], io.BytesIO)
+    assert environs[1]['wsgi.input'].read()==b'0123456789'
+    conn.response('200 OK', [], [])
+    trans._buff = b''
+    conn.data_received(b'POST / HTTP/1.1\r\nContent-Length: 17\r\n\r\n')
+    assert len(environs)==2
+    assert trans._buff==b'HTTP/1.1 413 Request Entity Too Large\r\n\r\n'
+    conn.timeout = 0
+    loop.close()
+
+
+def test_ChunkedTransferCoding():
+    
+    environs = list()
+    loop = asyncio.new_event_loop()
+    conn = aqua.http.Connection(loop)
+    conn.request_handler = lambda connection, environ: environs.append(environ)
+    trans = TestTransport(conn)
+    trans.get_extra_info = lambda name: ('myhost', 8080) if name=='sockname' else ('athost', 9090)
+    trans.close = lambda: None
+    conn.connection_made(trans)
+    data = (b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+            b'4\r\n0123\r\n'
+            b'a;name=value\r\n0123456789\r\n'
+            b'0\r\nTrailer: value\r\n\r\n'
+            b'GET / HTTP/1.1\r\n\r\n')
+    for i in range(0, len(data), 3):
+        conn.data_received(data[i:i+3])
+    assert len(environs)==1
+    assert environs[0]['aqua.complete']==True
+    assert environs[0]['CONTENT_LENGTH']=='14'
+    assert environs[0]['wsgi.input'].read()==b'01230123456789'
+    conn.response('200 OK', [], (data for data in [b'Hello', b'', b', World!']))
+    assert trans._buff==(b'HTTP/1.1 200 OK\r\n'
+                         b'Transfer-Encoding: chunked\r\n'
+                         b'\r\n'
+                         b'5\r\nHello\r\n'
+                         b'8\r\n, World!\r\n'
+                         b'0\r\n\r\n')
+    assert len(environs)==2
+    trans._buff = b''
+    conn.response('200 OK', [], [b'Hello'])
+    assert trans._buff==b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nHello'
+    conn.timeout = 0
+    # chunk size is only hexadecimal digits
+    for size in (b'0x4', b'+4', b'0_4', b' 4', b'-4', b''):
+        conn = aqua.http.Connection(loop)
+        conn.request_handler = lambda connection, environ: connection.response('200 OK', [], [])
+        trans = TestTransport(conn)
+        trans.get_extra_info = lambda name: ('myhost', 8080)
+        trans.close = lambda: None
+        conn.connection_made(trans)
+        conn.data_received(b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n' + size + b'\r\n0123\r\n')
+        assert b'HTTP/1.1 400 Bad Request\r\n' in trans._buff, size
+        conn.timeout = 0
+    loop.close()
+
+
+def test_AsyncBody():
+    
+    loop = asyncio.new_event_loop()
+    
+    class AsyncBody(object):
+        def __init__(self, items):
+            self.items = list(items)
+        
+        @asyncio.coroutine
+        def __anext__(self):
+            yield from asyncio.sleep(0.001, loop=loop)
+            if not self.items:
+                raise aqua.http.StopAsyncIteration
+            return self.items.pop(0)
+    
+    conn = aqua.http.Connection(loop)
+    conn.request_handler = lambda connection, environ: connection.response('200 OK', [], AsyncBody([b'Hello', b', World!']))
+    trans = TestTransport(conn)
+    trans.get_extra_info = lambda name: ('myhost', 8080) if name=='sockname' else ('athost', 9090)
+    trans.close = lambda: loop.stop()
+    conn.connection_made(trans)
+    
+    @asyncio.coroutine
+    def test_01():
+        conn.pause_writing()
+        conn.data_received(b'GET / HTTP/1.1\r\n\r\nGET / HTTP/1.1\r\nConnection: close\r\n\r\n')
+        yield from asyncio.sleep(0.01, loop=loop)
+        # writing waits while buffer is drained
+        assert trans._buff==(b'HTTP/1.1 200 OK\r\n'
+                             b'Transfer-Encoding: chunked\r\n'
+                             b'\r\n'
+                             b'5\r\nHello\r\n')
+        conn.resume_writing()
+    
+    asyncio.Task(test_01(), loop=loop)
+    loop.run_forever()
+    loop.close()
+    assert trans._buff==(b'HTTP/1.1 200 OK\r\n'
+                         b'Transfer-Encoding: chunked\r\n'
+                         b'\r\n'
+                         b'5\r\nHello\r\n'
+                         b'8\r\n, World!\r\n'
+                         b'0\r\n\r\n'
+                         b'HTTP/1.1 200 OK\r\n'
+                         b'\r\n'
+                         b'Hello, World!')
+
+
+def test_ResponseFraming():
+    
+    loop = asyncio.new_event_loop()
+    
+    def request_handler(connection, environ):
+        if environ['PATH_INFO']=='/length':
+            connection.response('200 OK', [('content-length', '5')], [b'Hello'])
+        elif environ['PATH_INFO']=='/chunked':
+            connection.response('200 OK', [('Transfer-Encoding', 'chunked')], iter([b'Hello']))
+        else:
+            connection.response('200 OK', [('connection', 'Close')], [b'Bye'])
+    
+    conn = aqua.http.Connection(loop)
+    conn.request_handler = request_handler
+    trans = TestTransport(conn)
+    trans.get_extra_info = lambda name: ('myhost', 8080) if name=='sockname' else ('athost', 9090)
+    trans.close = lambda: loop.stop()
+    conn.connection_made(trans)
+    conn.data_received(b'GET /length HTTP/1.1\r\n\r\nGET /chunked HTTP/1.1\r\n\r\nGET /close HTTP/1.1\r\n\r\n')
+    loop.run_forever()
+    loop.close()
+    # header names are case-insensitive, transfer coding of handler is replaced
+    assert trans._buff==(b'HTTP/1.1 200 OK\r\ncontent-length: 5\r\n\r\nHello'
+                         b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nHello\r\n0\r\n\r\n'
+                         b'HTTP/1.1 200 OK\r\nconnection: Close\r\n\r\nBye')
+
+
+def test_TimerWheel():
+    loop = asyncio.new_event_loop()
+    wheel = aqua.http.TimerWheel(loop, 0.05)
+    fired = []
+    start = loop.time()
+    for N in range(4):
+        wheel.schedule(N, 0.1, lambda N=N: fired.append((N, loop.time()-start)))
+    wheel.schedule(1, 0.3, lambda: fired.append((1, loop.time()-start)))
+    wheel.cancel(2)
+    wheel.cancel(2)
+    assert len(wheel)==3
+    loop.run_until_complete(asyncio.sleep(0.2))
+    assert sorted(N for N, delay in fired)==[0, 3]
+    assert all(0.1<=delay<0.2 for N, delay in fired)
+    assert len(wheel)==1
+    loop.run_until_complete(asyncio.sleep(0.2))
+    assert [N for N, delay in fired]==[0, 3, 1] or [N for N, delay in fired]==[3, 0, 1]
+    assert len(wheel)==0 and wheel._handle is None
+    
+    # connection uses wheel for its timeouts
+    conn = aqua.http.Connection(loop)
+    conn.timer = wheel
+    trans = TestTransport(conn)
+    trans.get_extra_info = lambda name: ('localhost', 8080)
+    conn.connection_made(trans)
+    assert len(wheel)==1 and conn._timeout[1] is None
+    conn.timeout = 0
+    assert len(wheel)==0
+    conn.timeout = 0.1
+    conn.transport.close = lambda: loop.stop()
+    loop.run_forever()
+    loop.close()
+
+
 if __name__ == '__main__':
     
-    test_RequestProcess()
\ No newline at end of file
+    test_ParseEnviron()
+    test_SplitHeaders()
+    test_LongHeaders()
+    test_Pipelining()
+    test_PipeliningLimit()
+    test_BodyStream()
+    test_BodySpooling()
+    test_ChunkedTransferCoding()
+    test_AsyncBody()
+    test_ResponseFraming()
+    test_RequestProcess()
+    test_TimerWheel()
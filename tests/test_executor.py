@@ -0,0 +1,171 @@
+import os
+import asyncio
+import threading
+from nose.tools import assert_raises
+from webob.exc import HTTPServiceUnavailable
+from aqua.app import Application, handler
+from aqua.executor import HandlerExecutor, PROCESS_POOL
+
+
+class ThreadApplication(Application):
+    metrics_route = '/metrics'
+
+    @handler('/thread', executor='thread')
+    def thread(self, request):
+        return '{0} {1}'.format(threading.current_thread() is threading.main_thread(), self is not None)
+
+    @handler('/loop')
+    def loop_handler(self, request):
+        return str(threading.current_thread() is threading.main_thread())
+
+    @handler('/args/:view/:executor', executor='thread')
+    def args(self, request, view, executor):
+        return view+executor
+
+
+class DefaultExecutor(Application):
+    executor = 'thread'
+
+    @handler('/')
+    def index(self, request):
+        yield from asyncio.sleep(0, loop=self.loop)
+        return str(threading.current_thread() is threading.main_thread())
+
+
+class ProcessApplication(Application):
+    metrics_route = '/metrics'
+
+    @handler('/process/:name', executor='process')
+    def process(self, request, name):
+        return '{0} {1} {2}'.format(name, str(os.getpid())!=request.environ['aqua.test_pid'], self)
+
+    @handler('/echo', 'POST', executor='process')
+    def echo(self, request):
+        return request.body.upper()
+
+
+@asyncio.coroutine
+def request(loop, port, data):
+    reader, writer = yield from asyncio.open_connection('127.0.0.1', port, loop=loop)
+    writer.write(data)
+    return (yield from reader.read())
+
+
+def get(loop, port, path):
+    return request(loop, port, 'GET {0} HTTP/1.1\r\nConnection: close\r\n\r\n'.format(path).encode())
+
+
+def test_HandlerExecutor():
+    loop = asyncio.new_event_loop()
+    executor = HandlerExecutor('thread', max_workers=1, max_queue=1, retry_after=5)
+    event = threading.Event()
+
+    @asyncio.coroutine
+    def test():
+        first = asyncio.Task(executor.run(loop, event.wait), loop=loop)
+        second = asyncio.Task(executor.run(loop, lambda: 'done'), loop=loop)
+        yield from asyncio.sleep(0.05, loop=loop)
+        assert executor.pending==2 and executor.queue_depth==1
+        try:
+            yield from executor.run(loop, lambda: None)
+        except HTTPServiceUnavailable as exc:
+            assert exc.headers['Retry-After']=='5'
+        else:
+            assert False, 'full queue accepts call'
+        finally:
+            event.set()
+        assert (yield from first) is True
+        assert (yield from second)=='done'
+        try:
+            yield from executor.run(loop, int, 'x')
+        except ValueError:
+            pass
+        stats = executor.stats()
+        assert stats['completed']==2 and stats['rejected']==1 and stats['max_queue_depth']==1
+        assert stats['pending']==0 and stats['time']['count']==3
+
+    loop.run_until_complete(test())
+    executor.shutdown()
+    loop.close()
+    assert_raises(ValueError, HandlerExecutor, 'fiber')
+
+
+def test_ThreadHandlers():
+    loop = asyncio.new_event_loop()
+    app = ThreadApplication(loop)
+
+    @asyncio.coroutine
+    def test():
+        server = yield from app.create_server('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        assert (yield from get(loop, port, '/thread')).endswith(b'\r\n\r\nFalse True')
+        assert (yield from get(loop, port, '/loop')).endswith(b'\r\n\r\nTrue')
+        assert (yield from get(loop, port, '/args/a/b')).endswith(b'\r\n\r\nab')
+        assert app.executors['thread'].completed==2
+        data = yield from get(loop, port, '/metrics')
+        assert b'aqua_executor_queue_depth{executor="thread"} 0\n' in data
+        assert b'aqua_executor_pending{executor="thread"} 0\n' in data
+        yield from app.shutdown(1)
+        # generator handler runs in event loop despite default executor
+        default = DefaultExecutor(loop)
+        server = yield from default.create_server('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        assert (yield from get(loop, port, '/')).endswith(b'\r\n\r\nTrue')
+        yield from default.shutdown(1)
+
+    loop.run_until_complete(test())
+    loop.close()
+
+    class GeneratorExecutor(Application):
+        @handler('/', executor='thread')
+        def index(self, request):
+            yield from asyncio.sleep(0, loop=self.loop)
+            return 'index'
+
+    class CoroutineExecutor(Application):
+        @handler('/', executor='thread')
+        @asyncio.coroutine
+        def index(self, request):
+            return 'index'
+
+    class UnknownExecutor(Application):
+        @handler('/', executor='fiber')
+        def index(self, request):
+            return 'index'
+
+    assert_raises(ValueError, CoroutineExecutor, loop)
+    assert_raises(ValueError, GeneratorExecutor, loop)
+    assert_raises(ValueError, UnknownExecutor, loop)
+
+
+def test_ProcessHandlers():
+    loop = asyncio.new_event_loop()
+    if not PROCESS_POOL:
+        assert_raises(ValueError, ProcessApplication, loop)
+        loop.close()
+        return
+    app = ProcessApplication(loop)
+    app.add_hook('before_parse', lambda connection, environ: environ.update({'aqua.test_pid': str(os.getpid())}))
+
+    @asyncio.coroutine
+    def test():
+        server = yield from app.create_server('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        responses = yield from asyncio.gather(*[get(loop, port, '/process/{0}'.format(N)) for N in range(4)], loop=loop)
+        for N, data in enumerate(responses):
+            assert data.endswith('\r\n\r\n{0} True None'.format(N).encode())
+        data = yield from request(loop, port, b'POST /echo HTTP/1.1\r\nContent-Length: 5\r\nConnection: close\r\n\r\nhello')
+        assert data.endswith(b'\r\n\r\nHELLO')
+        assert app.executors['process'].completed==5
+        data = yield from get(loop, port, '/metrics')
+        assert b'aqua_executor_queue_depth{executor="process"} 0\n' in data
+        yield from app.shutdown(1)
+
+    loop.run_until_complete(test())
+    loop.close()
+
+
+if __name__ == '__main__':
+    test_HandlerExecutor()
+    test_ThreadHandlers()
+    test_ProcessHandlers()
@@ -0,0 +1,100 @@
+import asyncio
+from aqua.app import Application, handler
+from aqua.metrics import Histogram, Metrics, RequestStats
+
+
+class MetricsApplication(Application):
+    metrics_route = '/metrics'
+    
+    @handler('/hello/:name', name='hello')
+    def hello(self, request, name):
+        return 'Hello, {0}!'.format(name)
+
+
+def test_Histogram():
+    histogram = Histogram(unit=1, precision=4)
+    assert histogram.percentile(50) is None and histogram.mean is None
+    for value in range(1, 101):
+        histogram.record(value)
+    assert (histogram.count, histogram.min, histogram.max, histogram.total)==(100, 1, 100, 5050)
+    assert histogram.percentile(0)==1
+    assert histogram.percentile(10)==10
+    # relative error of large values is bounded by precision
+    assert 50<=histogram.percentile(50)<=50*(1+2**-3)
+    assert 99<=histogram.percentile(99)<=100
+    assert histogram.percentile(100)==100
+    for value in range(1<<20):
+        assert histogram._index(value)<=histogram._index(value+1)
+        assert histogram._value(histogram._index(value))>=value
+    histogram = Histogram()
+    histogram.record(0.0015)
+    histogram.record(0.5)
+    summary = histogram.summary()
+    assert summary['count']==2 and summary['max']==0.5
+    assert 0.0015<=summary['p50']<=0.0016 and summary['p99.9']==0.5
+
+
+def test_Metrics():
+    metrics = Metrics()
+    stats = RequestStats()
+    stats.route, stats.status, stats.bytes_in, stats.bytes_out = 'index', 200, 100, 1000
+    stats.parse_time, stats.route_time, stats.handler_time = 0.0001, 0.00001, 0.01
+    metrics.record(stats)
+    metrics.record(stats)
+    stats = RequestStats()
+    stats.status = 400
+    metrics.record(stats)
+    snapshot = metrics.snapshot()
+    assert snapshot['index']['requests']==2 and snapshot['index']['statuses']=={200: 2}
+    assert (snapshot['index']['bytes_in'], snapshot['index']['bytes_out'])==(200, 2000)
+    assert snapshot['index']['handler_time']['count']==2
+    assert snapshot['']['statuses']=={400: 1} and snapshot['']['handler_time']['count']==0
+    text = metrics.prometheus()
+    assert 'aqua_requests_total{route="index",status="200"} 2\n' in text
+    assert 'aqua_requests_total{route="",status="400"} 1\n' in text
+    assert 'aqua_sent_bytes_total{route="index"} 2000\n' in text
+    assert 'aqua_handler_seconds_count{route="index"} 2\n' in text
+    assert 'aqua_handler_seconds{route="",quantile="0.5"} NaN\n' in text
+    assert '# TYPE aqua_parse_seconds summary\n' in text
+    metrics.reset()
+    assert metrics.snapshot()=={}
+
+
+def test_ApplicationMetrics():
+    loop = asyncio.new_event_loop()
+    app = MetricsApplication(loop)
+    
+    @asyncio.coroutine
+    def test():
+        server = yield from app.create_server('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = yield from asyncio.open_connection('127.0.0.1', port, loop=loop)
+        writer.write(b'GET /missing HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        assert (yield from reader.read()).startswith(b'HTTP/1.1 404 Not Found\r\n')
+        reader, writer = yield from asyncio.open_connection('127.0.0.1', port, loop=loop)
+        writer.write(b'GET /hello/ivan HTTP/1.1\r\nHost: localhost\r\n\r\n'
+                     b'GET /metrics HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+        data = yield from reader.read()
+        assert data.count(b'HTTP/1.1 200 OK\r\n')==2
+        assert b'Content-Type: text/plain; version=0.0.4; charset=UTF-8\r\n' in data
+        assert b'aqua_requests_total{route="hello",status="200"} 1\n' in data
+        assert b'aqua_requests_total{route="",status="404"} 1\n' in data
+        yield from app.shutdown(1)
+    
+    loop.run_until_complete(test())
+    loop.close()
+    snapshot = app.metrics.snapshot()
+    hello = snapshot['hello']
+    assert hello['requests']==1 and hello['statuses']=={200: 1}
+    assert hello['bytes_in']==len(b'GET /hello/ivan HTTP/1.1\r\nHost: localhost\r\n\r\n')
+    assert hello['bytes_out']>len(b'Hello, ivan!')
+    assert hello['parse_time']['count']==1 and hello['route_time']['count']==1
+    assert hello['handler_time']['count']==1
+    assert snapshot['metrics_handler']['requests']==1
+    assert Application(asyncio.new_event_loop()).metrics is None
+
+
+if __name__ == '__main__':
+    test_Histogram()
+    test_Metrics()
+    test_ApplicationMetrics()
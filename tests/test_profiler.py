@@ -0,0 +1,87 @@
+import shutil
+import pstats
+import asyncio
+import tempfile
+from nose.tools import assert_raises
+from aqua.app import Application, handler
+from aqua.profiler import SlowRequestProfiler
+
+
+class SlowApplication(Application):
+    
+    @handler('/:delay')
+    def index(self, request, delay):
+        yield from asyncio.sleep(float(delay or 0), loop=self.loop)
+        return 'Done'
+
+
+def run(app, *paths):
+    @asyncio.coroutine
+    def test():
+        server = yield from app.create_server('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        for path in paths:
+            reader, writer = yield from asyncio.open_connection('127.0.0.1', port, loop=app.loop)
+            writer.write('GET {0} HTTP/1.1\r\nConnection: close\r\n\r\n'.format(path).encode())
+            assert (yield from reader.read()).endswith(b'Done')
+        yield from app.shutdown(1)
+    app.loop.run_until_complete(test())
+
+
+def test_StackProfiler():
+    directory = tempfile.mkdtemp()
+    loop = asyncio.new_event_loop()
+    try:
+        app = SlowApplication(loop)
+        assert_raises(ValueError, SlowRequestProfiler, app, mode='unknown')
+        profiler = SlowRequestProfiler(app, threshold=0.2, directory=directory)
+        profiler.interval = 0.05
+        run(app, '/', '/0.5', '/0.01')
+        assert len(profiler.files)==1
+        with open(profiler.files[0]) as dump:
+            text = dump.read()
+        assert text.startswith('GET /0.5 200 ')
+        assert text.count('Sample at ')>=2 and 'in index' in text
+        profiler.close()
+        assert app.hooks=={}
+    finally:
+        loop.close()
+        shutil.rmtree(directory)
+
+
+def test_CProfileProfiler():
+    directory = tempfile.mkdtemp()
+    loop = asyncio.new_event_loop()
+    try:
+        app = SlowApplication(loop)
+        profiler = SlowRequestProfiler(app, threshold=0.2, directory=directory, mode='cprofile')
+        run(app, '/', '/0.3')
+        assert len(profiler.files)==1 and profiler.files[0].endswith('.prof')
+        assert pstats.Stats(profiler.files[0]).total_calls>0
+        # profiling is stopped when client drops connection
+        @asyncio.coroutine
+        def drop():
+            server = yield from app.create_server('127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = yield from asyncio.open_connection('127.0.0.1', port, loop=loop)
+            writer.write(b'GET /0.3 HTTP/1.1\r\n\r\n')
+            yield from asyncio.sleep(0.1, loop=loop)
+            assert profiler._profiled is not None
+            writer.close()
+            yield from asyncio.sleep(0.1, loop=loop)
+            assert profiler._profiled is None
+            yield from asyncio.sleep(0.3, loop=loop)
+            yield from app.shutdown(1)
+        loop.run_until_complete(drop())
+        count = len(profiler.files)
+        run(app, '/0.3')
+        assert len(profiler.files)==count+1
+        profiler.close()
+    finally:
+        loop.close()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    test_StackProfiler()
+    test_CProfileProfiler()
@@ -72,6 +72,71 @@ def test_RouteResolve():
         'sub:user': [('/sub/user', 'name')],
     }
 
+
+def test_TypedRoutes():
+    router = TraversalRouter()
+    router.add_route('/item/:id:int', 'GET', Test.route_0, name='item')
+    router.add_route('/price/:low:float/:high:float', 'GET', Test.route_0, name='price')
+    router.add_route('/files/:bucket/*path', 'GET', Test.route_1, name='files')
+    assert_raises(ValueError, router.add_route, '/bad/*path/:name', 'GET', Test.route_0)
+    assert_raises(ValueError, router.add_route, '/bad/:name/static', 'GET', Test.route_0)
+    assert_raises(ValueError, router.add_route, '/bad/:name:unknown', 'GET', Test.route_0)
+    
+    assert router.route('/item/7', 'GET')==(Test.route_0, {'id':7})
+    assert router.route('/item', 'GET')==(Test.route_0, {'id':None})
+    assert_raises(HTTPNotFound, router.route, '/item/seven', 'GET')
+    assert_raises(HTTPNotFound, router.route, '/item/7/0', 'GET')
+    assert router.route('/price/1.5', 'GET')==(Test.route_0, {'low':1.5, 'high':None})
+    assert router.route('/files/b/a/b/c.txt', 'GET')==(Test.route_1, {'bucket':'b', 'path':'a/b/c.txt'})
+    assert router.route('/files/b', 'GET')==(Test.route_1, {'bucket':'b', 'path':None})
+    assert_raises(HTTPMethodNotAllowed, router.route, '/files', 'POST')
+    assert router._views['files']==[('/files', 'bucket', 'path')]
+
+
+def test_UrlFor():
+    router = TraversalRouter()
+    router.add_route('/', 'GET', Test.route_0, name='index')
+    router.add_route('/pages/:page', 'GET', Test.route_0, name='index')
+    router.add_route('/item/:id:int/:title', 'GET', Test.route_0, name='item')
+    router.add_route('/files/:bucket/*path', 'GET', Test.route_1, name='files')
+    sub_router = TraversalRouter()
+    sub_router.add_route('/files/*path', 'GET', Test.route_1, name='files')
+    router.update('/sub', sub_router)
+    
+    assert router.url_for('index')=='/'
+    assert router.url_for('index', page='about')=='/pages/about'
+    assert router.url_for('item', id=7)=='/item/7'
+    assert router.url_for('item', id=7, title=None)=='/item/7'
+    assert router.url_for('item', id=7, title='a b/c?')=='/item/7/a%20b%2Fc%3F'
+    assert router.url_for('item', title='a') is None
+    assert router.url_for('item', id=7, name='a') is None
+    assert router.url_for('files', bucket='b', path='a/b c.txt')=='/files/b/a/b%20c.txt'
+    assert router.url_for('sub:files', path='a/b.txt')=='/sub/files/a/b.txt'
+    assert router.url_for('sub:files')=='/sub/files'
+
+
+def test_RouteCache():
+    router = TraversalRouter(cache_size=2)
+    router.add_route('/user/:name', 'GET', Test.route_1, name='user')
+    assert router.route('/user/ivan', 'GET')==(Test.route_1, {'name':'ivan'})
+    view, kwargs = router.route('/user/ivan', 'GET')
+    kwargs['name'] = 'petr'
+    assert router.route('/user/ivan', 'GET')==(Test.route_1, {'name':'ivan'})
+    assert (router.cache_hits, router.cache_misses)==(2, 1)
+    assert_raises(HTTPNotFound, router.route, '/article', 'GET')
+    assert_raises(HTTPNotFound, router.route, '/article', 'GET')
+    assert_raises(HTTPMethodNotAllowed, router.route, '/user', 'POST')
+    assert (router.cache_hits, router.cache_misses)==(3, 3)
+    assert len(router._cache)==2
+    assert ('/user/ivan', 'GET') not in router._cache
+    router.add_route('/article', 'GET', Test.route_0, name='article')
+    assert len(router._cache)==0
+    assert router.route('/article', 'GET')==(Test.route_0, {})
+
+
 if __name__ == '__main__':
     test_RouteAdd()
-    test_RouteResolve()
\ No newline at end of file
+    test_RouteResolve()
+    test_TypedRoutes()
+    test_UrlFor()
+    test_RouteCache()
\ No newline at end of file
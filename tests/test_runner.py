@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import signal
+import socket
+import subprocess
+from nose.tools import assert_raises
+from aqua.app import Application, handler
+from aqua.runner import load_app
+
+class HelloApplication(Application):
+    
+    @handler('/')
+    def index(self, request):
+        return str(os.getpid())
+
+
+class BrokenApplication(Application):
+    
+    def __init__(self, loop):
+        raise RuntimeError('Broken application')
+
+
+def get(port):
+    """ Returns body of response to GET request or None if server isn't available. """
+    data = b''
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=5) as sock:
+            sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+    except OSError:
+        # connection is reset if it's accepted by killed worker
+        return None
+    head, _, body = data.partition(b'\r\n\r\n')
+    assert head.startswith(b'HTTP/1.1 200 OK')
+    return body.decode()
+
+
+def wait_pids(port, count, exclude=()):
+    """ Returns set of pids of workers which answered. """
+    pids = set()
+    deadline = time.time()+20
+    while len(pids)<count and time.time()<deadline:
+        pid = get(port)
+        if pid is None or pid in exclude:
+            time.sleep(0.1)
+        else:
+            pids.add(pid)
+    return pids
+
+
+def test_LoadApp():
+    assert load_app('test_runner:HelloApplication').__name__=='HelloApplication'
+    assert load_app('aqua.runner:Runner.run').__name__=='run'
+    assert_raises(ValueError, load_app, 'test_runner')
+    assert_raises(ImportError, load_app, 'test_runner_missing:App')
+
+
+def test_Runner():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([root, os.path.join(root, 'tests'), env.get('PYTHONPATH', '')])
+    process = subprocess.Popen([sys.executable, '-m', 'aqua.runner', '--port', str(port), '--workers', '2',
+                                '--log-level', 'ERROR', 'test_runner:HelloApplication'], env=env)
+    try:
+        pids = wait_pids(port, 2)
+        assert len(pids)==2
+        # killed worker is started again
+        os.kill(int(pids.pop()), signal.SIGKILL)
+        assert len(wait_pids(port, 1, pids))==1
+        # restart replaces all workers
+        old_pids = wait_pids(port, 2)
+        process.send_signal(signal.SIGHUP)
+        assert len(wait_pids(port, 1, old_pids))==1
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=40)==0
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def test_StartError():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([root, os.path.join(root, 'tests'), env.get('PYTHONPATH', '')])
+    # master stops instead of starting failed workers again
+    process = subprocess.Popen([sys.executable, '-m', 'aqua.runner', '--port', '0', '--workers', '2',
+                                '--log-level', 'CRITICAL', 'test_runner:BrokenApplication'], env=env)
+    try:
+        assert process.wait(timeout=20)==3
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+if __name__ == '__main__':
+    test_LoadApp()
+    test_Runner()
+    test_StartError()
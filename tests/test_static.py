@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import os
+import asyncio
+import tempfile
+import aqua.http
+from nose.tools import assert_raises
+from webob.exc import HTTPNotFound
+from aqua.http import Request, FileWrapper
+from aqua.static import StaticFiles, FileCache, parse_range
+
+path = tempfile.mkdtemp()
+with open(os.path.join(path, 'hello.txt'), 'wb') as f:
+    f.write(b'Hello, World!')
+os.mkdir(os.path.join(path, 'dir'))
+files = StaticFiles(path)
+
+
+def request(**environ):
+    return Request.blank('/', environ=environ)
+
+
+def test_ParseRange():
+    assert parse_range('bytes=0-4', 13)==(0, 5)
+    assert parse_range('bytes=7-', 13)==(7, 6)
+    assert parse_range('bytes=-6', 13)==(7, 6)
+    assert parse_range('bytes=7-100', 13)==(7, 6)
+    assert parse_range('bytes=13-', 13)==()
+    assert parse_range('bytes=0-1,3-4', 13) is None
+    assert parse_range('items=0-4', 13) is None
+    assert parse_range('bytes=4-0', 13) is None
+
+
+def test_StaticFiles():
+    response = files(request(), 'hello.txt')
+    assert response.status=='200 OK'
+    assert response.content_type=='text/plain'
+    assert response.content_length==13
+    assert isinstance(response.app_iter, FileWrapper)
+    assert b''.join(response.app_iter)==b'Hello, World!'
+    response.app_iter.close()
+    etag = response.headers['ETag']
+    
+    response = files(request(HTTP_IF_NONE_MATCH=etag), 'hello.txt')
+    assert response.status=='304 Not Modified'
+    response = files(request(HTTP_IF_MODIFIED_SINCE=response.headers['Last-Modified']), 'hello.txt')
+    assert response.status=='304 Not Modified'
+    
+    response = files(request(HTTP_RANGE='bytes=7-'), 'hello.txt')
+    assert response.status=='206 Partial Content'
+    assert response.headers['Content-Range']=='bytes 7-12/13'
+    assert b''.join(response.app_iter)==b'World!'
+    response.app_iter.close()
+    response = files(request(HTTP_RANGE='bytes=7-', HTTP_IF_RANGE='"other"'), 'hello.txt')
+    assert response.status=='200 OK'
+    response.app_iter.close()
+    response = files(request(HTTP_RANGE='bytes=20-'), 'hello.txt')
+    assert response.status=='416 Requested Range Not Satisfiable'
+    
+    assert_raises(HTTPNotFound, files, request(), 'foo.txt')
+    assert_raises(HTTPNotFound, files, request(), 'dir')
+    assert_raises(HTTPNotFound, files, request(), '../hello.txt')
+    assert_raises(HTTPNotFound, files, request(), None)
+
+
+def test_FileCache():
+    now = [0]
+    cache = FileCache(max_entries=2, ttl=5, timer=lambda: now[0])
+    cached = StaticFiles(path, cache)
+    with open(os.path.join(path, 'other.txt'), 'wb') as f:
+        f.write(b'Other')
+    
+    first = cached(request(), 'hello.txt')
+    second = cached(request(HTTP_RANGE='bytes=7-'), 'hello.txt')
+    assert len(cache)==1
+    assert first.app_iter.filelike.fileno()==second.app_iter.filelike.fileno()
+    assert b''.join(second.app_iter)==b'World!'
+    assert b''.join(first.app_iter)==b'Hello, World!'
+    info = cache.get((path, 'hello.txt'), None)
+    assert info.etag==first.headers['ETag']
+    
+    # file is closed only after all responses are finished
+    cached(request(), 'other.txt').app_iter.close()
+    cached(request(), 'dir/../other.txt').app_iter.close()
+    assert len(cache)==2
+    assert info._discarded
+    os.fstat(first.app_iter.filelike.fileno())
+    first.app_iter.close()
+    second.app_iter.close()
+    assert_raises(OSError, os.fstat, info.fd)
+    
+    # expired file is opened again
+    info = cache.get((path, 'other.txt'), None)
+    now[0] = 10
+    assert cached(request(HTTP_IF_NONE_MATCH=info.etag), 'other.txt').status=='304 Not Modified'
+    assert cache.get((path, 'other.txt'), None) is not info
+    assert info._discarded
+    assert_raises(HTTPNotFound, cached, request(), 'foo.txt')
+    assert len(cache)==2
+    cache.clear()
+    assert len(cache)==0
+    
+    # file which cannot be opened isn't looked up again until entry expires
+    lookups = []
+    def missing():
+        lookups.append(now[0])
+        return os.path.join(path, 'hello.txt.br')
+    assert_raises(OSError, cache.get, (path, 'hello.txt.br'), missing)
+    assert_raises(OSError, cache.get, (path, 'hello.txt.br'), missing)
+    assert lookups==[10] and len(cache)==1
+    now[0] = 20
+    assert_raises(OSError, cache.get, (path, 'hello.txt.br'), missing)
+    assert lookups==[10, 20]
+    cache.clear()
+
+
+def test_SendFile():
+    
+    class TestTransport(object):
+        def __init__(self):
+            self._buff = b''
+        def write(self, data):
+            self._buff += data
+        def close(self):
+            loop.stop()
+        def get_extra_info(self, name):
+            return ('localhost', 8080)
+    
+    loop = asyncio.new_event_loop()
+    conn = aqua.http.Connection(loop)
+    conn.request_handler = lambda connection, environ: connection.response('200 OK', [],
+            FileWrapper(open(os.path.join(path, 'hello.txt'), 'rb'), 4, 2, 9))
+    trans = TestTransport()
+    conn.connection_made(trans)
+    conn.data_received(b'GET / HTTP/1.1\r\n\r\n'
+                       b'GET / HTTP/1.1\r\nConnection: close\r\n\r\n')
+    loop.run_forever()
+    loop.close()
+    assert trans._buff==(b'HTTP/1.1 200 OK\r\nContent-Length: 9\r\n\r\nllo, Worl'
+                         b'HTTP/1.1 200 OK\r\n\r\nllo, Worl')
+
+
+def test_Precompressed():
+    with open(os.path.join(path, 'hello.txt.gz'), 'wb') as f:
+        f.write(b'gzip')
+    precompressed = StaticFiles(path, precompressed=True)
+    response = precompressed(request(HTTP_ACCEPT_ENCODING='gzip, deflate, br'), 'hello.txt')
+    assert response.headers['Content-Encoding']=='gzip' and response.content_type=='text/plain'
+    assert response.headers['Vary']=='Accept-Encoding' and response.content_length==4
+    assert b''.join(response.app_iter)==b'gzip'
+    response.app_iter.close()
+    for environ in (dict(), dict(HTTP_ACCEPT_ENCODING='br')):
+        response = precompressed(request(**environ), 'hello.txt')
+        assert 'Content-Encoding' not in response.headers and response.content_length==13
+        assert response.headers['Vary']=='Accept-Encoding'
+        response.app_iter.close()
+    response = files(request(HTTP_ACCEPT_ENCODING='gzip'), 'hello.txt')
+    assert 'Content-Encoding' not in response.headers and 'Vary' not in response.headers
+    response.app_iter.close()
+    assert_raises(HTTPNotFound, precompressed, request(HTTP_ACCEPT_ENCODING='gzip'), 'missing.txt')
+    os.unlink(os.path.join(path, 'hello.txt.gz'))
+
+
+if __name__ == '__main__':
+    test_ParseRange()
+    test_StaticFiles()
+    test_FileCache()
+    test_SendFile()
+    test_Precompressed()